@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 
+from decouple import Csv, config
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -41,7 +43,6 @@ INSTALLED_APPS = [
     "store_products",
     "drf_spectacular",
     "drf_spectacular_sidecar",
-    # "drf_yasg",
 ]
 REST_FRAMEWORK = {
     "DEFAULT_SCHEMA_CLASS": "drf_spectacular.openapi.AutoSchema",
@@ -52,9 +53,18 @@ SPECTACULAR_SETTINGS = {
     "VERSION": "1.0.0",
     "SERVE_INCLUDE_SCHEMA": False,
 }
+# OpenAPI document written at build time with
+# `manage.py spectacular --file openapi.yml`. When unset the schema is
+# generated on the first request to /api/schema/.
+OPENAPI_SCHEMA_FILE = config("OPENAPI_SCHEMA_FILE", default=None)
 
 
 MIDDLEWARE = [
+    "store_products.middleware.RequestMetricsMiddleware",
+    "store_products.compression.CompressionMiddleware",
+    "store_products.throttling.ThrottleMiddleware",
+    "store_products.sql_profiler.SQLProfilerMiddleware",
+    "store_products.db_routers.ReplicaPinningMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -64,6 +74,80 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
+# Per-request timing, served at /api/metrics/. LOW_OVERHEAD only records wall
+# time per route, without query counting or the Server-Timing header.
+REQUEST_METRICS = {
+    "LOW_OVERHEAD": False,
+}
+
+# Response compression (store_products/compression.py): gzip, plus zstd and
+# brotli when their packages are installed. Bodies under MIN_SIZE bytes are
+# sent uncompressed; up to CACHE_MAX_BYTES of compressed bodies are reused
+# for identical responses.
+RESPONSE_COMPRESSION = {
+    "MIN_SIZE": 1024,
+    "LEVELS": {"zstd": 3, "br": 4, "gzip": 6},
+    "CACHE_MAX_BYTES": 32 * 1024 * 1024,
+}
+
+# Per-client rate limits (store_products/throttling.py). Each client gets
+# RATE tokens per second up to BURST; a request costs its route's COST, so
+# the unpaginated list endpoints drain the bucket ten times faster. Set
+# CACHE_ALIAS to share buckets between worker processes.
+THROTTLE = {
+    "ENABLED": config("THROTTLE_ENABLED", default=True, cast=bool),
+    "DEFAULT": {"RATE": 10.0, "BURST": 100},
+    "ROUTES": {
+        "api/products/": {"COST": 10},
+        "api/products/batch/": {"COST": 5},
+        "api/orders/": {"COST": 10},
+    },
+    "TRUSTED_PROXIES": config("THROTTLE_TRUSTED_PROXIES", default=0, cast=int),
+    "CACHE_ALIAS": None,
+}
+
+# Sampling SQL profiler, report at /admin/sql-profile/. Queries slower than
+# SLOW_QUERY_MS are logged on every request; SAMPLE_RATE of the requests
+# feed the per-endpoint fingerprint tables.
+SQL_PROFILER = {
+    "SAMPLE_RATE": 0.01,
+    "SLOW_QUERY_MS": 100,
+    "TOP_N": 20,
+}
+
+# Admin bulk actions update at most this many rows per transaction, keeping
+# each write lock short; 0 runs every action as a single UPDATE.
+ADMIN_BULK_CHUNK_SIZE = 5000
+
+# Most product IDs one /api/products/batch/ request may ask for
+PRODUCT_BATCH_MAX_IDS = 500
+
+# Transactional outbox (store_products/outbox.py). relay_outbox delivers the
+# events to every sink here; add a sink per downstream consumer.
+OUTBOX = {
+    "SINKS": {
+        "log": {"BACKEND": "store_products.outbox.LoggingSink"},
+        # "search": {
+        #     "BACKEND": "store_products.outbox.JsonLinesSink",
+        #     "OPTIONS": {"path": BASE_DIR / "logs" / "outbox.jsonl"},
+        # },
+    },
+    "BATCH_SIZE": 500,
+    "POLL_INTERVAL": 1.0,
+}
+
+# Server-sent order status streams (store_products/order_events.py), served
+# by the ASGI application
+ORDER_EVENTS = {
+    "HEARTBEAT_SECONDS": 15,
+    "BUFFER_SIZE": 32,
+    "RETRY_MS": 3000,
+}
+
+# /api/products/changes/ holds back writes this recent, so transactions
+# committing a little out of timestamp order are not skipped by replicas
+PRODUCT_CHANGES_SETTLE_SECONDS = 5
+
 ROOT_URLCONF = "ecommerce.urls"
 
 TEMPLATES = [
@@ -88,13 +172,104 @@ WSGI_APPLICATION = "ecommerce.wsgi.application"
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
+# DB_PROFILE selects the database tuning:
+# - "development": SQLite defaults, a new connection per request.
+# - "production": WAL journal, synchronous=NORMAL, busy timeout, memory
+#   mapped I/O and a larger page cache on every new connection; persistent
+#   connections with health checks; write transactions start IMMEDIATE so
+#   concurrent writers queue on the busy timeout instead of failing with
+#   "database is locked" when upgrading a read lock.
+DB_PROFILE = config("DB_PROFILE", default="development")
+DB_NAME = config("DB_NAME", default=str(BASE_DIR / "db.sqlite3"))
+
+SQLITE_PRODUCTION_OPTIONS = {
+    # Seconds to wait for a lock, also sets SQLite's busy timeout
+    "timeout": config("DB_BUSY_TIMEOUT", default=20, cast=int),
+    "transaction_mode": "IMMEDIATE",
+    "init_command": (
+        "PRAGMA journal_mode=WAL;"
+        "PRAGMA synchronous=NORMAL;"
+        f"PRAGMA mmap_size={config('DB_MMAP_SIZE', default=268435456, cast=int)};"
+        # Negative values are KiB: 64 MiB of page cache per connection
+        f"PRAGMA cache_size={config('DB_CACHE_SIZE', default=-65536, cast=int)};"
+        "PRAGMA temp_store=MEMORY;"
+    ),
+}
+
 DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "NAME": DB_NAME,
     }
 }
 
+if DB_PROFILE == "production":
+    DATABASES["default"].update(
+        {
+            "CONN_MAX_AGE": config("DB_CONN_MAX_AGE", default=600, cast=int),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": SQLITE_PRODUCTION_OPTIONS,
+        }
+    )
+
+# Read replicas: DB_READ_REPLICAS is a comma separated list of SQLite files
+# kept in sync with the primary by `manage.py sync_replicas`. Safe-method
+# requests read from a random replica unless they already wrote, or the
+# client wrote within the last REPLICA_LAG_TOLERANCE seconds
+# (store_products/db_routers.py).
+DATABASE_READ_REPLICAS = []
+for index, replica_name in enumerate(
+    config("DB_READ_REPLICAS", default="", cast=Csv())
+):
+    alias = f"replica_{index}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "NAME": replica_name,
+        "TEST": {"MIRROR": "default"},
+    }
+    DATABASE_READ_REPLICAS.append(alias)
+
+# Order shards: DB_ORDER_SHARDS is a comma separated list of SQLite files.
+# Orders and their items live on the shard their user_id hashes to, users
+# and products stay on the default database (store_products/sharding.py).
+# Only ever append files: `manage.py reshard_orders` then moves the orders
+# of the users that hash to the new shards.
+DATABASE_ORDER_SHARDS = []
+for index, shard_name in enumerate(config("DB_ORDER_SHARDS", default="", cast=Csv())):
+    alias = f"orders_{index}"
+    DATABASES[alias] = {**DATABASES["default"], "NAME": shard_name}
+    DATABASE_ORDER_SHARDS.append(alias)
+
+DATABASE_ROUTERS = [
+    "store_products.db_routers.OrderShardRouter",
+    "store_products.db_routers.ReadReplicaRouter",
+]
+REPLICA_LAG_TOLERANCE = config("DB_REPLICA_LAG_TOLERANCE", default=5.0, cast=float)
+
+
+# Cache backend. The default local-memory cache is per process; set
+# CACHE_BACKEND and CACHE_LOCATION to a shared backend (e.g. Redis) so the
+# catalog cache and its single-flight locks are shared between workers.
+CACHES = {
+    "default": {
+        "BACKEND": config(
+            "CACHE_BACKEND", default="django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": config("CACHE_LOCATION", default="store-products"),
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    }
+}
+
+# Cached product reads (store_products/cache.py): fresh for TIMEOUT seconds,
+# then served stale for up to STALE_TIMEOUT while a single caller refreshes.
+# Product writes invalidate every entry.
+CATALOG_CACHE = {
+    "TIMEOUT": 60,
+    "STALE_TIMEOUT": 30,
+    "LOCK_TIMEOUT": 10,
+    "EARLY_REFRESH_BETA": 1.0,
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -140,8 +315,26 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # Razorpay Configuration
 RAZORPAY_KEY_ID = "your_razorpay_key_id"  # Replace with your actual key
 RAZORPAY_KEY_SECRET = "your_razorpay_key_secret"  # Replace with your actual secret
+# Seconds a single request may spend waiting on the payment gateway
+RAZORPAY_LATENCY_BUDGET = 5.0
+# Circuit breaker around gateway calls, see store_products.payments.CircuitBreaker
+RAZORPAY_CIRCUIT_BREAKER = {
+    "window_size": 20,
+    "minimum_calls": 10,
+    "failure_rate_threshold": 0.5,
+    "slow_call_duration": 2.0,
+    "slow_call_rate_threshold": 0.5,
+    "open_duration": 30.0,
+    "half_open_calls": 3,
+}
 
 # Logging Configuration
+# Loggers only enqueue records; a background listener thread per queue writes
+# them to the file and console handlers and flushes in batches
+# (store_products/log_handlers.py). Log files rotate at LOG_FILE_MAX_BYTES.
+LOG_FILE_MAX_BYTES = 10 * 1024 * 1024
+LOG_FILE_BACKUP_COUNT = 5
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -158,8 +351,10 @@ LOGGING = {
     "handlers": {
         "file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "class": "store_products.log_handlers.BufferedRotatingFileHandler",
             "filename": BASE_DIR / "logs" / "django.log",
+            "maxBytes": LOG_FILE_MAX_BYTES,
+            "backupCount": LOG_FILE_BACKUP_COUNT,
             "formatter": "verbose",
         },
         "console": {
@@ -169,30 +364,52 @@ LOGGING = {
         },
         "api_file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "class": "store_products.log_handlers.BufferedRotatingFileHandler",
             "filename": BASE_DIR / "logs" / "api.log",
+            "maxBytes": LOG_FILE_MAX_BYTES,
+            "backupCount": LOG_FILE_BACKUP_COUNT,
             "formatter": "verbose",
         },
         "payment_file": {
             "level": "INFO",
-            "class": "logging.FileHandler",
+            "class": "store_products.log_handlers.BufferedRotatingFileHandler",
             "filename": BASE_DIR / "logs" / "payments.log",
+            "maxBytes": LOG_FILE_MAX_BYTES,
+            "backupCount": LOG_FILE_BACKUP_COUNT,
             "formatter": "verbose",
         },
+        "django_queue": {
+            "class": "store_products.log_handlers.BackgroundQueueHandler",
+            "handlers": ["file", "console"],
+            "listener": "store_products.log_handlers.BatchingQueueListener",
+            "respect_handler_level": True,
+        },
+        "api_queue": {
+            "class": "store_products.log_handlers.BackgroundQueueHandler",
+            "handlers": ["api_file", "console"],
+            "listener": "store_products.log_handlers.BatchingQueueListener",
+            "respect_handler_level": True,
+        },
+        "payment_queue": {
+            "class": "store_products.log_handlers.BackgroundQueueHandler",
+            "handlers": ["payment_file", "console"],
+            "listener": "store_products.log_handlers.BatchingQueueListener",
+            "respect_handler_level": True,
+        },
     },
     "loggers": {
         "django": {
-            "handlers": ["file", "console"],
+            "handlers": ["django_queue"],
             "level": "INFO",
             "propagate": True,
         },
         "store_products": {
-            "handlers": ["api_file", "console"],
+            "handlers": ["api_queue"],
             "level": "INFO",
             "propagate": False,
         },
         "payments": {
-            "handlers": ["payment_file", "console"],
+            "handlers": ["payment_queue"],
             "level": "INFO",
             "propagate": False,
         },
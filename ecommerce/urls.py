@@ -20,8 +20,14 @@ Function-based views
 
 from django.contrib import admin
 from django.urls import path, include
+from store_products.admin import sql_profile_view
 
 urlpatterns = [
+    path(
+        "admin/sql-profile/",
+        admin.site.admin_view(sql_profile_view),
+        name="sql_profile",
+    ),
     path("admin/", admin.site.urls),
     path("api/", include("store_products.urls")),
 ]
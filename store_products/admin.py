@@ -1,20 +1,359 @@
-from django.contrib import admin
+import logging
+from decimal import Decimal
+
+from django import forms
+from django.conf import settings
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.contrib.admin.views.main import ChangeList
+from django.contrib.auth.models import User
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.core.paginator import Paginator
+from django.db import router, transaction
+from django.db.models import F, Max, Q, QuerySet
+from django.db.models.functions import Round
+from django.shortcuts import redirect
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.template.response import TemplateResponse
 import store_products
 import store_products.models as models
+from store_products import order_events, outbox, sharding
+from store_products.cache import invalidate_catalog
+from store_products.changes import record_deletions
+from store_products.sql_profiler import profiler
+from store_products.totals import refresh_totals
+
+logger = logging.getLogger("store_products")
 
 # Register your models here.
 
 
+class EstimatedCountPaginator(Paginator):
+    """Paginator that never runs an unbounded ``COUNT(*)``.
+
+    An unfiltered list is sized by its highest primary key, an index lookup
+    that overestimates by the number of deleted rows. Filtered lists are
+    counted up to ``max_count`` matches, so pagination stops there instead
+    of scanning the whole table.
+    """
+
+    max_count = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            last = queryset.aggregate(last=Max("pk"))["last"] or 0
+            if last > self.max_count:
+                return last
+        return queryset[: self.max_count].count()
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables too large to count on every page"""
+
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    date_hierarchy = "created_at"
+
+
+class ShardedPaginator(EstimatedCountPaginator):
+    """Paginator over every order shard.
+
+    Each shard is counted up to ``max_count`` matches, and a page is merged
+    from the first rows of every shard up to its end, so deep pages read
+    more rows than shallow ones.
+    """
+
+    @cached_property
+    def count(self):
+        return sum(
+            sharding.fan_out(
+                lambda alias: sharding.on_shard(self.object_list, alias)[
+                    : self.max_count
+                ].count()
+            )
+        )
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        top = bottom + self.per_page
+        if top + self.orphans >= self.count:
+            top = self.count
+        rows = sharding.gather(self.object_list, limit=top)
+        return self._get_page(rows[bottom:top], number, self)
+
+
+class ShardedChangeList(ChangeList):
+    """Changelist reading every order shard, without the date drill-down"""
+
+    def __init__(
+        self,
+        request,
+        model,
+        list_display,
+        list_display_links,
+        list_filter,
+        date_hierarchy,
+        *args,
+        **kwargs,
+    ):
+        # The date drill-down would query the dates on default only
+        super().__init__(
+            request,
+            model,
+            list_display,
+            list_display_links,
+            list_filter,
+            None,
+            *args,
+            **kwargs,
+        )
+
+    def get_results(self, request):
+        super().get_results(request)
+        if isinstance(self.result_list, QuerySet):
+            # A single page or "Show all": every row, from every shard
+            self.result_list = sharding.gather(self.result_list)
+
+
+class ShardedAdmin(LargeTableAdmin):
+    """Admin for a model split across the order shards.
+
+    Without shards it is a plain ``LargeTableAdmin``. With them, lists read
+    every shard, related users and products are prefetched from ``default``
+    rather than joined, and search looks them up there first.
+    """
+
+    # Related rows to prefetch in place of list_select_related
+    sharded_prefetch = []
+    # Relation -> (model on default, fields searched there)
+    sharded_search = {}
+
+    def get_changelist(self, request, **kwargs):
+        if sharding.enabled():
+            return ShardedChangeList
+        return super().get_changelist(request, **kwargs)
+
+    def get_paginator(self, request, queryset, per_page, *args, **kwargs):
+        if sharding.enabled():
+            return ShardedPaginator(queryset, per_page, *args, **kwargs)
+        return super().get_paginator(request, queryset, per_page, *args, **kwargs)
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if sharding.enabled():
+            queryset = queryset.prefetch_related(*self.sharded_prefetch)
+        return queryset
+
+    def get_list_select_related(self, request):
+        if sharding.enabled():
+            # Not False, which would select every relation
+            return ()
+        return super().get_list_select_related(request)
+
+    def get_sortable_by(self, request):
+        sortable_by = super().get_sortable_by(request)
+        if not sharding.enabled():
+            return sortable_by
+        # Rows sorted by a related model could not be merged across shards
+        return [name for name in sortable_by if not self.is_relation(name)]
+
+    def is_relation(self, name):
+        try:
+            return self.model._meta.get_field(name).is_relation
+        except FieldDoesNotExist:
+            return False
+
+    def get_search_results(self, request, queryset, search_term):
+        if not sharding.enabled() or not search_term:
+            return super().get_search_results(request, queryset, search_term)
+        matches = Q()
+        for relation, (model, fields) in self.sharded_search.items():
+            found = Q()
+            for field in fields:
+                found |= Q(**{f"{field}__icontains": search_term})
+            ids = list(
+                model.objects.filter(found).values_list("pk", flat=True)[
+                    : EstimatedCountPaginator.max_count
+                ]
+            )
+            matches |= Q(**{f"{relation}__in": ids})
+        return queryset.filter(matches), False
+
+    def get_object(self, request, object_id, from_field=None):
+        if not sharding.enabled():
+            return super().get_object(request, object_id, from_field)
+        try:
+            return sharding.find(self.get_queryset(request), object_id)
+        except (self.model.DoesNotExist, ValidationError, ValueError):
+            return None
+
+    def get_actions(self, request):
+        actions = super().get_actions(request)
+        if sharding.enabled():
+            # Bulk deletes would only reach the rows on default
+            actions.pop("delete_selected", None)
+        return actions
+
+
+def chunked_update(queryset, **values):
+    """``queryset.update(**values)`` in primary key order, return the count.
+
+    Each run of ``ADMIN_BULK_CHUNK_SIZE`` rows is one UPDATE in its own
+    transaction, so a large selection never holds the write lock for long.
+    Rows are never loaded; ``updated_at`` is set explicitly because
+    ``update()`` skips ``auto_now``. Each chunk's outbox events are written
+    with it, selected before the update changes which rows match.
+    """
+    now = values.setdefault("updated_at", timezone.now())
+    chunk_size = getattr(settings, "ADMIN_BULK_CHUNK_SIZE", 0)
+    queryset = queryset.order_by()
+    using = sharding.write_db(queryset)
+    if not chunk_size:
+        with transaction.atomic(using=using):
+            outbox.emit_queryset(queryset, outbox.UPDATED, now)
+            return queryset.update(**values)
+
+    updated = 0
+    remaining = queryset
+    while True:
+        # First ID of the next chunk, found by walking the primary key index
+        boundary = list(
+            remaining.order_by("pk").values_list("pk", flat=True)[
+                chunk_size : chunk_size + 1
+            ]
+        )
+        chunk = remaining.filter(pk__lt=boundary[0]) if boundary else remaining
+        with transaction.atomic(using=using):
+            outbox.emit_queryset(chunk, outbox.UPDATED, now)
+            updated += chunk.update(**values)
+        if not boundary:
+            break
+        remaining = queryset.filter(pk__gte=boundary[0])
+    return updated
+
+
+class BulkActionForm(ActionForm):
+    """Action bar with an amount for the actions that take one"""
+
+    amount = forms.DecimalField(
+        required=False,
+        label="Amount",
+        help_text="Units to restock, or percentage price change",
+    )
+
+
 @admin.register(models.Products)
-class ProductsAdmin(admin.ModelAdmin):
+class ProductsAdmin(LargeTableAdmin):
     list_display = ["name", "price", "stock_quantity", "is_available", "created_at"]
     list_filter = ["is_available", "created_at"]
     search_fields = ["name", "description"]
     list_editable = ["price", "stock_quantity", "is_available"]
+    action_form = BulkActionForm
+    actions = ["mark_available", "mark_unavailable", "restock", "change_price"]
+
+    def action_amount(self, request):
+        """The amount submitted with the action, or None if it is invalid"""
+        form = self.action_form(request.POST)
+        form.fields["action"].choices = self.get_action_choices(request)
+        if form.is_valid() and form.cleaned_data["amount"] is not None:
+            return form.cleaned_data["amount"]
+        self.message_user(request, "Enter an amount.", messages.ERROR)
+        return None
+
+    def bulk_update(self, request, queryset, message, **values):
+        count = chunked_update(queryset, **values)
+        invalidate_catalog()
+        logger.info("Admin %s: %s", request.user, message % count)
+        self.message_user(request, message % count, messages.SUCCESS)
+
+    @admin.action(
+        description="Mark selected products available", permissions=["change"]
+    )
+    def mark_available(self, request, queryset):
+        self.bulk_update(
+            request, queryset, "Marked %d products available.", is_available=True
+        )
+
+    @admin.action(
+        description="Mark selected products unavailable", permissions=["change"]
+    )
+    def mark_unavailable(self, request, queryset):
+        self.bulk_update(
+            request, queryset, "Marked %d products unavailable.", is_available=False
+        )
+
+    @admin.action(
+        description="Restock selected products by amount", permissions=["change"]
+    )
+    def restock(self, request, queryset):
+        amount = self.action_amount(request)
+        if amount is None:
+            return
+        if amount != amount.to_integral_value() or amount <= 0:
+            self.message_user(
+                request,
+                "Restock amount must be a positive whole number.",
+                messages.ERROR,
+            )
+            return
+        self.bulk_update(
+            request,
+            queryset,
+            f"Restocked %d products by {amount:.0f}.",
+            stock_quantity=F("stock_quantity") + int(amount),
+        )
+
+    @admin.action(
+        description="Change price of selected products by percentage",
+        permissions=["change"],
+    )
+    def change_price(self, request, queryset):
+        amount = self.action_amount(request)
+        if amount is None:
+            return
+        if amount <= -100:
+            self.message_user(
+                request, "A price cannot drop by 100% or more.", messages.ERROR
+            )
+            return
+        self.bulk_update(
+            request,
+            queryset,
+            f"Changed the price of %d products by {amount}%%.",
+            price=Round(F("price") * (1 + amount / Decimal(100)), 2),
+        )
+
+    def delete_model(self, request, obj):
+        product_id = obj.pk
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            super().delete_model(request, obj)
+            record_deletions([product_id])
+            outbox.emit(outbox.events(models.Products, [product_id], outbox.DELETED))
+        sharding.delete_product_items([product_id])
+        invalidate_catalog()
+
+    def delete_queryset(self, request, queryset):
+        product_ids = list(queryset.values_list("pk", flat=True))
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            super().delete_queryset(request, queryset)
+            record_deletions(product_ids)
+            outbox.emit(outbox.events(models.Products, product_ids, outbox.DELETED))
+        sharding.delete_product_items(product_ids)
+        invalidate_catalog()
+
+    def save_model(self, request, obj, form, change):
+        if change and form.changed_data:
+            obj.save(update_fields=[*form.changed_data, "updated_at"])
+        else:
+            super().save_model(request, obj, form, change)
 
 
 @admin.register(models.Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ShardedAdmin):
     list_display = [
         "id",
         "user",
@@ -26,10 +365,134 @@ class OrderAdmin(admin.ModelAdmin):
     list_filter = ["status", "payment_status", "created_at"]
     search_fields = ["user__username", "user__email"]
     readonly_fields = ["total_amount", "created_at", "updated_at"]
+    list_select_related = ["user"]
+    sharded_prefetch = ["user"]
+    sharded_search = {"user": (User, ["username", "email"])}
+    autocomplete_fields = ["user"]
+    actions = ["mark_shipped", "mark_delivered"]
+
+    # Status each bulk action moves to, from the statuses it may leave
+    TRANSITIONS = {
+        "shipped": ["pending", "confirmed"],
+        "delivered": ["shipped"],
+    }
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        if obj is not None and sharding.enabled():
+            # Another user may be on another shard
+            return [*readonly_fields, "user"]
+        return readonly_fields
+
+    def advance(self, request, queryset, new_status):
+        count = 0
+        for alias in sharding.shards():
+            eligible = sharding.on_shard(queryset, alias).filter(
+                status__in=self.TRANSITIONS[new_status]
+            )
+            # Only read the orders back when a status stream is open
+            streamed = []
+            if order_events.broker.topics:
+                streamed = list(eligible.values_list("pk", "user_id", "payment_status"))
+            count += chunked_update(eligible, status=new_status)
+            order_events.publish_on_commit(
+                order_events.order_state(pk, user_id, new_status, payment_status)
+                for pk, user_id, payment_status in streamed
+            )
+        logger.info("Admin %s: marked %s orders %s", request.user, count, new_status)
+        self.message_user(
+            request, f"Marked {count} orders {new_status}.", messages.SUCCESS
+        )
+
+    @admin.action(description="Mark selected orders shipped", permissions=["change"])
+    def mark_shipped(self, request, queryset):
+        self.advance(request, queryset, "shipped")
+
+    @admin.action(description="Mark selected orders delivered", permissions=["change"])
+    def mark_delivered(self, request, queryset):
+        self.advance(request, queryset, "delivered")
+
+    def delete_model(self, request, obj):
+        order_id = obj.pk
+        using = router.db_for_write(self.model, instance=obj)
+        with transaction.atomic(using=using):
+            super().delete_model(request, obj)
+            outbox.emit(
+                outbox.events(models.Order, [order_id], outbox.DELETED), using=using
+            )
+
+    def delete_queryset(self, request, queryset):
+        order_ids = list(queryset.values_list("pk", flat=True))
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            super().delete_queryset(request, queryset)
+            outbox.emit(outbox.events(models.Order, order_ids, outbox.DELETED))
 
 
 @admin.register(models.OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(ShardedAdmin):
     list_display = ["order", "product", "quantity", "price_at_time", "get_total_price"]
     list_filter = ["order__status", "created_at"]
     search_fields = ["product__name", "order__user__username"]
+    # Order.__str__ shows the username
+    list_select_related = ["order__user", "product"]
+    sharded_prefetch = ["order__user", "product"]
+    sharded_search = {
+        "product": (models.Products, ["name"]),
+        "order__user": (User, ["username"]),
+    }
+    raw_id_fields = ["order"]
+    autocomplete_fields = ["product"]
+
+    # With shards, items are changed through the API, which keeps them on
+    # their order's shard
+    def has_add_permission(self, request):
+        return not sharding.enabled() and super().has_add_permission(request)
+
+    def has_change_permission(self, request, obj=None):
+        return not sharding.enabled() and super().has_change_permission(request, obj)
+
+    # Keep the order's stored total in step with its items
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        order_ids = {obj.order_id}
+        if change and "order" in form.changed_data:
+            order_ids.add(form.initial["order"])
+        refresh_totals(models.Order.objects.filter(pk__in=order_ids))
+
+    def delete_model(self, request, obj):
+        item_id = obj.pk
+        using = router.db_for_write(self.model, instance=obj)
+        with transaction.atomic(using=using):
+            super().delete_model(request, obj)
+            outbox.emit(
+                outbox.events(models.OrderItem, [item_id], outbox.DELETED), using=using
+            )
+            refresh_totals(
+                sharding.on_shard(models.Order.objects, using).filter(pk=obj.order_id)
+            )
+
+    def delete_queryset(self, request, queryset):
+        rows = list(queryset.values_list("pk", "order_id"))
+        with transaction.atomic(using=router.db_for_write(self.model)):
+            super().delete_queryset(request, queryset)
+            outbox.emit(
+                outbox.events(models.OrderItem, [pk for pk, _ in rows], outbox.DELETED)
+            )
+            refresh_totals(
+                models.Order.objects.filter(pk__in={order_id for _, order_id in rows})
+            )
+
+
+def sql_profile_view(request):
+    """Admin page showing the SQL profiler's per-endpoint top queries"""
+    if request.method == "POST":
+        profiler.reset()
+        return redirect(request.path)
+    config = getattr(settings, "SQL_PROFILER", {})
+    context = {
+        **admin.site.each_context(request),
+        "title": "SQL profile",
+        "report": profiler.report(top_n=config.get("TOP_N", 20)),
+        "config": config,
+    }
+    return TemplateResponse(request, "admin/store_products/sql_profile.html", context)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ProductsConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "store_products"
+
+    def ready(self):
+        from store_products import signals  # noqa: F401
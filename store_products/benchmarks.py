@@ -0,0 +1,84 @@
+"""Helpers shared by the ``bench_*`` management commands."""
+
+import io
+import json
+from urllib.parse import urlencode
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class WSGIHarness:
+    """Drive the project's WSGI application in process.
+
+    Unlike the test client, requests go through the full ``WSGIHandler`` and
+    fire the ``request_started``/``request_finished`` signals, so connection
+    handling (``CONN_MAX_AGE``) behaves as it does behind a real server.
+    """
+
+    def __init__(self):
+        self.application = WSGIHandler()
+
+    def request(self, method, path, query=None, data=None, headers=None):
+        """Return ``(status_code, body)`` for one request"""
+        body = json.dumps(data).encode() if data is not None else b""
+        environ = {
+            "REQUEST_METHOD": method,
+            "PATH_INFO": path,
+            "QUERY_STRING": urlencode(query or {}),
+            "SERVER_NAME": "testserver",
+            "SERVER_PORT": "80",
+            "SERVER_PROTOCOL": "HTTP/1.1",
+            "REMOTE_ADDR": "127.0.0.1",
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": "http",
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.errors": io.StringIO(),
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": False,
+            "wsgi.run_once": False,
+        }
+        for name, value in (headers or {}).items():
+            environ["HTTP_" + name.upper().replace("-", "_")] = value
+
+        status = []
+
+        def start_response(status_line, response_headers, exc_info=None):
+            status.append(int(status_line.split(" ", 1)[0]))
+
+        result = self.application(environ, start_response)
+        try:
+            content = b"".join(result)
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return status[0], content
+
+
+def percentile(sorted_samples, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(fraction * len(sorted_samples)))
+    return sorted_samples[index]
+
+
+def add_database(alias, name, options=None):
+    """Register the SQLite file ``name`` as database ``alias``.
+
+    The alias is configured like ``default`` apart from its file and, if
+    given, its ``OPTIONS``. It exists in this process, and those forked from
+    it, until ``remove_database``.
+    """
+    database = {**connections.settings[DEFAULT_DB_ALIAS], "NAME": name}
+    if options is not None:
+        database["OPTIONS"] = options
+    connections.settings[alias] = database
+
+
+def remove_database(alias):
+    connections[alias].close()
+    del connections[alias]
+    del connections.settings[alias]
@@ -0,0 +1,278 @@
+"""Single-flight caching for hot read endpoints.
+
+When a cached value expires under load, only one caller recomputes it:
+threads in a process queue on a per-key lock, and processes sharing the
+cache backend race for a lock key added with ``cache.add``. Everyone else
+waits for the new value, or keeps serving the old one while it is within
+its stale period. Values may also be refreshed early with a probability
+that grows as expiry approaches (XFetch), so a hot key is usually
+recomputed before any caller sees it expire.
+
+Catalog responses are keyed by a version number that product edits bump
+(``invalidate_catalog``), so entries never need deleting one by one. Orders
+change stock and sales counters with every write, so they only bump it when
+a product sells out or comes back in stock: otherwise every checkout would
+empty the cache when it is needed most. Stock counts and the sales order of
+lists may lag by up to ``TIMEOUT`` meanwhile.
+"""
+
+import functools
+import hashlib
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+import weakref
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework.response import Response
+
+logger = logging.getLogger("store_products")
+
+DEFAULTS = {
+    "ALIAS": "default",
+    # Seconds a value is fresh
+    "TIMEOUT": 60,
+    # Seconds after that during which the old value is served while one
+    # caller recomputes it
+    "STALE_TIMEOUT": 30,
+    # Seconds a recompute may hold the lock before others stop waiting
+    "LOCK_TIMEOUT": 10,
+    # XFetch beta: higher refreshes earlier, 0 disables early refresh
+    "EARLY_REFRESH_BETA": 1.0,
+}
+
+CATALOG_VERSION_KEY = "catalog:version"
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "CATALOG_CACHE", {})}
+
+
+class SingleFlight:
+    """Compute cached values at most once per key across threads and processes.
+
+    Entries are stored as ``(value, fresh_until, compute_seconds)`` and kept
+    by the backend for ``timeout + stale_timeout`` seconds.
+    """
+
+    poll_interval = 0.02
+
+    def __init__(
+        self,
+        alias="default",
+        timeout=60,
+        stale_timeout=30,
+        lock_timeout=10,
+        beta=1.0,
+    ):
+        self.alias = alias
+        self.timeout = timeout
+        self.stale_timeout = stale_timeout
+        self.lock_timeout = lock_timeout
+        self.beta = beta
+        self._locks = weakref.WeakValueDictionary()
+        self._locks_lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for ``key``, calling ``compute()`` if needed"""
+        entry = self.cache.get(key)
+        if entry is not None:
+            value, fresh_until, delta = entry
+            if not self.should_refresh(fresh_until, delta):
+                return value
+            if time.time() < fresh_until + self.stale_timeout:
+                # Stale or due for early refresh: one caller recomputes and
+                # the rest keep serving the current value meanwhile.
+                with self.try_lock(key) as acquired:
+                    if acquired:
+                        return self.compute_and_store(key, compute)
+                return value
+
+        # Miss: threads of this process wait for each other, then for any
+        # other process holding the shared lock.
+        with self.local_lock(key):
+            deadline = time.monotonic() + self.lock_timeout
+            while True:
+                entry = self.cache.get(key)
+                if entry is not None and time.time() < entry[1] + self.stale_timeout:
+                    return entry[0]
+                with self.try_lock(key) as acquired:
+                    if acquired:
+                        return self.compute_and_store(key, compute)
+                if time.monotonic() >= deadline:
+                    logger.warning("Timed out waiting for cache key %s", key)
+                    return compute()
+                time.sleep(self.poll_interval)
+
+    def get_many(self, keys):
+        """Return the fresh cached values among ``keys``, in one round trip.
+
+        Stale entries count as missing: there is no lock to take for a
+        batch, so the caller recomputes them along with the misses.
+        """
+        now = time.time()
+        return {
+            key: value
+            for key, (value, fresh_until, _) in self.cache.get_many(keys).items()
+            if now < fresh_until
+        }
+
+    def set_many(self, values):
+        """Store ``values`` by key as if each had just been computed"""
+        fresh_until = time.time() + self.timeout
+        self.cache.set_many(
+            {key: (value, fresh_until, 0) for key, value in values.items()},
+            self.timeout + self.stale_timeout,
+        )
+
+    def should_refresh(self, fresh_until, delta):
+        """XFetch: refresh early with a probability rising towards expiry"""
+        now = time.time()
+        if self.beta and delta:
+            # -log(U) for U in (0, 1] is exponentially distributed
+            now -= delta * self.beta * math.log(1.0 - random.random())
+        return now >= fresh_until
+
+    def compute_and_store(self, key, compute):
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        self.cache.set(
+            key,
+            (value, time.time() + self.timeout, delta),
+            self.timeout + self.stale_timeout,
+        )
+        return value
+
+    def local_lock(self, key):
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+        return lock
+
+    def try_lock(self, key):
+        """Context manager yielding whether the shared lock was acquired"""
+        return _SharedLock(self.cache, f"{key}:lock", self.lock_timeout)
+
+
+class _SharedLock:
+    def __init__(self, cache, key, timeout):
+        self.cache = cache
+        self.key = key
+        self.timeout = timeout
+        self.token = uuid.uuid4().hex
+        self.acquired = False
+
+    def __enter__(self):
+        # add() only sets a missing key, atomically on shared backends
+        self.acquired = self.cache.add(self.key, self.token, self.timeout)
+        return self.acquired
+
+    def __exit__(self, *exc_info):
+        # Do not release a lock that expired and was taken by someone else
+        if self.acquired and self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+
+def catalog_version():
+    cache = caches[get_config()["ALIAS"]]
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # If the key was evicted, restarting from a fixed number could
+        # reuse the keys of old entries; a timestamp never does.
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def _bump_catalog_version():
+    cache = caches[get_config()["ALIAS"]]
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate_catalog(using=None):
+    """Make every cached catalog response stale.
+
+    Bumps the version now, so no later request reads data cached before the
+    write, and again on commit, so data read by other requests while the
+    transaction was open is not served either.
+    """
+    _bump_catalog_version()
+    transaction.on_commit(_bump_catalog_version, using=using)
+
+
+_catalog = None
+
+
+def catalog_cache():
+    """The ``SingleFlight`` configured by ``CATALOG_CACHE``"""
+    global _catalog
+    config = get_config()
+    if _catalog is None or _catalog.config != config:
+        _catalog = SingleFlight(
+            alias=config["ALIAS"],
+            timeout=config["TIMEOUT"],
+            stale_timeout=config["STALE_TIMEOUT"],
+            lock_timeout=config["LOCK_TIMEOUT"],
+            beta=config["EARLY_REFRESH_BETA"],
+        )
+        _catalog.config = config
+    return _catalog
+
+
+def catalog_key(version, view_name, arguments):
+    """Cache key of a ``cached_catalog_view`` response.
+
+    ``arguments`` are the sorted ``(name, value or values)`` pairs of the
+    URL arguments followed by the query string.
+    """
+    encoded = urlencode(arguments, doseq=True)
+    return ":".join(
+        [
+            "catalog",
+            str(version),
+            view_name,
+            # Hashed to stay within backend key length and charset limits
+            hashlib.blake2b(encoded.encode(), digest_size=16).hexdigest(),
+        ]
+    )
+
+
+def cached_catalog_view(view):
+    """Cache the responses a DRF function view returns, per catalog version.
+
+    The key covers the view, its URL arguments and the query string.
+    Exceptions such as ``Http404`` propagate and are not cached. Apply below
+    ``@api_view`` so the wrapped function receives the DRF request.
+    """
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        key = catalog_key(
+            catalog_version(),
+            view.__name__,
+            sorted(kwargs.items()) + sorted(request.GET.lists()),
+        )
+
+        def compute():
+            response = view(request, *args, **kwargs)
+            return response.status_code, response.data
+
+        status_code, data = catalog_cache().get_or_compute(key, compute)
+        return Response(data, status=status_code)
+
+    return wrapper
@@ -0,0 +1,111 @@
+"""Changes feed for replicating the catalog incrementally.
+
+A replica asks for everything after its last token and gets the products
+updated since, the IDs of products deleted since (``ProductTombstone``) and
+a new token. Both are read in ``(timestamp, id)`` order from their indexes,
+so a sync after a quiet period reads a few rows rather than the catalog.
+
+Every product write must therefore move ``updated_at`` forward, and every
+delete must go through ``record_deletions``. The exception is the sales
+counters recounted by ``refresh_popularity``: reporting every product
+whose counts moved on each run would defeat the feed.
+"""
+
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from store_products.models import Products, ProductTombstone
+
+CHANGED = 0
+DELETED = 1
+
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+class Position(NamedTuple):
+    """Where a replica is in the feed: the last entry it received"""
+
+    at: datetime
+    kind: int
+    id: int
+
+
+def encode_token(position):
+    micros = (position.at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}.{position.kind}.{position.id}"
+
+
+def decode_token(token):
+    """Parse a token from ``encode_token``, raising ``ValueError`` if invalid"""
+    micros, kind, id_ = (int(part) for part in token.split("."))
+    if kind not in (CHANGED, DELETED):
+        raise ValueError(f"Unknown change kind {kind}")
+    try:
+        at = EPOCH + timedelta(microseconds=micros)
+    except OverflowError:
+        raise ValueError(f"Token time {micros} out of range")
+    return Position(at, kind, id_)
+
+
+def record_deletions(product_ids):
+    """Write tombstones for deleted products, in one insert"""
+    now = timezone.now()
+    ProductTombstone.objects.bulk_create(
+        ProductTombstone(product_id=product_id, deleted_at=now)
+        for product_id in product_ids
+    )
+
+
+def _after(position, kind, time_field, id_field):
+    """Rows of ``kind`` that come after ``position`` in the feed"""
+    if position is None:
+        return Q()
+    later = Q(**{f"{time_field}__gt": position.at})
+    if kind > position.kind:
+        return later | Q(**{time_field: position.at})
+    if kind == position.kind:
+        return later | Q(**{time_field: position.at, f"{id_field}__gt": position.id})
+    return later
+
+
+def changes_since(position, limit):
+    """Return ``(products, deleted IDs, next position, has_more)``.
+
+    At most ``limit`` entries are returned. Entries from the last
+    ``PRODUCT_CHANGES_SETTLE_SECONDS`` are held back: a transaction still
+    open may commit rows with earlier timestamps, which a replica past them
+    would never see.
+    """
+    until = timezone.now() - timedelta(
+        seconds=getattr(settings, "PRODUCT_CHANGES_SETTLE_SECONDS", 0)
+    )
+    products = Products.objects.filter(
+        _after(position, CHANGED, "updated_at", "id"), updated_at__lte=until
+    ).order_by("updated_at", "id")[: limit + 1]
+    tombstones = (
+        ProductTombstone.objects.filter(
+            _after(position, DELETED, "deleted_at", "product_id"),
+            deleted_at__lte=until,
+        )
+        .order_by("deleted_at", "product_id")
+        .values_list("deleted_at", "product_id")[: limit + 1]
+    )
+    entries = sorted(
+        [(Position(p.updated_at, CHANGED, p.pk), p) for p in products]
+        + [(Position(at, DELETED, id_), None) for at, id_ in tombstones],
+        key=lambda entry: entry[0],
+    )
+    page = entries[:limit]
+    next_position = page[-1][0] if page else position
+    return (
+        [product for _, product in page if product is not None],
+        [entry.id for entry, product in page if product is None],
+        next_position,
+        len(entries) > limit,
+    )
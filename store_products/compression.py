@@ -0,0 +1,303 @@
+"""Negotiated response compression.
+
+``CompressionMiddleware`` compresses response bodies with the best encoding
+the client accepts: gzip always, and zstd or brotli when the ``zstandard``
+or ``brotli`` package is installed. Compressed bodies are kept in a bounded
+LRU cache keyed by a digest of the uncompressed body, so a hot payload such as
+the product list or the OpenAPI schema is compressed once per process
+instead of once per request.
+"""
+
+import gzip
+import hashlib
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils.cache import patch_vary_headers
+from store_products import metrics
+
+compression_duration = metrics.histogram(
+    "http_response_compression_seconds",
+    "Time spent compressing response bodies, by encoding and cache result",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0),
+)
+compression_ratio = metrics.histogram(
+    "http_response_compression_ratio",
+    "Compressed size as a fraction of the original size, by encoding",
+    buckets=(0.02, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0),
+)
+
+DEFAULTS = {
+    # Bodies smaller than this are sent as is: the framing overhead and CPU
+    # time are not worth the few bytes saved.
+    "MIN_SIZE": 1024,
+    # Compression level per encoding
+    "LEVELS": {"zstd": 3, "br": 4, "gzip": 6},
+    # Bytes of compressed bodies kept in memory, 0 disables the cache
+    "CACHE_MAX_BYTES": 32 * 1024 * 1024,
+}
+
+
+class Codec:
+    """One content encoding: whole-body and incremental compression"""
+
+    def __init__(self, name, compress, compressor):
+        self.name = name
+        # compress(data, level) -> bytes
+        self.compress = compress
+        # compressor(level) -> object with compress(chunk) and flush(),
+        # where compress() returns output that decodes up to that chunk
+        self.compressor = compressor
+
+
+class _GzipStream:
+    def __init__(self, level):
+        self._compressobj = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        return self._compressobj.compress(chunk) + self._compressobj.flush(
+            zlib.Z_SYNC_FLUSH
+        )
+
+    def flush(self):
+        return self._compressobj.flush()
+
+
+def _available_codecs():
+    """Codecs usable in this process, in server preference order"""
+    codecs = []
+    try:
+        import zstandard
+    except ImportError:
+        pass
+    else:
+
+        class ZstdStream:
+            def __init__(self, level):
+                self._compressobj = zstandard.ZstdCompressor(level=level).compressobj()
+
+            def compress(self, chunk):
+                return self._compressobj.compress(chunk) + self._compressobj.flush(
+                    zstandard.COMPRESSOBJ_FLUSH_BLOCK
+                )
+
+            def flush(self):
+                return self._compressobj.flush()
+
+        codecs.append(
+            Codec(
+                "zstd",
+                lambda data, level: zstandard.ZstdCompressor(level=level).compress(
+                    data
+                ),
+                ZstdStream,
+            )
+        )
+    try:
+        import brotli
+    except ImportError:
+        pass
+    else:
+
+        class BrotliStream:
+            def __init__(self, level):
+                self._compressor = brotli.Compressor(quality=level)
+
+            def compress(self, chunk):
+                return self._compressor.process(chunk) + self._compressor.flush()
+
+            def flush(self):
+                return self._compressor.finish()
+
+        codecs.append(
+            Codec(
+                "br",
+                lambda data, level: brotli.compress(data, quality=level),
+                BrotliStream,
+            )
+        )
+    codecs.append(
+        Codec(
+            "gzip",
+            # mtime=0 keeps the output a function of the input alone
+            lambda data, level: gzip.compress(data, level, mtime=0),
+            _GzipStream,
+        )
+    )
+    return codecs
+
+
+CODECS = {codec.name: codec for codec in _available_codecs()}
+
+_ACCEPT_ENCODING_RE = re.compile(r"\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*")
+
+
+def negotiate(accept_encoding, codecs=CODECS):
+    """Return the name of the codec to use for ``accept_encoding``, or None.
+
+    The client's highest q-value wins; ties go to the first codec in
+    ``codecs``. ``*`` matches any codec not listed explicitly.
+    """
+    weights = {}
+    for item in accept_encoding.split(","):
+        match = _ACCEPT_ENCODING_RE.fullmatch(item)
+        if not match:
+            continue
+        try:
+            weights[match[1].lower()] = float(match[2]) if match[2] else 1.0
+        except ValueError:
+            continue
+
+    best, best_weight = None, 0.0
+    for name in codecs:
+        weight = weights.get(name, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = name, weight
+    return best
+
+
+class CompressedCache:
+    """Thread-safe LRU of compressed bodies, bounded by their total size"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def set(self, key, body):
+        if len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = body
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class CompressionMiddleware:
+    """Compress responses with the encoding negotiated from Accept-Encoding.
+
+    Settings live in ``RESPONSE_COMPRESSION`` (see ``DEFAULTS``). Responses
+    that already have a Content-Encoding, ask for ``no-transform``, or are
+    smaller than ``MIN_SIZE`` are left alone. Streaming responses are
+    compressed chunk by chunk, flushing after each one so clients still
+    receive data as it is produced.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = {**DEFAULTS, **getattr(settings, "RESPONSE_COMPRESSION", {})}
+        self.min_size = config["MIN_SIZE"]
+        self.levels = {**DEFAULTS["LEVELS"], **config["LEVELS"]}
+        self.cache = (
+            CompressedCache(config["CACHE_MAX_BYTES"])
+            if config["CACHE_MAX_BYTES"]
+            else None
+        )
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # Every response from these URLs may vary, including the ones
+        # sent uncompressed, so shared caches must key on the header.
+        patch_vary_headers(response, ("Accept-Encoding",))
+
+        if response.has_header("Content-Encoding") or "no-transform" in response.get(
+            "Cache-Control", ""
+        ):
+            return response
+        encoding = negotiate(request.headers.get("Accept-Encoding", ""))
+        if encoding is None:
+            return response
+
+        codec = CODECS[encoding]
+        level = self.levels[encoding]
+        if response.streaming:
+            if response.is_async:
+                response.streaming_content = self.compress_async_stream(
+                    codec, level, response.streaming_content
+                )
+            else:
+                response.streaming_content = self.compress_stream(
+                    codec, level, response.streaming_content
+                )
+            del response.headers["Content-Length"]
+        else:
+            content = response.content
+            if len(content) < self.min_size:
+                return response
+            compressed = self.compress(codec, level, content)
+            if len(compressed) >= len(content):
+                return response
+            response.content = compressed
+            response["Content-Length"] = str(len(compressed))
+
+        # The compressed representation is not byte-identical, so a strong
+        # validator becomes weak (as django.middleware.gzip does).
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response["ETag"] = "W/" + etag
+        response["Content-Encoding"] = encoding
+        return response
+
+    def compress(self, codec, level, content):
+        """Return ``content`` compressed, from the cache when possible"""
+        started = time.perf_counter()
+        key = None
+        if self.cache is not None:
+            # Hashing is an order of magnitude cheaper than compressing
+            digest = hashlib.blake2b(content, digest_size=16).digest()
+            key = (codec.name, level, digest)
+            compressed = self.cache.get(key)
+            if compressed is not None:
+                compression_duration.observe(
+                    time.perf_counter() - started, encoding=codec.name, cache="hit"
+                )
+                return compressed
+
+        compressed = codec.compress(content, level)
+        if key is not None:
+            self.cache.set(key, compressed)
+        compression_duration.observe(
+            time.perf_counter() - started, encoding=codec.name, cache="miss"
+        )
+        compression_ratio.observe(len(compressed) / len(content), encoding=codec.name)
+        return compressed
+
+    @staticmethod
+    def compress_stream(codec, level, chunks):
+        compressor = codec.compressor(level)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+    @staticmethod
+    async def compress_async_stream(codec, level, chunks):
+        compressor = codec.compressor(level)
+        async for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
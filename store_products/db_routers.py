@@ -0,0 +1,135 @@
+import contextvars
+import random
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from store_products import sharding
+from store_products.models import Order
+
+# Whether the current request must read from the primary database
+_use_primary = contextvars.ContextVar("use_primary", default=False)
+# Whether the current request wrote to the primary database
+_wrote = contextvars.ContextVar("wrote", default=False)
+
+PIN_COOKIE = "db_pin_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class OrderShardRouter:
+    """Keep orders and their items on their user's shard.
+
+    Saved rows stay on the database they came from, new orders saved with
+    ``save()`` go to the shard of their user and new items to the shard of
+    their order; a related lookup follows the instance it starts from.
+    Anything without an instance to go by, such as querysets and
+    ``objects.create()``, is left to the next router, so it must be bound
+    to a shard, see ``store_products.sharding``.
+    """
+
+    def shard(self, instance):
+        if isinstance(instance, User):
+            # The user's orders, e.g. user.orders.all()
+            return sharding.shard_for_user(instance.pk)
+        if not isinstance(instance, sharding.SHARDED_MODELS):
+            return None
+        if not instance._state.adding:
+            return instance._state.db
+        if isinstance(instance, Order):
+            if instance.user_id is None:
+                return None
+            return sharding.shard_for_user(instance.user_id)
+        order = instance._state.fields_cache.get("order")
+        return self.shard(order) if order is not None else None
+
+    def db_for_read(self, model, **hints):
+        if sharding.enabled() and model in sharding.SHARDED_MODELS:
+            return self.shard(hints.get("instance"))
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Orders refer to users and products on default, but never to rows
+        # on another shard
+        shards = settings.DATABASE_ORDER_SHARDS
+        if obj1._state.db in shards and obj2._state.db in shards:
+            return obj1._state.db == obj2._state.db
+        if obj1._state.db in shards or obj2._state.db in shards:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards hold the order tables and the outbox of their changes
+        if db in settings.DATABASE_ORDER_SHARDS:
+            return app_label == "store_products" and model_name in (
+                "order",
+                "orderitem",
+                "outboxevent",
+            )
+        return None
+
+
+class ReadReplicaRouter:
+    """Send reads to the read replicas and writes to the primary.
+
+    Reads go to a random alias from ``DATABASE_READ_REPLICAS`` unless the
+    current request is pinned to the primary, see
+    ``ReplicaPinningMiddleware``. Any write pins the rest of the request, so
+    a request reads its own writes.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_READ_REPLICAS
+        if not replicas or _use_primary.get():
+            return "default"
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        _use_primary.set(True)
+        _wrote.set(True)
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {"default", *settings.DATABASE_READ_REPLICAS}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas are copies of the primary made by `sync_replicas`
+        if db in settings.DATABASE_READ_REPLICAS:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Pin requests to the primary database when replicas may be stale.
+
+    Unsafe methods always use the primary. A client that wrote is sent a
+    cookie for ``REPLICA_LAG_TOLERANCE`` seconds, during which its reads also
+    use the primary so it sees its own writes until the replicas catch up.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        use_primary = (
+            request.method not in SAFE_METHODS or PIN_COOKIE in request.COOKIES
+        )
+        use_primary_token = _use_primary.set(use_primary)
+        wrote_token = _wrote.set(False)
+        try:
+            response = self.get_response(request)
+            if _wrote.get() and settings.REPLICA_LAG_TOLERANCE > 0:
+                response.set_cookie(
+                    PIN_COOKIE,
+                    "1",
+                    max_age=settings.REPLICA_LAG_TOLERANCE,
+                    httponly=True,
+                    samesite="Lax",
+                )
+            return response
+        finally:
+            _use_primary.reset(use_primary_token)
+            _wrote.reset(wrote_token)
@@ -0,0 +1,162 @@
+"""Logging handlers that keep log I/O off the request path.
+
+Loggers write to a ``BackgroundQueueHandler``, which only puts the record on
+an in-memory queue. A ``BatchingQueueListener`` thread drains the queue into
+the real handlers and flushes them once per batch, and
+``BufferedRotatingFileHandler`` writes without flushing every record and
+rotates by size. See ``LOGGING`` in ``ecommerce/settings.py``.
+"""
+
+import atexit
+import os
+import queue
+import threading
+import time
+import weakref
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+_queue_handlers = weakref.WeakSet()
+
+
+class BufferedRotatingFileHandler(RotatingFileHandler):
+    """Size-rotated file handler that leaves flushing to its caller.
+
+    ``RotatingFileHandler`` seeks to the end of the file before every record
+    to check its size, which also flushes the write buffer. This handler reads
+    the size once per batch, before the first record after a ``flush()``, so
+    writes from other processes sharing the file are counted, and adds the
+    encoded size of its own records until the next ``flush()``.
+    """
+
+    stream_size = None
+
+    def _open(self):
+        self.stream_size = None
+        return super()._open()
+
+    def flush(self):
+        super().flush()
+        self.stream_size = None
+
+    def emit(self, record):
+        try:
+            msg = self.format(record) + self.terminator
+            size = len(msg.encode(self.encoding or "utf-8"))
+            if self.stream is None:
+                self.stream = self._open()
+            if self.stream_size is None:
+                self.stream_size = os.fstat(self.stream.fileno()).st_size
+            if (
+                self.maxBytes > 0
+                and self.stream_size > 0
+                and self.stream_size + size >= self.maxBytes
+            ):
+                self.doRollover()
+                if self.stream is None:
+                    self.stream = self._open()
+                self.stream_size = os.fstat(self.stream.fileno()).st_size
+            self.stream.write(msg)
+            self.stream_size += size
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class BatchingQueueListener(QueueListener):
+    """Queue listener that flushes its handlers once per batch.
+
+    Handlers are flushed after ``batch_size`` records, or ``flush_interval``
+    seconds after the oldest unflushed record, whichever comes first.
+    """
+
+    batch_size = 256
+    flush_interval = 1.0
+
+    def _monitor(self):
+        q = self.queue
+        pending = 0
+        deadline = None
+        while True:
+            try:
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    raise queue.Empty
+                record = q.get(timeout=timeout)
+            except queue.Empty:
+                self.flush()
+                pending, deadline = 0, None
+                continue
+
+            if record is self._sentinel:
+                self.flush()
+                q.task_done()
+                break
+            self.handle(record)
+            q.task_done()
+
+            pending += 1
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_interval
+            if pending >= self.batch_size:
+                self.flush()
+                pending, deadline = 0, None
+
+    def flush(self):
+        for handler in self.handlers:
+            handler.flush()
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Queue handler that starts its listener thread on first use.
+
+    ``logging.config.dictConfig`` attaches a listener to queue handlers but
+    does not start it. Starting lazily also restarts the thread in worker
+    processes forked after logging was configured.
+    """
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.listener = None
+        self.started = False
+        self.start_lock = threading.Lock()
+        _queue_handlers.add(self)
+
+    def prepare(self, record):
+        # The queue never leaves the process, so unlike the base class there
+        # is no need to copy the record or pre-format tracebacks. Only the
+        # message is rendered now, so arguments mutated after the call cannot
+        # change what gets written.
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        return record
+
+    def emit(self, record):
+        if not self.started:
+            self.start()
+        super().emit(record)
+
+    def start(self):
+        with self.start_lock:
+            if self.started or self.listener is None:
+                return
+            self.listener.start()
+            self.started = True
+            atexit.register(self.stop)
+
+    def stop(self):
+        with self.start_lock:
+            if self.started:
+                self.listener.stop()
+                self.started = False
+
+
+def _reset_after_fork():
+    # Listener threads do not survive a fork; let the child start its own.
+    for handler in _queue_handlers:
+        handler.started = False
+        handler.start_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
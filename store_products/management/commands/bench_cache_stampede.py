@@ -0,0 +1,138 @@
+import threading
+import time
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand
+from store_products.benchmarks import percentile
+from store_products.cache import SingleFlight
+
+# (stale_timeout, beta) per single-flight mode; "naive" is get-then-set
+MODES = {
+    "naive": None,
+    "single-flight": (0, 0),
+    "+ stale-while-revalidate": (None, 0),
+    "+ early refresh": (None, 1.0),
+}
+
+
+class NaiveCache:
+    """Cache-aside without coordination: every miss recomputes"""
+
+    def __init__(self, cache, timeout):
+        self.cache = cache
+        self.timeout = timeout
+
+    def get_or_compute(self, key, compute):
+        value = self.cache.get(key)
+        if value is None:
+            value = compute()
+            self.cache.set(key, value, self.timeout)
+        return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Hammer a few cache keys from many threads while they expire, and "
+        "count recomputations (database hits) per key and expiry"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=50,
+            help="Concurrent clients (default: 50)",
+        )
+        parser.add_argument(
+            "--keys",
+            type=int,
+            default=4,
+            help="Distinct hot keys (default: 4)",
+        )
+        parser.add_argument(
+            "--ttl",
+            type=float,
+            default=0.5,
+            help="Seconds a value stays fresh (default: 0.5)",
+        )
+        parser.add_argument(
+            "--compute-ms",
+            type=float,
+            default=50,
+            help="Simulated query and serialization time (default: 50)",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=3.0,
+            help="Seconds to run each mode (default: 3)",
+        )
+
+    def handle(self, *args, **options):
+        cache = caches["default"]
+        expiries = options["duration"] / options["ttl"]
+        self.stdout.write(
+            f"{'mode':<26}{'computes':>9}{'per key/expiry':>16}"
+            f"{'peak parallel':>15}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}"
+        )
+        for mode, params in MODES.items():
+            cache.clear()
+            if params is None:
+                flight = NaiveCache(cache, options["ttl"])
+            else:
+                stale_timeout, beta = params
+                flight = SingleFlight(
+                    timeout=options["ttl"],
+                    stale_timeout=(
+                        options["ttl"] if stale_timeout is None else stale_timeout
+                    ),
+                    lock_timeout=10,
+                    beta=beta,
+                )
+            computes, peak, samples = self.run(flight, options)
+            samples.sort()
+            self.stdout.write(
+                f"{mode:<26}{computes:>9}"
+                f"{computes / options['keys'] / expiries:>16.1f}{peak:>15}"
+                f"{percentile(samples, 0.5) * 1000:>9.2f}"
+                f"{percentile(samples, 0.99) * 1000:>9.2f}"
+                f"{samples[-1] * 1000:>9.2f}"
+            )
+
+    def run(self, flight, options):
+        """Return (computations, peak concurrent computations, latencies)"""
+        lock = threading.Lock()
+        state = {"computes": 0, "running": 0, "peak": 0}
+        samples = []
+        deadline = time.monotonic() + options["duration"]
+
+        def compute():
+            with lock:
+                state["computes"] += 1
+                state["running"] += 1
+                state["peak"] = max(state["peak"], state["running"])
+            time.sleep(options["compute_ms"] / 1000)
+            with lock:
+                state["running"] -= 1
+            return "payload"
+
+        def client(index):
+            key = f"bench:stampede:{index % options['keys']}"
+            latencies = []
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                flight.get_or_compute(key, compute)
+                latencies.append(time.perf_counter() - started)
+                time.sleep(0.001)
+            with lock:
+                samples.extend(latencies)
+
+        threads = [
+            threading.Thread(target=client, args=(i,))
+            for i in range(options["threads"])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return state["computes"], state["peak"], samples
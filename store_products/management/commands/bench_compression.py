@@ -0,0 +1,122 @@
+import contextlib
+import hashlib
+import io
+import statistics
+import time
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import setup_test_environment, teardown_test_environment
+from store_products.compression import CODECS
+
+# Levels compared per encoding: fastest, the middleware default, strongest
+# that is still usable per request
+LEVELS = {"zstd": (1, 3, 10), "br": (1, 4, 9), "gzip": (1, 6, 9)}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare compression encodings and levels on the product and order "
+        "list payloads: CPU time per response against bytes on the wire"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products",
+            type=int,
+            default=10000,
+            help="Products in the scratch database (default: 10000)",
+        )
+        parser.add_argument(
+            "--orders",
+            type=int,
+            default=5000,
+            help="Orders in the scratch database (default: 5000)",
+        )
+        parser.add_argument(
+            "--bandwidths",
+            default="10,100,1000",
+            help="Comma separated link speeds in Mbit/s to estimate the "
+            "response time at (default: 10,100,1000)",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=5,
+            help="Compressions per encoding and level, the median is "
+            "reported (default: 5)",
+        )
+
+    def handle(self, *args, **options):
+        bandwidths = [float(b) for b in options["bandwidths"].split(",")]
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        try:
+            # Keep print() output from views out of the report
+            with contextlib.redirect_stdout(io.StringIO()):
+                call_command(
+                    "populate_db",
+                    bulk=True,
+                    users=max(10, options["orders"] // 100),
+                    products=options["products"],
+                    orders=options["orders"],
+                    seed=0,
+                )
+                client = Client()
+                payloads = {
+                    "get_products": client.get("/api/products/").content,
+                    "get_orders": client.get("/api/orders/").content,
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        for name, body in payloads.items():
+            self.report(name, body, bandwidths, options["repeat"])
+
+    def report(self, name, body, bandwidths, repeat):
+        self.stdout.write(f"\n{name}: {len(body) / 1024:.0f} KiB uncompressed")
+        header = f"{'encoding':<10}{'KiB':>9}{'ratio':>8}{'CPU ms':>9}{'MB/s':>8}"
+        for bandwidth in bandwidths:
+            header += f"{f'@{bandwidth:g}Mb ms':>13}"
+        self.stdout.write(header)
+
+        rows = [("identity", body, 0.0)]
+        for encoding, codec in CODECS.items():
+            for level in LEVELS[encoding]:
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    compressed = codec.compress(body, level)
+                    timings.append(time.perf_counter() - started)
+                rows.append(
+                    (f"{encoding}:{level}", compressed, statistics.median(timings))
+                )
+
+        # A cache hit costs a digest of the body instead of a compression
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            hashlib.blake2b(body, digest_size=16).digest()
+            timings.append(time.perf_counter() - started)
+        hit_cost = statistics.median(timings)
+
+        for label, compressed, cpu in rows:
+            line = (
+                f"{label:<10}{len(compressed) / 1024:>9.0f}"
+                f"{len(compressed) / len(body):>8.3f}{cpu * 1000:>9.2f}"
+                f"{len(body) / cpu / 1e6 if cpu else 0:>8.0f}"
+            )
+            for bandwidth in bandwidths:
+                transfer = len(compressed) * 8 / (bandwidth * 1e6)
+                line += f"{(cpu + transfer) * 1000:>13.1f}"
+            self.stdout.write(line)
+        self.stdout.write(
+            f"Cached variant lookup (body digest): {hit_cost * 1000:.2f}ms, "
+            "replacing the CPU column on repeat responses"
+        )
@@ -0,0 +1,199 @@
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test.utils import override_settings
+from store_products.benchmarks import WSGIHarness, percentile
+from store_products.models import Products
+
+
+class Command(BaseCommand):
+    help = (
+        "Concurrent read/write benchmark against the product and order "
+        "endpoints. Run it against a scratch database, e.g. "
+        "DB_NAME=/tmp/bench.sqlite3 DB_PROFILE=production"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=8,
+            help="Number of concurrent clients (default: 8)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=1,
+            help="Number of worker processes, each running --threads clients",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=10.0,
+            help="Seconds to run the benchmark for (default: 10)",
+        )
+        parser.add_argument(
+            "--write-ratio",
+            type=float,
+            default=0.2,
+            help="Fraction of requests that create an order (default: 0.2)",
+        )
+        parser.add_argument(
+            "--seed",
+            action="store_true",
+            help="Create benchmark users and products before running",
+        )
+
+    def handle(self, *args, **options):
+        if options["seed"]:
+            self.seed()
+        self.user_ids = list(User.objects.values_list("id", flat=True)[:1000])
+        self.product_ids = list(
+            Products.objects.filter(stock_quantity__gte=1000).values_list(
+                "id", flat=True
+            )[:1000]
+        )
+        if not self.user_ids or not self.product_ids:
+            raise CommandError("No benchmark data found, run with --seed first")
+        connections.close_all()
+
+        db = settings.DATABASES["default"]
+        self.stdout.write(
+            f"Profile: {settings.DB_PROFILE}, CONN_MAX_AGE={db.get('CONN_MAX_AGE', 0)}, "
+            f"{options['processes']} processes x {options['threads']} threads "
+            f"for {options['duration']:.0f}s"
+        )
+
+        # Every harness request comes from one address, so throttling would
+        # turn most of them into 429s. The middleware reads the setting once,
+        # when the handler loads it.
+        with override_settings(THROTTLE={"ENABLED": False}):
+            self.harness = WSGIHarness()
+        self.deadline = time.monotonic() + options["duration"]
+        self.write_ratio = options["write_ratio"]
+        self.results = {"read": [], "write": []}
+        self.statuses = Counter()
+        self.lock = threading.Lock()
+
+        # Worker processes are forked so they share the loaded project and
+        # the benchmark data IDs; results come back through a queue.
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        processes = [
+            context.Process(
+                target=self.worker,
+                args=(queue, index * options["threads"], options["threads"]),
+            )
+            for index in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        for _ in processes:
+            results, statuses = queue.get()
+            for kind, samples in results.items():
+                self.results[kind].extend(samples)
+            self.statuses.update(statuses)
+        for process in processes:
+            process.join()
+
+        for kind, samples in self.results.items():
+            samples.sort()
+            self.stdout.write(
+                f"{kind:>5}: {len(samples) / options['duration']:8.1f} req/s  "
+                f"p50={percentile(samples, 0.5) * 1000:.1f}ms  "
+                f"p95={percentile(samples, 0.95) * 1000:.1f}ms  "
+                f"p99={percentile(samples, 0.99) * 1000:.1f}ms"
+            )
+        self.stdout.write(
+            f"Status codes: {dict(sorted(self.statuses.items(), key=str))}"
+        )
+
+    def worker(self, queue, first_seed, threads):
+        threads = [
+            threading.Thread(target=self.client, args=(seed,))
+            for seed in range(first_seed, first_seed + threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queue.put((self.results, self.statuses))
+
+    def client(self, seed):
+        rng = random.Random(seed)
+        results = {"read": [], "write": []}
+        statuses = Counter()
+        try:
+            while time.monotonic() < self.deadline:
+                if rng.random() < self.write_ratio:
+                    kind = "write"
+                    request = (
+                        "POST",
+                        "/api/orders/create/",
+                        None,
+                        {
+                            "user": rng.choice(self.user_ids),
+                            "shipping_address": "1 Benchmark Road",
+                            "order_items": [
+                                {"product_id": str(product_id), "quantity": "1"}
+                                for product_id in rng.sample(self.product_ids, 2)
+                            ],
+                        },
+                    )
+                else:
+                    kind = "read"
+                    request = rng.choice(
+                        [
+                            ("GET", f"/api/products/{rng.choice(self.product_ids)}/"),
+                            ("GET", "/api/products/", {"name": "Bench 1"}),
+                            (
+                                "GET",
+                                "/api/orders/",
+                                {"user_id": rng.choice(self.user_ids)},
+                            ),
+                        ]
+                    )
+                started = time.perf_counter()
+                try:
+                    status_code, _ = self.harness.request(*request)
+                except Exception as e:
+                    status_code = type(e).__name__
+                results[kind].append(time.perf_counter() - started)
+                statuses[status_code] += 1
+        finally:
+            connections.close_all()
+        with self.lock:
+            for kind, samples in results.items():
+                self.results[kind].extend(samples)
+            self.statuses.update(statuses)
+
+    def seed(self):
+        password = make_password("testpass123")
+        User.objects.bulk_create(
+            [
+                User(username=f"bench{i}", password=password)
+                for i in range(50)
+                if not User.objects.filter(username=f"bench{i}").exists()
+            ]
+        )
+        Products.objects.bulk_create(
+            [
+                Products(
+                    name=f"Bench {i}",
+                    description="Benchmark product",
+                    price=Decimal("9.99"),
+                    stock_quantity=10**9,
+                )
+                for i in range(500)
+            ]
+        )
+        self.stdout.write("Seeded 50 users and 500 products")
@@ -0,0 +1,374 @@
+import contextlib
+import io
+import json
+import time
+import tracemalloc
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_test_environment,
+    teardown_test_environment,
+)
+from django.urls import URLPattern, reverse
+from drf_spectacular.drainage import GENERATOR_STATS
+from store_products import urls
+from store_products.benchmarks import percentile
+from store_products.models import Order, Products
+
+# How each URL in store_products/urls.py is exercised. Keys are URL names, or
+# the route for unnamed patterns. Values are callables taking the benchmark
+# fixture ids and returning (method, url kwargs, query, body).
+ENDPOINTS = {
+    "schema": lambda ids: ("GET", {}, None, None),
+    "swagger-ui": lambda ids: ("GET", {}, None, None),
+    "redoc": lambda ids: ("GET", {}, None, None),
+    "hello/": lambda ids: ("GET", {}, None, None),
+    "metrics": lambda ids: ("GET", {}, None, None),
+    "get_products": lambda ids: ("GET", {}, {"name": "Product 1"}, None),
+    "get_product": lambda ids: (
+        "GET",
+        {"product_id": ids["product"]},
+        None,
+        None,
+    ),
+    "get_products_batch": lambda ids: (
+        "GET",
+        {},
+        {"ids": f"{ids['product']},{ids['product'] + 1}"},
+        None,
+    ),
+    "get_product_changes": lambda ids: ("GET", {}, {"limit": "100"}, None),
+    "add_products": lambda ids: (
+        "POST",
+        {},
+        None,
+        {
+            "name": "Benchmark product",
+            "description": "Created by bench_endpoints",
+            "price": "19.99",
+            "stock_quantity": 10,
+        },
+    ),
+    "update_product": lambda ids: (
+        "PATCH",
+        {"product_id": ids["product"]},
+        None,
+        {"price": "29.99"},
+    ),
+    "delete_product": lambda ids: (
+        "DELETE",
+        {"product_id": ids["product"]},
+        None,
+        None,
+    ),
+    "related_products": lambda ids: (
+        "GET",
+        {"product_id": ids["product"]},
+        None,
+        None,
+    ),
+    "get_orders": lambda ids: ("GET", {}, {"user_id": ids["user"]}, None),
+    "get_order": lambda ids: ("GET", {"order_id": ids["order"]}, None, None),
+    "create_order": lambda ids: (
+        "POST",
+        {},
+        None,
+        {
+            "user": ids["user"],
+            "shipping_address": "1 Benchmark Road",
+            "order_items": [{"product_id": str(ids["product"]), "quantity": "1"}],
+        },
+    ),
+    "order_status_events": lambda ids: (
+        "GET",
+        {},
+        {"order_id": ids["order"]},
+        None,
+    ),
+    "update_order": lambda ids: (
+        "PATCH",
+        {"order_id": ids["order"]},
+        None,
+        {"status": "shipped"},
+    ),
+    "cancel_order": lambda ids: (
+        "DELETE",
+        {"order_id": ids["order"]},
+        None,
+        None,
+    ),
+    "create_razorpay_order": lambda ids: (
+        "POST",
+        {},
+        None,
+        {"order_id": ids["order"], "amount": "10.00"},
+    ),
+    "verify_razorpay_payment": lambda ids: (
+        "POST",
+        {},
+        None,
+        {
+            "razorpay_payment_id": "pay_bench",
+            "razorpay_order_id": "order_bench",
+            "razorpay_signature": "invalid",
+            "order_id": ids["order"],
+        },
+    ),
+}
+
+# Direction in which each reported metric gets worse
+HIGHER_IS_WORSE = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "queries": True,
+    "peak_memory_kb": True,
+    "requests_per_second": False,
+}
+
+
+def endpoint_names():
+    """Names of every pattern in store_products/urls.py"""
+    return [
+        pattern.name or str(pattern.pattern)
+        for pattern in urls.urlpatterns
+        if isinstance(pattern, URLPattern)
+    ]
+
+
+def fixture_ids():
+    """IDs of existing rows that the ``ENDPOINTS`` requests refer to"""
+    return {
+        "user": Order.objects.values_list("user_id", flat=True).first(),
+        "product": Products.objects.filter(is_available=True, stock_quantity__gt=0)
+        .values_list("id", flat=True)
+        .first(),
+        "order": Order.objects.values_list("id", flat=True).first(),
+    }
+
+
+def endpoint_request(client, name, ids):
+    """Return a function making the ``ENDPOINTS`` request for ``name``.
+
+    Each call is rolled back, so mutating requests can be repeated and
+    every request sees the same data.
+    """
+    method, kwargs, query, body = ENDPOINTS[name](ids)
+    path = reverse(name, kwargs=kwargs) if name != "hello/" else "/api/hello/"
+
+    def request():
+        with transaction.atomic():
+            response = client.generic(
+                method,
+                path,
+                data=json.dumps(body) if body is not None else "",
+                content_type="application/json",
+                QUERY_STRING=urlencode(query or {}),
+            )
+            transaction.set_rollback(True)
+        return response
+
+    return request
+
+
+def compare(baseline, results, threshold):
+    """Return a message for every metric that regressed past ``threshold``.
+
+    Both arguments are reports as written by the command. Only scales,
+    endpoints and metrics present in both are compared.
+    """
+    regressions = []
+    for scale, endpoints in results.get("scales", {}).items():
+        baseline_endpoints = baseline.get("scales", {}).get(scale, {})
+        for name, metrics in endpoints.items():
+            baseline_metrics = baseline_endpoints.get(name, {})
+            for metric, higher_is_worse in HIGHER_IS_WORSE.items():
+                if metric not in metrics or metric not in baseline_metrics:
+                    continue
+                old, new = baseline_metrics[metric], metrics[metric]
+                if higher_is_worse:
+                    regressed = new > old * (1 + threshold)
+                else:
+                    regressed = new < old * (1 - threshold)
+                if regressed:
+                    regressions.append(
+                        f"{name} at {scale} rows: {metric} {old:g} -> {new:g}"
+                    )
+    return regressions
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark every store_products endpoint against a scratch test "
+        "database seeded at increasing data scales, reporting JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--scales",
+            default="10000,100000,1000000",
+            help="Comma separated product and order counts "
+            "(default: 10000,100000,1000000)",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=50,
+            help="Timed requests per endpoint and scale (default: 50)",
+        )
+        parser.add_argument(
+            "--time-budget",
+            type=float,
+            default=10.0,
+            help="Stop timing an endpoint after this many seconds, even if "
+            "fewer than --requests were made (default: 10)",
+        )
+        parser.add_argument(
+            "--endpoints",
+            help="Comma separated URL names to run (default: all)",
+        )
+        parser.add_argument(
+            "--output",
+            help="Write the JSON report to this file instead of stdout",
+        )
+        parser.add_argument(
+            "--baseline",
+            help="JSON report of an earlier run to compare against",
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=0.2,
+            help="Relative change counted as a regression (default: 0.2)",
+        )
+
+    def handle(self, *args, **options):
+        scales = sorted(int(scale) for scale in options["scales"].split(","))
+        names = endpoint_names()
+        missing = set(names) - set(ENDPOINTS)
+        if missing:
+            raise CommandError(
+                f"No benchmark request defined for: {', '.join(sorted(missing))}"
+            )
+        if options["endpoints"]:
+            selected = options["endpoints"].split(",")
+            unknown = set(selected) - set(names)
+            if unknown:
+                raise CommandError(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+            names = [name for name in names if name in selected]
+
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+
+        # Benchmark data never touches the configured database: seed a
+        # throwaway test database, as the test runner does.
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False
+        )
+        report = {"scales": {}}
+        try:
+            # Keep print() output from views out of the JSON report, schema
+            # generation warnings from repeating for every request, and the
+            # benchmark client from being rate limited
+            with (
+                contextlib.redirect_stdout(io.StringIO()),
+                GENERATOR_STATS.silence(),
+                override_settings(THROTTLE={"ENABLED": False}),
+            ):
+                for scale in scales:
+                    self.seed(scale)
+                    report["scales"][str(scale)] = self.run_scale(
+                        scale, names, options["requests"], options["time_budget"]
+                    )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        output = json.dumps(report, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+        if baseline is not None:
+            regressions = compare(baseline, report, options["threshold"])
+            if regressions:
+                raise CommandError(
+                    "Performance regressions:\n" + "\n".join(regressions)
+                )
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+
+    def seed(self, scale):
+        """Top the database up to ``scale`` products and orders"""
+        started = time.monotonic()
+        added = scale - Products.objects.count()
+        # New orders go to users created in the same call, one per 100 orders
+        call_command(
+            "populate_db",
+            bulk=True,
+            users=max(10, added // 100),
+            products=added,
+            orders=scale - Order.objects.count(),
+            seed=scale,
+            stdout=io.StringIO(),
+        )
+        self.stderr.write(
+            f"Seeded {scale} products and orders in {time.monotonic() - started:.1f}s"
+        )
+
+    def run_scale(self, scale, names, requests, time_budget):
+        ids = fixture_ids()
+        client = Client()
+        results = {}
+        # The payment gateway is stubbed so the benchmark measures this
+        # service, not the network.
+        with mock.patch(
+            "store_products.views.call_gateway", return_value={"id": "order_bench"}
+        ):
+            for name in names:
+                request = endpoint_request(client, name, ids)
+                request()  # warm up
+                samples = []
+                deadline = time.perf_counter() + time_budget
+                while len(samples) < requests and time.perf_counter() < deadline:
+                    started = time.perf_counter()
+                    response = request()
+                    samples.append(time.perf_counter() - started)
+                samples.sort()
+
+                with CaptureQueriesContext(connection) as queries:
+                    request()
+                # Read now, the next request resets the connection's query log
+                query_count = len(queries)
+
+                tracemalloc.start()
+                try:
+                    request()
+                    peak = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+
+                results[name] = {
+                    "status": response.status_code,
+                    "requests": len(samples),
+                    "requests_per_second": round(len(samples) / sum(samples), 1),
+                    "p50_ms": round(percentile(samples, 0.5) * 1000, 2),
+                    "p95_ms": round(percentile(samples, 0.95) * 1000, 2),
+                    "p99_ms": round(percentile(samples, 0.99) * 1000, 2),
+                    "queries": query_count,
+                    "peak_memory_kb": round(peak / 1024),
+                }
+                self.stderr.write(
+                    f"{scale:>8} {name:<24} {results[name]['p50_ms']:>9.2f}ms p50"
+                )
+        return results
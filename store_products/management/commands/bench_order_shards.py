@@ -0,0 +1,149 @@
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from decimal import Decimal
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.test.utils import override_settings
+from store_products import outbox, sharding
+from store_products.benchmarks import add_database, remove_database
+from store_products.models import Order, OrderItem
+
+PRICE = Decimal("9.99")
+
+
+class Command(BaseCommand):
+    help = (
+        "Order write throughput with the orders split across 1, 2, 4... "
+        "SQLite shards. Each run writes to new scratch files with the "
+        "production SQLite settings; users and products are not touched"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--shards",
+            default="1,2,4",
+            help="Comma separated shard counts to compare (default: 1,2,4)",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=4,
+            help="Number of concurrent writer processes (default: 4)",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=5.0,
+            help="Seconds to write for at each shard count (default: 5)",
+        )
+        parser.add_argument(
+            "--items",
+            type=int,
+            default=3,
+            help="Items per order (default: 3)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            counts = [int(count) for count in options["shards"].split(",")]
+        except ValueError:
+            raise CommandError("--shards must be a comma separated list of numbers")
+        if min(counts) < 1:
+            raise CommandError("Every shard count must be at least 1")
+
+        # Shards only add throughput while the writers have cores to run on
+        self.stdout.write(
+            f"{options['processes']} processes on {os.cpu_count()} CPUs writing "
+            f"orders of {options['items']} items for {options['duration']:.0f}s"
+        )
+        baseline = None
+        for count in counts:
+            with tempfile.TemporaryDirectory() as directory:
+                rate = self.run(count, Path(directory), options)
+            baseline = baseline or rate
+            self.stdout.write(
+                f"{count:>3} shards: {rate:8.1f} orders/s ({rate / baseline:.2f}x)"
+            )
+
+    def run(self, count, directory, options):
+        """Orders per second written to ``count`` new shards in ``directory``"""
+        aliases = [f"bench_shard_{index}" for index in range(count)]
+        for alias in aliases:
+            add_database(
+                alias,
+                str(directory / f"{alias}.sqlite3"),
+                settings.SQLITE_PRODUCTION_OPTIONS,
+            )
+        try:
+            with override_settings(DATABASE_ORDER_SHARDS=aliases):
+                for alias in aliases:
+                    call_command(
+                        "migrate", "store_products", database=alias, verbosity=0
+                    )
+                # Forked workers must not share the parent's connections
+                connections.close_all()
+                return self.measure(options)
+        finally:
+            for alias in aliases:
+                remove_database(alias)
+
+    def measure(self, options):
+        context = multiprocessing.get_context("fork")
+        queue = context.Queue()
+        deadline = time.monotonic() + options["duration"]
+        processes = [
+            context.Process(
+                target=self.worker, args=(queue, seed, deadline, options["items"])
+            )
+            for seed in range(options["processes"])
+        ]
+        for process in processes:
+            process.start()
+        written = sum(queue.get() for _ in processes)
+        for process in processes:
+            process.join()
+        return written / options["duration"]
+
+    def worker(self, queue, seed, deadline, items):
+        """Place orders for random users until ``deadline``, as the API does"""
+        rng = random.Random(seed)
+        written = 0
+        try:
+            while time.monotonic() < deadline:
+                user_id = rng.randrange(1, 10**6)
+                shard = sharding.shard_for_user(user_id)
+                with transaction.atomic(using=shard):
+                    order = Order.objects.using(shard).create(
+                        user_id=user_id,
+                        shipping_address="1 Benchmark Road",
+                        total_amount=PRICE * items,
+                    )
+                    order_items = OrderItem.objects.using(shard).bulk_create(
+                        OrderItem(
+                            order=order,
+                            product_id=rng.randrange(1, 10**4),
+                            quantity=1,
+                            price_at_time=PRICE,
+                        )
+                        for _ in range(items)
+                    )
+                    outbox.emit(
+                        outbox.events(
+                            OrderItem,
+                            [item.pk for item in order_items],
+                            outbox.CREATED,
+                        ),
+                        using=shard,
+                    )
+                written += 1
+        finally:
+            connections.close_all()
+            # Also on errors, so the parent never waits for a dead worker
+            queue.put(written)
@@ -0,0 +1,48 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+from store_products.middleware import RequestMetricsMiddleware
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request overhead of RequestMetricsMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=100000,
+            help="Number of requests per mode (default: 100000)",
+        )
+
+    def handle(self, *args, **options):
+        count = options["requests"]
+        request = RequestFactory().get("/api/products/1/")
+        request.resolver_match = resolve("/api/products/1/")
+        response = HttpResponse(b"{}", content_type="application/json")
+
+        def view(request):
+            return response
+
+        baseline = self.measure(view, request, count)
+        self.stdout.write(f"No middleware: {baseline:.2f}us/request")
+        for mode, low_overhead in [("low overhead", True), ("full", False)]:
+            with override_settings(REQUEST_METRICS={"LOW_OVERHEAD": low_overhead}):
+                middleware = RequestMetricsMiddleware(view)
+            elapsed = self.measure(middleware, request, count)
+            self.stdout.write(
+                f"{mode.capitalize()} mode: {elapsed:.2f}us/request "
+                f"({elapsed - baseline:.2f}us overhead)"
+            )
+
+    def measure(self, handler, request, count):
+        """Return the mean time per call in microseconds"""
+        for _ in range(1000):
+            handler(request)
+        started = time.perf_counter()
+        for _ in range(count):
+            handler(request)
+        return (time.perf_counter() - started) / count * 1e6
@@ -0,0 +1,112 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter: boot the WSGI application the way a worker
+# does, then time the first and second request to each path.
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from store_products.benchmarks import WSGIHarness
+harness = WSGIHarness()
+result = {"boot": time.perf_counter() - started, "first": {}, "second": {}}
+for path in sys.argv[1:]:
+    for key in ("first", "second"):
+        request_started = time.perf_counter()
+        status_code, _ = harness.request("GET", path)
+        result[key][path] = time.perf_counter() - request_started
+        if status_code != 200:
+            raise SystemExit(f"{path} returned {status_code}")
+print(json.dumps(result))
+"""
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure worker cold start: interpreter and Django boot time and "
+        "the latency of the first request to each path"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--paths",
+            default="/api/metrics/,/api/schema/",
+            help="Comma separated paths to request after boot "
+            "(default: /api/metrics/,/api/schema/)",
+        )
+        parser.add_argument(
+            "--runs",
+            type=int,
+            default=5,
+            help="Number of fresh processes to start (default: 5)",
+        )
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10,
+            help="Also list the N slowest top-level imports (default: 10)",
+        )
+
+    def handle(self, *args, **options):
+        paths = options["paths"].split(",")
+        env = {**os.environ, "DJANGO_SETTINGS_MODULE": settings.SETTINGS_MODULE}
+
+        runs = []
+        for _ in range(options["runs"]):
+            started = time.perf_counter()
+            result = self.run_child(env, paths)
+            result["process"] = time.perf_counter() - started
+            runs.append(result)
+
+        def median_ms(values):
+            return f"{statistics.median(values) * 1000:8.1f}ms"
+
+        self.stdout.write(
+            f"{'process total':<32}{median_ms([r['process'] for r in runs])}"
+        )
+        self.stdout.write(f"{'django boot':<32}{median_ms([r['boot'] for r in runs])}")
+        for path in paths:
+            self.stdout.write(
+                f"{'first ' + path:<32}{median_ms([r['first'][path] for r in runs])}"
+                f"  (warm: {median_ms([r['second'][path] for r in runs]).strip()})"
+            )
+
+        if options["top"]:
+            self.stdout.write("\nSlowest top-level imports:")
+            for name, cumulative in self.import_times(env, paths)[: options["top"]]:
+                self.stdout.write(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    def run_child(self, env, paths, *flags):
+        process = subprocess.run(
+            [sys.executable, *flags, "-c", CHILD, *paths],
+            env=env,
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+        )
+        if process.returncode != 0:
+            raise CommandError(process.stderr.strip().splitlines()[-1])
+        result = json.loads(process.stdout.strip().splitlines()[-1])
+        result["stderr"] = process.stderr
+        return result
+
+    def import_times(self, env, paths):
+        """Return ``[(module, cumulative microseconds)]``, slowest first"""
+        stderr = self.run_child(env, paths, "-X", "importtime")["stderr"]
+        times = []
+        for line in stderr.splitlines():
+            if not line.startswith("import time:"):
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            # Only modules imported directly, not their dependencies
+            if cumulative.strip().isdigit() and not name[1:].startswith(" "):
+                times.append((name.strip(), int(cumulative)))
+        return sorted(times, key=lambda item: item[1], reverse=True)
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.urls import resolve
+from store_products.throttling import ThrottleMiddleware
+
+
+class Command(BaseCommand):
+    help = "Measure the per-request overhead of ThrottleMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=100000,
+            help="Number of requests per mode (default: 100000)",
+        )
+        parser.add_argument(
+            "--clients",
+            type=int,
+            default=1000,
+            help="Distinct client addresses to rotate through (default: 1000)",
+        )
+
+    def handle(self, *args, **options):
+        count = options["requests"]
+        factory = RequestFactory()
+        match = resolve("/api/products/")
+        requests = []
+        for i in range(options["clients"]):
+            request = factory.get(
+                "/api/products/", REMOTE_ADDR=f"10.0.{i // 256}.{i % 256}"
+            )
+            request.resolver_match = match
+            requests.append(request)
+
+        # A rate no client reaches, so every request takes the allow path
+        unlimited = {"DEFAULT": {"RATE": 1e9, "BURST": 1e9}}
+        for mode, config in [
+            ("in-process", unlimited),
+            ("cache backend", {**unlimited, "CACHE_ALIAS": "default"}),
+        ]:
+            with override_settings(THROTTLE=config):
+                middleware = ThrottleMiddleware(lambda request: None)
+            elapsed = self.measure(middleware, requests, match, count)
+            self.stdout.write(f"{mode.capitalize()}: {elapsed:.2f}us/request")
+
+    def measure(self, middleware, requests, match, count):
+        """Return the mean time per ``process_view`` call in microseconds"""
+        process_view = middleware.process_view
+        view, args, kwargs = match.func, match.args, match.kwargs
+        clients = len(requests)
+        for i in range(1000):
+            process_view(requests[i % clients], view, args, kwargs)
+        started = time.perf_counter()
+        for i in range(count):
+            process_view(requests[i % clients], view, args, kwargs)
+        return (time.perf_counter() - started) / count * 1e6
@@ -0,0 +1,311 @@
+import csv
+import hashlib
+import json
+import multiprocessing
+import random
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+from store_products.management.commands.populate_db import (
+    ADDRESSES,
+    ALL_PRODUCTS,
+    CATEGORIES,
+    FIRST_NAMES,
+    LAST_NAMES,
+    PAYMENT_STATUSES,
+    PRICE_RANGES,
+    STATUSES,
+)
+
+# Rows are generated in blocks of consecutive IDs, each from its own random
+# stream, so the data depends on --seed only and not on the number of shards.
+BLOCK_SIZE = 10000
+
+# Database columns written to each shard, in order. `load_shards` fills in
+# the remaining columns (timestamps, password, flags) from the manifest.
+COLUMNS = {
+    "users": ["id", "username", "first_name", "last_name", "email"],
+    "products": [
+        "id",
+        "name",
+        "description",
+        "price",
+        "is_available",
+        "stock_quantity",
+    ],
+    "orders": [
+        "id",
+        "user_id",
+        "status",
+        "total_amount",
+        "shipping_address",
+        "payment_status",
+        "created_at",
+    ],
+    "order_items": ["order_id", "product_id", "quantity", "price_at_time"],
+}
+
+
+def product_attributes(seed, product_id):
+    """Return ``(category, price in cents, stock, is_available)``.
+
+    A pure function of the seed and product ID, so the worker generating an
+    order can price any product without sharing state with other workers.
+    """
+    digest = hashlib.blake2b(f"{seed}:{product_id}".encode(), digest_size=8)
+    value = int.from_bytes(digest.digest(), "big")
+    value, category_index = divmod(value, len(CATEGORIES))
+    category = CATEGORIES[category_index]
+    low, high = (round(bound * 100) for bound in PRICE_RANGES[category])
+    value, offset = divmod(value, high - low + 1)
+    value, stock = divmod(value, 96)
+    return category, low + offset, 5 + stock, value % 4 != 0
+
+
+def format_cents(cents):
+    return f"{cents // 100}.{cents % 100:02d}"
+
+
+class ShardWriter:
+    """Write rows as headerless CSV or as one compact JSON array per line"""
+
+    def __init__(self, path, fmt):
+        self.file = open(path, "w", newline="")
+        if fmt == "csv":
+            self.writerow = csv.writer(self.file).writerow
+        else:
+            self.writerow = self.write_json
+
+    def write_json(self, row):
+        self.file.write(json.dumps(row, separators=(",", ":")))
+        self.file.write("\n")
+
+    def close(self):
+        self.file.close()
+
+
+def block_ranges(total, first_block, last_block):
+    """Yield ``(block, first_id, last_id)`` for blocks of IDs 1..total"""
+    for block in range(first_block, last_block):
+        first_id = block * BLOCK_SIZE + 1
+        last_id = min(total, (block + 1) * BLOCK_SIZE)
+        if first_id > last_id:
+            break
+        yield block, first_id, last_id
+
+
+def generate_shard(job):
+    """Write the users, products and orders of one shard, return row counts"""
+    shard, config = job
+    seed = config["seed"]
+    fmt = config["format"]
+    output = Path(config["output_dir"])
+    counts = dict.fromkeys(COLUMNS, 0)
+    writers = {
+        table: ShardWriter(output / f"{table}-{shard:04d}.{fmt}", fmt)
+        for table in COLUMNS
+    }
+    try:
+        for table, total in (
+            ("users", config["users"]),
+            ("products", config["products"]),
+            ("orders", config["orders"]),
+        ):
+            blocks = -(-total // BLOCK_SIZE)
+            first_block = blocks * shard // config["shards"]
+            last_block = blocks * (shard + 1) // config["shards"]
+            for block, first_id, last_id in block_ranges(
+                total, first_block, last_block
+            ):
+                rng = random.Random(f"{seed}:{table}:{block}")
+                GENERATORS[table](
+                    rng, config, writers, counts, range(first_id, last_id + 1)
+                )
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return counts
+
+
+def generate_users(rng, config, writers, counts, ids):
+    writerow = writers["users"].writerow
+    for user_id in ids:
+        first_name = rng.choice(FIRST_NAMES)
+        last_name = rng.choice(LAST_NAMES)
+        username = f"{first_name.lower()}{last_name.lower()}{user_id}"
+        writerow([user_id, username, first_name, last_name, f"{username}@example.com"])
+    counts["users"] += len(ids)
+
+
+def generate_products(rng, config, writers, counts, ids):
+    writerow = writers["products"].writerow
+    for product_id in ids:
+        category, cents, stock, is_available = product_attributes(
+            config["seed"], product_id
+        )
+        if product_id <= len(ALL_PRODUCTS):
+            name = ALL_PRODUCTS[product_id - 1]
+        else:
+            name = f"Product {product_id}"
+        description = (
+            f"High-quality {name.lower()} in {category.lower()} category. "
+            f"Perfect for everyday use with excellent durability and performance."
+        )
+        writerow(
+            [
+                product_id,
+                name,
+                description,
+                format_cents(cents),
+                int(is_available),
+                stock,
+            ]
+        )
+    counts["products"] += len(ids)
+
+
+def generate_orders(rng, config, writers, counts, ids):
+    seed = config["seed"]
+    products = config["products"]
+    created_at = config["created_at"]
+    write_order = writers["orders"].writerow
+    write_item = writers["order_items"].writerow
+    for order_id in ids:
+        num_items = min(rng.randint(1, 5), products)
+        items = []
+        for _ in range(10):
+            for product_id in rng.sample(range(1, products + 1), num_items):
+                _, cents, _, is_available = product_attributes(seed, product_id)
+                if is_available:
+                    items.append((product_id, rng.randint(1, 3), cents))
+            if items:
+                break
+        if not items:
+            continue
+        total = 0
+        for product_id, quantity, cents in items:
+            write_item([order_id, product_id, quantity, format_cents(cents)])
+            total += quantity * cents
+        write_order(
+            [
+                order_id,
+                rng.randint(1, config["users"]),
+                rng.choice(STATUSES),
+                format_cents(total),
+                rng.choice(ADDRESSES),
+                rng.choice(PAYMENT_STATUSES),
+                created_at[rng.randint(0, 30)],
+            ]
+        )
+        counts["orders"] += 1
+        counts["order_items"] += len(items)
+
+
+GENERATORS = {
+    "users": generate_users,
+    "products": generate_products,
+    "orders": generate_orders,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate users, products and orders as CSV or NDJSON shards in "
+        "parallel worker processes, for loading with load_shards"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output_dir", help="Directory to write the shards to")
+        parser.add_argument(
+            "--users",
+            type=int,
+            default=10000,
+            help="Number of users to generate (default: 10000)",
+        )
+        parser.add_argument(
+            "--products",
+            type=int,
+            default=100000,
+            help="Number of products to generate (default: 100000)",
+        )
+        parser.add_argument(
+            "--orders",
+            type=int,
+            default=1000000,
+            help="Number of orders to generate (default: 1000000)",
+        )
+        parser.add_argument(
+            "--shards",
+            type=int,
+            default=multiprocessing.cpu_count(),
+            help="Number of shards, each generated by its own worker process "
+            "(default: number of CPUs)",
+        )
+        parser.add_argument(
+            "--format",
+            choices=["csv", "ndjson"],
+            default="csv",
+            help="Shard file format (default: csv)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed; the same seed always produces the same rows "
+            "(default: 0)",
+        )
+
+    def handle(self, *args, **options):
+        if options["users"] < 1 or options["products"] < 1:
+            raise CommandError("At least one user and one product are required")
+        output = Path(options["output_dir"])
+        output.mkdir(parents=True, exist_ok=True)
+        if (output / "manifest.json").exists():
+            raise CommandError(f"{output} already contains shards")
+
+        now = timezone.now()
+        config = {
+            "seed": options["seed"],
+            "format": options["format"],
+            "output_dir": str(output),
+            "shards": options["shards"],
+            "users": options["users"],
+            "products": options["products"],
+            "orders": options["orders"],
+            # Values as stored by the database backend, written verbatim
+            "created_at": [
+                str(connection.ops.adapt_datetimefield_value(now - timedelta(days=d)))
+                for d in range(31)
+            ],
+        }
+
+        started = time.monotonic()
+        with multiprocessing.Pool(options["shards"]) as pool:
+            results = pool.map(
+                generate_shard, [(shard, config) for shard in range(config["shards"])]
+            )
+        counts = {table: sum(result[table] for result in results) for table in COLUMNS}
+
+        manifest = {
+            "seed": options["seed"],
+            "format": options["format"],
+            "shards": options["shards"],
+            "counts": counts,
+            "columns": COLUMNS,
+            "now": str(connection.ops.adapt_datetimefield_value(now)),
+            "password": make_password("testpass123"),
+        }
+        with open(output / "manifest.json", "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Generated {', '.join(f'{n} {t}' for t, n in counts.items())} "
+                f"in {options['shards']} shards in {time.monotonic() - started:.1f}s"
+            )
+        )
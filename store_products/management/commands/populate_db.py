@@ -1,11 +1,147 @@
-from django.core.management.base import BaseCommand
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.contrib.auth.hashers import make_password
 from django.contrib.auth.models import User
+from django.db import connections, transaction
+from store_products import sharding
+from store_products.cache import invalidate_catalog
+from store_products.changes import record_deletions
 from store_products.models import Products, Order, OrderItem
+from array import array
 from decimal import Decimal
 import random
 from datetime import datetime, timedelta
 from django.utils import timezone
 
+FIRST_NAMES = [
+    "John",
+    "Jane",
+    "Mike",
+    "Sarah",
+    "David",
+    "Emily",
+    "Chris",
+    "Lisa",
+    "Robert",
+    "Maria",
+    "James",
+    "Anna",
+    "Michael",
+    "Emma",
+    "William",
+]
+
+LAST_NAMES = [
+    "Smith",
+    "Johnson",
+    "Williams",
+    "Brown",
+    "Jones",
+    "Garcia",
+    "Miller",
+    "Davis",
+    "Rodriguez",
+    "Martinez",
+    "Hernandez",
+    "Lopez",
+    "Gonzalez",
+]
+
+ELECTRONICS = [
+    "iPhone 15 Pro",
+    "Samsung Galaxy S24",
+    "MacBook Pro M3",
+    "Dell XPS 13",
+    "iPad Air",
+    "Sony WH-1000XM5",
+    "AirPods Pro",
+    "Nintendo Switch",
+    "PlayStation 5",
+    "Xbox Series X",
+    "Apple Watch Series 9",
+    "Kindle Oasis",
+]
+
+CLOTHING = [
+    "Nike Air Max 270",
+    "Adidas Ultraboost 22",
+    "Levi's 501 Jeans",
+    "North Face Jacket",
+    "Under Armour T-Shirt",
+    "Converse Chuck Taylor",
+    "Polo Ralph Lauren Shirt",
+    "Zara Dress",
+    "H&M Sweater",
+    "Uniqlo Hoodie",
+]
+
+HOME_GARDEN = [
+    "Dyson V15 Vacuum",
+    "Instant Pot Duo 7-in-1",
+    "KitchenAid Stand Mixer",
+    "Philips Air Fryer",
+    "Roomba i7+",
+    "Nest Thermostat",
+    "Ring Doorbell",
+    "Shark Navigator Vacuum",
+    "Cuisinart Coffee Maker",
+    "Vitamix Blender",
+]
+
+BOOKS = [
+    "The Great Gatsby",
+    "To Kill a Mockingbird",
+    "1984",
+    "Pride and Prejudice",
+    "The Catcher in the Rye",
+    "Lord of the Flies",
+    "Harry Potter Series",
+    "The Hobbit",
+    "Dune",
+    "The Alchemist",
+    "Think and Grow Rich",
+]
+
+SPORTS = [
+    "Wilson Tennis Racket",
+    "Spalding Basketball",
+    "Nike Soccer Ball",
+    "Callaway Golf Clubs",
+    "Yeti Cooler",
+    "Patagonia Backpack",
+    "Coleman Tent",
+    "REI Sleeping Bag",
+    "Hydro Flask Water Bottle",
+]
+
+ADDRESSES = [
+    "123 Main St, New York, NY 10001",
+    "456 Oak Ave, Los Angeles, CA 90210",
+    "789 Pine Rd, Chicago, IL 60601",
+    "321 Elm St, Houston, TX 77001",
+    "654 Maple Dr, Phoenix, AZ 85001",
+    "987 Cedar Ln, Philadelphia, PA 19101",
+    "147 Birch Way, San Antonio, TX 78201",
+    "258 Spruce St, San Diego, CA 92101",
+    "369 Willow Ave, Dallas, TX 75201",
+    "741 Poplar Rd, San Jose, CA 95101",
+]
+
+ALL_PRODUCTS = ELECTRONICS + CLOTHING + HOME_GARDEN + BOOKS + SPORTS
+
+# Realistic price range for each category
+PRICE_RANGES = {
+    "Electronics": (99.99, 2999.99),
+    "Clothing": (19.99, 299.99),
+    "Home & Garden": (29.99, 899.99),
+    "Books": (9.99, 49.99),
+    "Sports": (24.99, 599.99),
+}
+CATEGORIES = list(PRICE_RANGES)
+
+STATUSES = ["pending", "confirmed", "shipped", "delivered", "cancelled"]
+PAYMENT_STATUSES = ["pending", "completed", "failed"]
+
 
 class Command(BaseCommand):
     help = "Populate database with dummy data for testing"
@@ -32,16 +168,52 @@ class Command(BaseCommand):
         parser.add_argument(
             "--clear", action="store_true", help="Clear existing data before populating"
         )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help="Write rows with bulk inserts, for seeding millions of rows",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Rows per bulk insert and transaction in --bulk mode (default: 5000)",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            help="Random seed, for generating the same data on every run",
+        )
 
     def handle(self, *args, **options):
+        # Orders are placed by the users created in this run
+        if options["orders"] > 0 and options["users"] < 1:
+            raise CommandError("--orders needs at least one user, set --users")
+        self.rng = random.Random(options["seed"])
+
         if options["clear"]:
             self.stdout.write(self.style.WARNING("Clearing existing data..."))
-            OrderItem.objects.all().delete()
-            Order.objects.all().delete()
+            for alias in sharding.databases():
+                OrderItem.objects.using(alias).all().delete()
+                Order.objects.using(alias).all().delete()
+            record_deletions(Products.objects.values_list("pk", flat=True))
             Products.objects.all().delete()
             User.objects.filter(is_superuser=False).delete()
+            invalidate_catalog()
             self.stdout.write(self.style.SUCCESS("Existing data cleared."))
 
+        if options["bulk"]:
+            self.populate_bulk(
+                options["users"],
+                options["products"],
+                options["orders"],
+                options["batch_size"],
+            )
+            call_command("refresh_popularity", all_time=True, stdout=self.stdout)
+            invalidate_catalog()
+            self.stdout.write(self.style.SUCCESS("Database populated successfully!"))
+            return
+
         # Create users
         self.stdout.write("Creating users...")
         users = self.create_users(options["users"])
@@ -63,47 +235,16 @@ class Command(BaseCommand):
             self.style.SUCCESS(f"Successfully created {len(orders)} orders")
         )
 
+        call_command("refresh_popularity", all_time=True, stdout=self.stdout)
         self.stdout.write(self.style.SUCCESS("Database populated successfully!"))
 
     def create_users(self, count):
         """Create dummy users"""
         users = []
-        first_names = [
-            "John",
-            "Jane",
-            "Mike",
-            "Sarah",
-            "David",
-            "Emily",
-            "Chris",
-            "Lisa",
-            "Robert",
-            "Maria",
-            "James",
-            "Anna",
-            "Michael",
-            "Emma",
-            "William",
-        ]
-        last_names = [
-            "Smith",
-            "Johnson",
-            "Williams",
-            "Brown",
-            "Jones",
-            "Garcia",
-            "Miller",
-            "Davis",
-            "Rodriguez",
-            "Martinez",
-            "Hernandez",
-            "Lopez",
-            "Gonzalez",
-        ]
 
         for i in range(count):
-            first_name = random.choice(first_names)
-            last_name = random.choice(last_names)
+            first_name = self.rng.choice(FIRST_NAMES)
+            last_name = self.rng.choice(LAST_NAMES)
             username = f"{first_name.lower()}{last_name.lower()}{i+1}"
             email = f"{username}@example.com"
 
@@ -118,116 +259,40 @@ class Command(BaseCommand):
 
         return users
 
+    def product_fields(self, i):
+        """Return ``(name, description, price)`` for the i-th dummy product"""
+        if i < len(ALL_PRODUCTS):
+            name = ALL_PRODUCTS[i]
+        else:
+            name = f"Product {i+1}"
+
+        category = self.rng.choice(CATEGORIES)
+
+        # Generate realistic prices based on category, rounded to 2 places
+        price = Decimal(round(self.rng.uniform(*PRICE_RANGES[category]) * 100))
+        price = price.scaleb(-2)
+
+        description = (
+            f"High-quality {name.lower()} in {category.lower()} category. "
+            f"Perfect for everyday use with excellent durability and performance."
+        )
+        return name, description, price
+
     def create_products(self, count):
         """Create dummy products"""
         products = []
 
-        # Product categories and names
-        electronics = [
-            "iPhone 15 Pro",
-            "Samsung Galaxy S24",
-            "MacBook Pro M3",
-            "Dell XPS 13",
-            "iPad Air",
-            "Sony WH-1000XM5",
-            "AirPods Pro",
-            "Nintendo Switch",
-            "PlayStation 5",
-            "Xbox Series X",
-            "Apple Watch Series 9",
-            "Kindle Oasis",
-        ]
-
-        clothing = [
-            "Nike Air Max 270",
-            "Adidas Ultraboost 22",
-            "Levi's 501 Jeans",
-            "North Face Jacket",
-            "Under Armour T-Shirt",
-            "Converse Chuck Taylor",
-            "Polo Ralph Lauren Shirt",
-            "Zara Dress",
-            "H&M Sweater",
-            "Uniqlo Hoodie",
-        ]
-
-        home_garden = [
-            "Dyson V15 Vacuum",
-            "Instant Pot Duo 7-in-1",
-            "KitchenAid Stand Mixer",
-            "Philips Air Fryer",
-            "Roomba i7+",
-            "Nest Thermostat",
-            "Ring Doorbell",
-            "Shark Navigator Vacuum",
-            "Cuisinart Coffee Maker",
-            "Vitamix Blender",
-        ]
-
-        books = [
-            "The Great Gatsby",
-            "To Kill a Mockingbird",
-            "1984",
-            "Pride and Prejudice",
-            "The Catcher in the Rye",
-            "Lord of the Flies",
-            "Harry Potter Series",
-            "The Hobbit",
-            "Dune",
-            "The Alchemist",
-            "Think and Grow Rich",
-        ]
-
-        sports = [
-            "Wilson Tennis Racket",
-            "Spalding Basketball",
-            "Nike Soccer Ball",
-            "Callaway Golf Clubs",
-            "Yeti Cooler",
-            "Patagonia Backpack",
-            "Coleman Tent",
-            "REI Sleeping Bag",
-            "Hydro Flask Water Bottle",
-        ]
-
-        all_products = electronics + clothing + home_garden + books + sports
-
-        categories = ["Electronics", "Clothing", "Home & Garden", "Books", "Sports"]
-
         for i in range(count):
-            if i < len(all_products):
-                name = all_products[i]
-            else:
-                name = f"Product {i+1}"
-
-            category = random.choice(categories)
-
-            # Generate realistic prices based on category
-            if category == "Electronics":
-                price = Decimal(random.uniform(99.99, 2999.99))
-            elif category == "Clothing":
-                price = Decimal(random.uniform(19.99, 299.99))
-            elif category == "Home & Garden":
-                price = Decimal(random.uniform(29.99, 899.99))
-            elif category == "Books":
-                price = Decimal(random.uniform(9.99, 49.99))
-            else:  # Sports
-                price = Decimal(random.uniform(24.99, 599.99))
-
-            # Round to 2 decimal places
-            price = price.quantize(Decimal("0.01"))
-
-            description = (
-                f"High-quality {name.lower()} in {category.lower()} category. "
-                f"Perfect for everyday use with excellent durability and performance."
-            )
+            name, description, price = self.product_fields(i)
 
             product = Products.objects.create(
                 name=name,
                 description=description,
                 price=price,
-                stock_quantity=random.randint(5, 100),
-                is_available=random.choice([True, True, True, False]),  # 75% available
+                stock_quantity=self.rng.randint(5, 100),
+                is_available=self.rng.choice(
+                    [True, True, True, False]
+                ),  # 75% available
             )
             products.append(product)
 
@@ -237,41 +302,25 @@ class Command(BaseCommand):
         """Create dummy orders with order items"""
         orders = []
 
-        addresses = [
-            "123 Main St, New York, NY 10001",
-            "456 Oak Ave, Los Angeles, CA 90210",
-            "789 Pine Rd, Chicago, IL 60601",
-            "321 Elm St, Houston, TX 77001",
-            "654 Maple Dr, Phoenix, AZ 85001",
-            "987 Cedar Ln, Philadelphia, PA 19101",
-            "147 Birch Way, San Antonio, TX 78201",
-            "258 Spruce St, San Diego, CA 92101",
-            "369 Willow Ave, Dallas, TX 75201",
-            "741 Poplar Rd, San Jose, CA 95101",
-        ]
-
-        statuses = ["pending", "confirmed", "shipped", "delivered", "cancelled"]
-        payment_statuses = ["pending", "completed", "failed"]
-
         for i in range(count):
-            user = random.choice(users)
-            status = random.choice(statuses)
+            user = self.rng.choice(users)
+            status = self.rng.choice(STATUSES)
 
-            # Create order
-            order = Order.objects.create(
+            # Create order, on its user's shard
+            order = Order.objects.using(sharding.shard_for_user(user.pk)).create(
                 user=user,
                 status=status,
-                shipping_address=random.choice(addresses),
-                payment_status=random.choice(payment_statuses),
+                shipping_address=self.rng.choice(ADDRESSES),
+                payment_status=self.rng.choice(PAYMENT_STATUSES),
                 total_amount=Decimal("0.00"),  # Will be calculated below
             )
 
             # Add random created_at date (last 30 days)
-            days_ago = random.randint(0, 30)
+            days_ago = self.rng.randint(0, 30)
             order.created_at = timezone.now() - timedelta(days=days_ago)
 
             # Create order items (1-5 items per order)
-            num_items = random.randint(1, 5)
+            num_items = self.rng.randint(1, 5)
             available_products = [
                 p for p in products if p.is_available and p.stock_quantity > 0
             ]
@@ -279,17 +328,17 @@ class Command(BaseCommand):
             if not available_products:
                 continue
 
-            selected_products = random.sample(
+            selected_products = self.rng.sample(
                 available_products, min(num_items, len(available_products))
             )
 
             total_amount = Decimal("0.00")
 
             for product in selected_products:
-                quantity = random.randint(1, min(3, product.stock_quantity))
+                quantity = self.rng.randint(1, min(3, product.stock_quantity))
 
                 # Create order item
-                order_item = OrderItem.objects.create(
+                order_item = OrderItem.objects.using(order._state.db).create(
                     order=order,
                     product=product,
                     quantity=quantity,
@@ -310,3 +359,179 @@ class Command(BaseCommand):
             orders.append(order)
 
         return orders
+
+    def populate_bulk(self, user_count, product_count, order_count, batch_size):
+        """Create the same kind of data with bulk inserts.
+
+        The password is hashed once and shared, product stock and order
+        totals are computed in memory, and rows are written in chunks of
+        ``batch_size`` with one transaction per chunk.
+        """
+        # Continue numbering after existing users so usernames stay unique
+        first_user = User.objects.count()
+        password = make_password("testpass123")
+        user_ids = []
+        for start in range(0, user_count, batch_size):
+            users = []
+            for i in range(
+                first_user + start, first_user + min(start + batch_size, user_count)
+            ):
+                first_name = self.rng.choice(FIRST_NAMES)
+                last_name = self.rng.choice(LAST_NAMES)
+                username = f"{first_name.lower()}{last_name.lower()}{i+1}"
+                users.append(
+                    User(
+                        username=username,
+                        email=f"{username}@example.com",
+                        password=password,
+                        first_name=first_name,
+                        last_name=last_name,
+                    )
+                )
+            with transaction.atomic():
+                user_ids.extend(user.id for user in User.objects.bulk_create(users))
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully created {user_count} users")
+        )
+
+        # Only what order generation needs is kept per product, in compact
+        # arrays rather than model instances, so millions of rows fit in memory.
+        product_ids = array("q")
+        prices = []
+        stock = array("q")
+        available = bytearray()
+        for start in range(0, product_count, batch_size):
+            products = []
+            for i in range(start, min(start + batch_size, product_count)):
+                name, description, price = self.product_fields(i)
+                products.append(
+                    Products(
+                        name=name,
+                        description=description,
+                        price=price,
+                        stock_quantity=self.rng.randint(5, 100),
+                        is_available=self.rng.choice([True, True, True, False]),
+                    )
+                )
+            with transaction.atomic():
+                Products.objects.bulk_create(products)
+            for product in products:
+                product_ids.append(product.id)
+                prices.append(product.price)
+                stock.append(product.stock_quantity)
+                available.append(product.is_available)
+        self.stdout.write(
+            self.style.SUCCESS(f"Successfully created {product_count} products")
+        )
+
+        touched = bytearray(len(product_ids))
+        created = 0
+        now = timezone.now()
+        for start in range(0, order_count, batch_size):
+            orders, order_items, created_at = [], [], []
+            for _ in range(min(batch_size, order_count - start)):
+                items = self.pick_items(product_ids, available, stock, touched)
+                if not items:
+                    continue
+                order = Order(
+                    user_id=self.rng.choice(user_ids),
+                    status=self.rng.choice(STATUSES),
+                    shipping_address=self.rng.choice(ADDRESSES),
+                    payment_status=self.rng.choice(PAYMENT_STATUSES),
+                    total_amount=sum(
+                        prices[index] * quantity for index, quantity in items
+                    ),
+                )
+                orders.append(order)
+                order_items.append(items)
+                created_at.append(now - timedelta(days=self.rng.randint(0, 30)))
+            # Each order goes to its user's shard, in one transaction per shard
+            by_shard = {}
+            for row in zip(orders, order_items, created_at):
+                by_shard.setdefault(sharding.shard_for_user(row[0].user_id), []).append(
+                    row
+                )
+            for alias, rows in by_shard.items():
+                self.create_bulk_orders(alias, rows, product_ids, prices)
+            created += len(orders)
+
+        # Write the stock left after all orders, for every product ordered
+        sold = [index for index in range(len(product_ids)) if touched[index]]
+        for start in range(0, len(sold), batch_size):
+            with transaction.atomic():
+                self.executemany(
+                    Products,
+                    "stock_quantity",
+                    [
+                        (stock[index], product_ids[index])
+                        for index in sold[start : start + batch_size]
+                    ],
+                )
+        self.stdout.write(self.style.SUCCESS(f"Successfully created {created} orders"))
+
+    def create_bulk_orders(self, using, rows, product_ids, prices):
+        """Insert ``(order, items, created_at)`` rows into database ``using``"""
+        orders = [order for order, _, _ in rows]
+        with transaction.atomic(using=using):
+            Order.objects.using(using).bulk_create(orders)
+            OrderItem.objects.using(using).bulk_create(
+                OrderItem(
+                    order=order,
+                    product_id=product_ids[index],
+                    quantity=quantity,
+                    price_at_time=prices[index],
+                )
+                for order, items, _ in rows
+                for index, quantity in items
+            )
+            # bulk_create stamps created_at with the current time
+            self.executemany(
+                Order,
+                "created_at",
+                [(timestamp, order.id) for order, _, timestamp in rows],
+                using,
+            )
+
+    def pick_items(self, product_ids, available, stock, touched):
+        """Return ``[(product index, quantity), ...]`` for one order.
+
+        Takes the stock from the in-memory ``stock`` array and marks the
+        products in ``touched``. Returns an empty list when no sampled
+        product is available.
+        """
+        num_items = min(self.rng.randint(1, 5), len(product_ids))
+        # Sampling from the whole range and skipping unavailable products
+        # avoids rebuilding the list of available products for every order.
+        for _ in range(10):
+            indexes = [
+                index
+                for index in self.rng.sample(range(len(product_ids)), num_items)
+                if available[index] and stock[index] > 0
+            ]
+            if indexes:
+                break
+        items = []
+        for index in indexes:
+            quantity = self.rng.randint(1, min(3, stock[index]))
+            stock[index] -= quantity
+            touched[index] = 1
+            items.append((index, quantity))
+        return items
+
+    def executemany(self, model, column, rows, using="default"):
+        """Set ``column`` from ``(value, id)`` rows with one prepared UPDATE"""
+        connection = connections[using]
+        field = model._meta.get_field(column)
+        quote = connection.ops.quote_name
+        sql = (
+            f"UPDATE {quote(model._meta.db_table)} SET {quote(field.column)} = %s "
+            f"WHERE {quote(model._meta.pk.column)} = %s"
+        )
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                sql,
+                [
+                    (field.get_db_prep_value(value, connection), pk)
+                    for value, pk in rows
+                ],
+            )
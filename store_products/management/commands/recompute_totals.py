@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from store_products import outbox, sharding
+from store_products.models import Order
+from store_products.totals import drifted_totals
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every order's total from its items in SQL and correct "
+        "the ones that drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Orders checked and corrected per transaction (default: 5000)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report drifted totals without correcting them",
+        )
+
+    def handle(self, *args, **options):
+        checked = corrected = 0
+        for alias in sharding.shards():
+            for count, drifted in drifted_totals(options["chunk_size"], alias):
+                checked += count
+                corrected += len(drifted)
+                if drifted and not options["dry_run"]:
+                    self.correct(drifted, alias)
+
+        verb = "would be corrected" if options["dry_run"] else "corrected"
+        self.stdout.write(
+            self.style.SUCCESS(f"Checked {checked} orders, {corrected} totals {verb}")
+        )
+
+    def correct(self, drifted, using):
+        now = timezone.now()
+        for order in drifted:
+            order.updated_at = now
+        with transaction.atomic(using=using):
+            Order.objects.using(using).bulk_update(
+                drifted, ["total_amount", "updated_at"]
+            )
+            outbox.emit(
+                outbox.events(
+                    Order, [order.pk for order in drifted], outbox.UPDATED, now
+                ),
+                using=using,
+            )
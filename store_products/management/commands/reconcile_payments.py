@@ -0,0 +1,180 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+from django.utils import timezone
+from store_products import sharding
+from store_products.models import Order
+from store_products.payments import GATEWAY_PAYMENT_STATUS, get_razorpay_client
+
+payment_logger = logging.getLogger("payments")
+
+
+class Command(BaseCommand):
+    help = "Reconcile pending order payments against the Razorpay gateway"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=1000,
+            help="Number of orders fetched and written per chunk (default: 1000)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=16,
+            help="Maximum number of concurrent gateway calls (default: 16)",
+        )
+        parser.add_argument(
+            "--timeout",
+            type=float,
+            default=10.0,
+            help="Timeout in seconds for a single gateway call (default: 10)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            help="File used to store the last reconciled order ID",
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="Resume from the order ID stored in --checkpoint",
+        )
+        parser.add_argument(
+            "--base-url",
+            help="Gateway base URL, e.g. a local stub gateway for testing",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Fetch gateway statuses without writing any changes",
+        )
+
+    def handle(self, *args, **options):
+        self.timeout = options["timeout"]
+        self.client_options = {}
+        if options["base_url"]:
+            self.client_options["base_url"] = options["base_url"]
+        self.local = threading.local()
+
+        checkpoint = Path(options["checkpoint"]) if options["checkpoint"] else None
+        last_id = 0
+        if options["resume"]:
+            if checkpoint is None:
+                self.stderr.write(self.style.ERROR("--resume requires --checkpoint"))
+                return
+            last_id = self.load_checkpoint(checkpoint)
+            self.stdout.write(f"Resuming after order ID {last_id}")
+
+        queryset = (
+            Order.objects.filter(payment_status="pending", payment_id__isnull=False)
+            .exclude(payment_id="")
+            .order_by("id")
+            .only("id", "payment_id", "payment_status", "status")
+        )
+        # Orders are read from every shard, merged in ID order
+        total = sum(
+            sharding.fan_out(
+                lambda alias: sharding.on_shard(
+                    queryset.filter(id__gt=last_id), alias
+                ).count()
+            )
+        )
+        self.stdout.write(f"Reconciling {total} pending payments...")
+
+        processed = updated = failed = 0
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            while True:
+                # Keyset pagination keeps every chunk query cheap, no matter
+                # how far into the table we are.
+                chunk = sharding.gather(
+                    queryset.filter(id__gt=last_id), ["id"], options["chunk_size"]
+                )
+                if not chunk:
+                    break
+
+                changed = []
+                now = timezone.now()
+                for order, gateway_status in zip(
+                    chunk, pool.map(self.fetch_gateway_status, chunk)
+                ):
+                    if gateway_status is None:
+                        failed += 1
+                        continue
+                    payment_status = GATEWAY_PAYMENT_STATUS.get(gateway_status)
+                    if payment_status and payment_status != order.payment_status:
+                        order.payment_status = payment_status
+                        if order.status == "pending":
+                            order.status = "confirmed"
+                        order.updated_at = now
+                        changed.append(order)
+
+                if changed and not options["dry_run"]:
+                    self.save_changed(changed)
+
+                processed += len(chunk)
+                updated += len(changed)
+                last_id = chunk[-1].id
+                if checkpoint is not None and not options["dry_run"]:
+                    self.save_checkpoint(checkpoint, last_id)
+
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"{processed}/{total} orders processed, {updated} updated, "
+                    f"{failed} failed ({processed / elapsed:.1f} orders/s)"
+                )
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Reconciled {processed} orders in {elapsed:.1f}s: "
+                f"{updated} updated, {failed} failed"
+            )
+        )
+
+    def save_changed(self, orders):
+        """Write the changed orders back, one transaction per database"""
+        by_database = defaultdict(list)
+        for order in orders:
+            by_database[router.db_for_write(Order, instance=order)].append(order)
+        for using, changed in by_database.items():
+            with transaction.atomic(using=using):
+                Order.objects.using(using).bulk_update(
+                    changed, ["payment_status", "status", "updated_at"]
+                )
+
+    def fetch_gateway_status(self, order):
+        """Return the Razorpay status for an order, or None if the call failed"""
+        # requests sessions are not shared between threads, so every worker
+        # keeps its own client and connection pool.
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = get_razorpay_client(**self.client_options)
+        try:
+            return client.order.fetch(order.payment_id, timeout=self.timeout)["status"]
+        except Exception as e:
+            payment_logger.error(
+                "Error fetching Razorpay order %s for order ID %s: %s",
+                order.payment_id,
+                order.id,
+                e,
+            )
+            return None
+
+    def load_checkpoint(self, path):
+        if not path.exists():
+            return 0
+        return json.loads(path.read_text())["last_order_id"]
+
+    def save_checkpoint(self, path, last_id):
+        tmp_path = path.with_suffix(path.suffix + ".tmp")
+        tmp_path.write_text(json.dumps({"last_order_id": last_id}))
+        tmp_path.replace(path)
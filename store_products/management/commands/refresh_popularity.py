@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from store_products.cache import invalidate_catalog
+from store_products.models import Products
+from store_products.popularity import WINDOWS, counted_sales, stale_products
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the rolling sales windows behind ordering=popularity, so "
+        "orders that aged out stop counting; run it periodically"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all-time",
+            action="store_true",
+            help="Also recount all-time sales, reading every order item",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=5000,
+            help="Products compared and updated per transaction (default: 5000)",
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        fields = list(WINDOWS)
+        if options["all_time"]:
+            fields.append("sales_total")
+
+        # Orders placed between counting and writing are overwritten here;
+        # the next run counts them again
+        counted = counted_sales(timezone.now(), all_time=options["all_time"])
+        updated = 0
+        for stale in stale_products(counted, fields, options["batch_size"]):
+            if stale:
+                with transaction.atomic():
+                    Products.objects.bulk_update(stale, fields)
+                updated += len(stale)
+        if updated:
+            invalidate_catalog()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Counted sales of {len(counted)} products, updated {updated} "
+                f"in {elapsed:.2f}s"
+            )
+        )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from store_products import outbox
+
+
+class Command(BaseCommand):
+    help = (
+        "Deliver outbox events to the sinks configured in OUTBOX, in order "
+        "and at least once, deleting each batch once every sink took it"
+    )
+
+    def add_arguments(self, parser):
+        config = outbox.get_config()
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=config["BATCH_SIZE"],
+            help=f"Events per batch (default: {config['BATCH_SIZE']})",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=config["POLL_INTERVAL"],
+            help="Seconds to wait when the outbox is empty or a sink failed "
+            f"(default: {config['POLL_INTERVAL']})",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the outbox is drained instead of polling",
+        )
+
+    def handle(self, *args, **options):
+        sinks = outbox.load_sinks(outbox.get_config())
+        relayed = outbox.relay(
+            sinks,
+            options["batch_size"],
+            once=options["once"],
+            poll_interval=options["poll_interval"],
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Relayed {relayed} events to {', '.join(sinks) or 'no sinks'}"
+            )
+        )
@@ -0,0 +1,100 @@
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from store_products import sharding
+from store_products.models import Order, OrderItem
+
+
+class Command(BaseCommand):
+    help = (
+        "Move every order and its items to the shard of its user, after "
+        "shards were added or orders were loaded into default"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Orders checked per query and moved per transaction "
+            "(default: 1000)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Count the orders to move without moving them",
+        )
+
+    def handle(self, *args, **options):
+        if not sharding.enabled():
+            raise CommandError("No order shards configured, set DB_ORDER_SHARDS")
+
+        started = time.monotonic()
+        moved = 0
+        for source in sharding.databases():
+            count = self.drain(source, options["batch_size"], options["dry_run"])
+            if count:
+                self.stdout.write(f"{count} orders to move from {source}")
+            moved += count
+
+        verb = "would be moved" if options["dry_run"] else "moved"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{moved} orders {verb} in {time.monotonic() - started:.1f}s"
+            )
+        )
+
+    def drain(self, source, batch_size, dry_run):
+        """Move the orders on ``source`` that belong elsewhere, return how many"""
+        orders = Order.objects.using(source).order_by("pk").values_list("pk", "user_id")
+        moved = last_pk = 0
+        while True:
+            rows = list(orders.filter(pk__gt=last_pk)[:batch_size])
+            if not rows:
+                return moved
+            last_pk = rows[-1][0]
+            misplaced = defaultdict(list)
+            for pk, user_id in rows:
+                target = sharding.shard_for_user(user_id)
+                if target != source:
+                    misplaced[target].append(pk)
+            for target, order_ids in misplaced.items():
+                if not dry_run:
+                    self.move(order_ids, source, target)
+                moved += len(order_ids)
+
+    def move(self, order_ids, source, target):
+        """Copy orders and their items to ``target``, then delete them on ``source``.
+
+        Rows are copied as stored, keeping their IDs and timestamps, and
+        replace any copy a previous interrupted run left on ``target``. The
+        move writes no outbox events: the orders themselves did not change.
+        """
+        with transaction.atomic(using=target):
+            self.copy(Order, "id", order_ids, source, target)
+            self.copy(OrderItem, "order_id", order_ids, source, target)
+        with transaction.atomic(using=source):
+            OrderItem.objects.using(source).filter(order_id__in=order_ids).delete()
+            Order.objects.using(source).filter(pk__in=order_ids).delete()
+
+    def copy(self, model, column, ids, source, target):
+        quote = connections[source].ops.quote_name
+        table = quote(model._meta.db_table)
+        with connections[source].cursor() as cursor:
+            cursor.execute(
+                f"SELECT * FROM {table} WHERE {quote(column)} "
+                f"IN ({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
+            columns = [quote(description[0]) for description in cursor.description]
+            rows = cursor.fetchall()
+        if not rows:
+            return
+        with connections[target].cursor() as cursor:
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) "
+                f"VALUES ({', '.join(['%s'] * len(columns))})",
+                rows,
+            )
@@ -0,0 +1,46 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = "Copy the primary SQLite database into every configured read replica"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            help="Keep syncing every INTERVAL seconds instead of once",
+        )
+
+    def handle(self, *args, **options):
+        replicas = settings.DATABASE_READ_REPLICAS
+        if not replicas:
+            raise CommandError("No read replicas configured, set DB_READ_REPLICAS")
+
+        primary = settings.DATABASES["default"]["NAME"]
+        while True:
+            started = time.monotonic()
+            for alias in replicas:
+                self.copy(primary, settings.DATABASES[alias]["NAME"])
+            self.stdout.write(
+                f"Synced {len(replicas)} replicas in "
+                f"{(time.monotonic() - started) * 1000:.0f}ms"
+            )
+            if options["interval"] is None:
+                break
+            time.sleep(options["interval"])
+
+    def copy(self, source_name, target_name):
+        # The online backup API copies a consistent snapshot while the
+        # primary keeps serving writes, and replaces the target in a single
+        # transaction, so replica readers never see a half-written file.
+        source = sqlite3.connect(source_name)
+        target = sqlite3.connect(target_name, timeout=30)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,119 @@
+import bisect
+import threading
+
+# Latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = {}
+_registry_lock = threading.Lock()
+
+
+class Histogram:
+    """Thread-safe in-process histogram, one series per label set"""
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts plus a trailing +Inf bucket, sum, count
+                series = self.series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                key: ([*counts], total, count)
+                for key, (counts, total, count) in self.series.items()
+            }
+
+
+class Gauge:
+    """Thread-safe in-process gauge, one value per label set"""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.series[tuple(sorted(labels.items()))] = value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.series)
+
+
+def _register(cls, name, *args, **kwargs):
+    with _registry_lock:
+        metric = REGISTRY.get(name)
+        if metric is None:
+            metric = REGISTRY[name] = cls(name, *args, **kwargs)
+        return metric
+
+
+def histogram(name, documentation, buckets=DEFAULT_BUCKETS):
+    """Get or create the histogram registered under ``name``"""
+    return _register(Histogram, name, documentation, buckets=buckets)
+
+
+def gauge(name, documentation):
+    """Get or create the gauge registered under ``name``"""
+    return _register(Gauge, name, documentation)
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    with _registry_lock:
+        metrics = sorted(REGISTRY.values(), key=lambda metric: metric.name)
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        snapshot = metric.snapshot()
+        for labels in sorted(snapshot):
+            if metric.type == "gauge":
+                value = _format_value(snapshot[labels])
+                lines.append(f"{metric.name}{_format_labels(labels)} {value}")
+                continue
+            counts, total, count = snapshot[labels]
+            cumulative = 0
+            for bound, bucket_count in zip((*metric.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                bucket_labels = _format_labels((*labels, ("le", str(bound))))
+                lines.append(f"{metric.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(
+                f"{metric.name}_sum{_format_labels(labels)} {_format_value(total)}"
+            )
+            lines.append(f"{metric.name}_count{_format_labels(labels)} {count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,104 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from store_products import metrics
+
+request_duration = metrics.histogram(
+    "http_request_duration_seconds",
+    "Wall time spent handling a request, by route and method",
+)
+request_db_duration = metrics.histogram(
+    "http_request_db_duration_seconds",
+    "Time spent in database queries per request, by route",
+)
+request_db_queries = metrics.histogram(
+    "http_request_db_queries",
+    "Number of database queries per request, by route",
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+response_size = metrics.histogram(
+    "http_response_size_bytes",
+    "Size of non-streaming response bodies, by route",
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216),
+)
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` that counts queries and their duration.
+
+    The queries ``sharding.fan_out`` runs in parallel threads are counted
+    too, and their durations summed as if they had run one after another.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            with self.lock:
+                self.duration += duration
+                self.count += 1
+
+
+class RequestMetricsMiddleware:
+    """Measure every request and aggregate the results per route.
+
+    Records wall time, database query count and time, and response size into
+    the histograms in ``store_products.metrics`` (served at ``/api/metrics/``)
+    and adds a ``Server-Timing`` header to the response.
+
+    With ``REQUEST_METRICS["LOW_OVERHEAD"]`` only the wall time is recorded:
+    no database wrapper is installed and no header is added.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, "REQUEST_METRICS", {})
+        self.low_overhead = config.get("LOW_OVERHEAD", False)
+
+    def __call__(self, request):
+        if self.low_overhead:
+            started = time.perf_counter()
+            response = self.get_response(request)
+            request_duration.observe(
+                time.perf_counter() - started,
+                route=self.route(request),
+                method=request.method,
+            )
+            return response
+
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        route = self.route(request)
+        request_duration.observe(duration, route=route, method=request.method)
+        request_db_duration.observe(timer.duration, route=route)
+        request_db_queries.observe(timer.count, route=route)
+        if not response.streaming:
+            response_size.observe(len(response.content), route=route)
+
+        response["Server-Timing"] = (
+            f"total;dur={duration * 1000:.1f}, "
+            f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries"'
+        )
+        return response
+
+    def route(self, request):
+        # Use the URL pattern rather than the path to keep label cardinality
+        # bounded, e.g. "api/products/<int:product_id>/".
+        match = request.resolver_match
+        return match.route if match is not None else "unmatched"
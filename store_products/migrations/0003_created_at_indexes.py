@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 12:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        (
+            "store_products",
+            "0002_alter_products_options_products_stock_quantity_and_more",
+        ),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="order",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="orderitem",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name="products",
+            name="created_at",
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
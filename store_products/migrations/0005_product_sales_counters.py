@@ -0,0 +1,41 @@
+# Generated by Django 5.1.7 on 2026-10-19 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store_products", "0004_product_co_purchase"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="products",
+            name="sales_30d",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="products",
+            name="sales_7d",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="products",
+            name="sales_total",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name="products",
+            index=models.Index(
+                fields=["-sales_total", "id"], name="products_sales_total"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="products",
+            index=models.Index(fields=["-sales_7d", "id"], name="products_sales_7d"),
+        ),
+        migrations.AddIndex(
+            model_name="products",
+            index=models.Index(fields=["-sales_30d", "id"], name="products_sales_30d"),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.1.7 on 2026-10-19 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store_products", "0005_product_sales_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductTombstone",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("product_id", models.BigIntegerField()),
+                ("deleted_at", models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="products",
+            index=models.Index(fields=["updated_at", "id"], name="products_changes"),
+        ),
+        migrations.AddIndex(
+            model_name="producttombstone",
+            index=models.Index(
+                fields=["deleted_at", "product_id"], name="product_tombstone_changes"
+            ),
+        ),
+    ]
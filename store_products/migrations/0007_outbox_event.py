@@ -0,0 +1,51 @@
+# Generated by Django 5.1.7 on 2026-10-19 13:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("store_products", "0006_product_changes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutboxEvent",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "entity",
+                    models.CharField(
+                        choices=[
+                            ("product", "Product"),
+                            ("order", "Order"),
+                            ("order_item", "Order item"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("entity_id", models.BigIntegerField()),
+                (
+                    "op",
+                    models.CharField(
+                        choices=[
+                            ("created", "Created"),
+                            ("updated", "Updated"),
+                            ("deleted", "Deleted"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("version", models.BigIntegerField()),
+                ("created_at", models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -5,7 +5,10 @@ from django.contrib.auth.models import User
 
 
 class AuditData(models.Model):
-    created_at: models.DateTimeField = models.DateTimeField(auto_now_add=True)
+    # Indexed for date filters and ordering on large tables
+    created_at: models.DateTimeField = models.DateTimeField(
+        auto_now_add=True, db_index=True
+    )
     updated_at: models.DateTimeField = models.DateTimeField(auto_now=True)
 
     class Meta:
@@ -18,12 +21,25 @@ class Products(AuditData):
     price: models.DecimalField = models.DecimalField(max_digits=10, decimal_places=2)
     is_available: models.BooleanField = models.BooleanField(default=True)
     stock_quantity: models.IntegerField = models.IntegerField(default=0)
+    # Units sold by non-cancelled orders, kept by store_products.popularity
+    sales_total: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    sales_7d: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+    sales_30d: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
 
     def __str__(self):
         return self.name
 
     class Meta:
         verbose_name_plural = "Products"
+        # One per ordering=popularity window, so a sorted page is read in
+        # index order
+        indexes = [
+            models.Index(fields=["-sales_total", "id"], name="products_sales_total"),
+            models.Index(fields=["-sales_7d", "id"], name="products_sales_7d"),
+            models.Index(fields=["-sales_30d", "id"], name="products_sales_30d"),
+            # The changes feed reads in (updated_at, id) order
+            models.Index(fields=["updated_at", "id"], name="products_changes"),
+        ]
 
 
 class Order(AuditData):
@@ -35,8 +51,10 @@ class Order(AuditData):
         ("cancelled", "Cancelled"),
     ]
 
+    # No database constraints to users and products: with order shards,
+    # they live in another database (store_products.sharding)
     user: models.ForeignKey[User, User] = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name="orders"
+        User, on_delete=models.CASCADE, related_name="orders", db_constraint=False
     )
     status: models.CharField = models.CharField(
         max_length=20, choices=STATUS_CHOICES, default="pending"
@@ -62,7 +80,10 @@ class OrderItem(AuditData):
         Order, on_delete=models.CASCADE, related_name="order_items"
     )
     product: models.ForeignKey[Products, Products] = models.ForeignKey(
-        Products, on_delete=models.CASCADE, related_name="order_items"
+        Products,
+        on_delete=models.CASCADE,
+        related_name="order_items",
+        db_constraint=False,
     )
     quantity: models.PositiveIntegerField = models.PositiveIntegerField(default=1)
     price_at_time: models.DecimalField = models.DecimalField(
@@ -70,7 +91,7 @@ class OrderItem(AuditData):
     )  # Price when ordered
 
     def __str__(self):
-        return f"{self.product.name} x {self.quantity} in Order #{self.order.id}"
+        return f"{self.product.name} x {self.quantity} in Order #{self.order_id}"
 
     def get_total_price(self):
         return self.quantity * self.price_at_time
@@ -79,4 +100,81 @@ class OrderItem(AuditData):
         unique_together = ["order", "product"]
 
 
+class ProductCoPurchase(models.Model):
+    """How many orders contain both ``product`` and ``related``.
+
+    Each pair is stored in both directions, so the products bought with a
+    given one are a single index range scan, highest count first.
+    """
+
+    product: models.ForeignKey[Products, Products] = models.ForeignKey(
+        Products, on_delete=models.CASCADE, related_name="co_purchases"
+    )
+    related: models.ForeignKey[Products, Products] = models.ForeignKey(
+        Products, on_delete=models.CASCADE, related_name="+"
+    )
+    order_count: models.PositiveIntegerField = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.product_id} + {self.related_id}: {self.order_count} orders"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["product", "related"], name="unique_co_purchase_pair"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["product", "-order_count"], name="co_purchase_top_k")
+        ]
+
+
+class ProductTombstone(models.Model):
+    """A deleted product, reported by the changes feed"""
+
+    # Not a foreign key: the product row is gone
+    product_id: models.BigIntegerField = models.BigIntegerField()
+    deleted_at: models.DateTimeField = models.DateTimeField()
+
+    def __str__(self):
+        return f"Product #{self.product_id} deleted at {self.deleted_at}"
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["deleted_at", "product_id"], name="product_tombstone_changes"
+            )
+        ]
+
+
+class OutboxEvent(models.Model):
+    """A change to relay to downstream consumers, see store_products.outbox.
+
+    Written in the same transaction as the change and deleted once every
+    sink has received it, so the table only holds the undelivered backlog.
+    """
+
+    ENTITY_CHOICES = [
+        ("product", "Product"),
+        ("order", "Order"),
+        ("order_item", "Order item"),
+    ]
+    OP_CHOICES = [
+        ("created", "Created"),
+        ("updated", "Updated"),
+        ("deleted", "Deleted"),
+    ]
+
+    entity: models.CharField = models.CharField(max_length=20, choices=ENTITY_CHOICES)
+    entity_id: models.BigIntegerField = models.BigIntegerField()
+    op: models.CharField = models.CharField(max_length=10, choices=OP_CHOICES)
+    # Time of the change in microseconds; consumers drop events older than
+    # the version they already applied
+    version: models.BigIntegerField = models.BigIntegerField()
+    created_at: models.DateTimeField = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.entity} #{self.entity_id} {self.op}"
+
+
 # Products.objects.all()
@@ -0,0 +1,177 @@
+"""In-process pub/sub of order status changes, streamed as server-sent events.
+
+Order saves publish the order's ``status`` and ``payment_status`` once
+their transaction commits, to the topics of the order and of its user. Each
+open stream holds one ``Subscription``: a bounded ``asyncio.Queue`` on the
+event loop serving it, so an idle subscriber costs a queue and a pending
+heartbeat timer, with no thread or polling. Publishing from a worker thread
+hands events to that loop with ``call_soon_threadsafe``.
+
+The broker only reaches streams in its own process, so the writes and the
+streams must be served by the same ASGI process for events to arrive.
+"""
+
+import asyncio
+import json
+import threading
+
+from django.conf import settings
+from django.db import transaction
+
+DEFAULTS = {
+    # Seconds between keep-alive comments on an idle stream
+    "HEARTBEAT_SECONDS": 15,
+    # Events buffered per stream; a stream that falls further behind is
+    # told to refetch instead
+    "BUFFER_SIZE": 32,
+    # Milliseconds clients wait before reconnecting
+    "RETRY_MS": 3000,
+}
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "ORDER_EVENTS", {})}
+
+
+def order_topic(order_id):
+    return f"order:{order_id}"
+
+
+def user_topic(user_id):
+    return f"user:{user_id}"
+
+
+class Subscription:
+    """One stream's buffer, owned by the event loop that reads it"""
+
+    __slots__ = ("topics", "loop", "queue", "overflowed")
+
+    def __init__(self, topics, size):
+        self.topics = topics
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on self.loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    def __init__(self):
+        self.topics = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, topics, size):
+        """Register a subscription, from a coroutine on the loop that reads it"""
+        subscription = Subscription(topics, size)
+        with self.lock:
+            for topic in topics:
+                self.topics.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for topic in subscription.topics:
+                subscribers = self.topics.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.topics[topic]
+
+    def has_subscribers(self, *topics):
+        # Unlocked: a stale answer only delays or skips one publish
+        return any(topic in self.topics for topic in topics)
+
+    def publish(self, topics, event):
+        """Queue ``event`` for every subscriber of any of ``topics``"""
+        with self.lock:
+            subscriptions = set()
+            for topic in topics:
+                subscriptions.update(self.topics.get(topic, ()))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The loop closed; its stream is going away
+                pass
+
+
+broker = Broker()
+
+
+def order_state(order_id, user_id, status, payment_status):
+    return {
+        "order_id": order_id,
+        "user_id": user_id,
+        "status": status,
+        "payment_status": payment_status,
+    }
+
+
+def publish_on_commit(states, using=None):
+    """Publish order states once the current transaction commits.
+
+    Skipped entirely when no stream follows any of the orders, so writes
+    pay nothing while nobody is listening.
+    """
+    states = [
+        state
+        for state in states
+        if broker.has_subscribers(
+            order_topic(state["order_id"]), user_topic(state["user_id"])
+        )
+    ]
+    if not states:
+        return
+
+    def publish():
+        for state in states:
+            broker.publish(
+                [order_topic(state["order_id"]), user_topic(state["user_id"])],
+                state,
+            )
+
+    transaction.on_commit(publish, using=using)
+
+
+def format_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def stream(topics, snapshot=None):
+    """Server-sent events for ``topics``, starting with ``await snapshot()``.
+
+    Only changes are sent: a save that leaves an order's status and payment
+    status as last sent produces no event.
+    """
+    config = get_config()
+    subscription = broker.subscribe(topics, config["BUFFER_SIZE"])
+    sent = {}
+    try:
+        yield f"retry: {config['RETRY_MS']}\n\n"
+        # Read after subscribing, so no change falls between the two
+        for state in await snapshot() if snapshot else []:
+            sent[state["order_id"]] = state
+            yield format_event("status", state)
+        while True:
+            try:
+                state = await asyncio.wait_for(
+                    subscription.queue.get(), config["HEARTBEAT_SECONDS"]
+                )
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if sent.get(state["order_id"]) != state:
+                sent[state["order_id"]] = state
+                yield format_event("status", state)
+            if subscription.overflowed and subscription.queue.empty():
+                # Events were dropped: the client should refetch its orders
+                subscription.overflowed = False
+                sent.clear()
+                yield format_event("resync", {})
+    finally:
+        broker.unsubscribe(subscription)
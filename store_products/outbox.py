@@ -0,0 +1,209 @@
+"""Transactional outbox for product and order changes.
+
+Every change to ``Products``, ``Order`` and ``OrderItem`` adds an
+``OutboxEvent`` (entity, ID, op, version) in the transaction that makes it:
+``Model.save`` through the receivers in ``signals``, and bulk writes and
+deletes by calling ``emit`` or ``emit_queryset`` next to them. The
+``relay_outbox`` command reads the events in ID order, hands each batch to
+the configured sinks and deletes it once all of them accepted it.
+
+Delivery is at least once: a batch is sent again after a failure, including
+to the sinks that had already taken it, so sinks must be idempotent. A
+consumer keeps the highest ``version`` applied per entity and ignores
+events at or below it. Deleting an order or product also deletes its items
+without an event per item. ``populate_db`` and ``load_shards`` write no
+events; rebuild consumers after a bulk load.
+
+With order shards, the events of orders and items are written to the
+order's shard, in its transaction, and the relay drains every database in
+turn. Events from different databases arrive interleaved, which the
+``version`` check already tolerates.
+"""
+
+import json
+import logging
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Min
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from store_products import metrics, sharding
+from store_products.models import Order, OrderItem, OutboxEvent, Products
+
+logger = logging.getLogger("store_products")
+
+ENTITIES = {Products: "product", Order: "order", OrderItem: "order_item"}
+
+CREATED = "created"
+UPDATED = "updated"
+DELETED = "deleted"
+
+DEFAULTS = {
+    # Name -> {"BACKEND": dotted path of a sink class, "OPTIONS": kwargs}
+    "SINKS": {"log": {"BACKEND": "store_products.outbox.LoggingSink"}},
+    "BATCH_SIZE": 500,
+    # Seconds between polls of an empty outbox, and before retrying a
+    # batch a sink rejected
+    "POLL_INTERVAL": 1.0,
+}
+
+lag_seconds = metrics.gauge(
+    "outbox_lag_seconds",
+    "Age of the oldest undelivered outbox event (0 when drained)",
+)
+pending_events = metrics.gauge(
+    "outbox_pending_events",
+    "Outbox events waiting to be relayed",
+)
+
+
+def get_config():
+    return {**DEFAULTS, **getattr(settings, "OUTBOX", {})}
+
+
+def version_of(when):
+    """A change time as integer microseconds since the epoch"""
+    epoch = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+    return (when - epoch) // timedelta(microseconds=1)
+
+
+def events(model, ids, op, when=None):
+    """Unsaved events for ``ids`` of ``model``, to pass to ``emit``"""
+    when = when or timezone.now()
+    entity = ENTITIES[model]
+    version = version_of(when)
+    return [
+        OutboxEvent(
+            entity=entity, entity_id=pk, op=op, version=version, created_at=when
+        )
+        for pk in ids
+    ]
+
+
+def emit(events, using=None):
+    """Add events to the outbox of database ``using``, in one insert"""
+    OutboxEvent.objects.db_manager(using).bulk_create(events)
+
+
+def emit_queryset(queryset, op, when=None):
+    """Add an event for every row of ``queryset`` with one INSERT ... SELECT.
+
+    The rows are never loaded, and the events are written to the database
+    the queryset updates. Call it before an update that changes which rows
+    the queryset matches.
+    """
+    when = when or timezone.now()
+    connection = connections[sharding.write_db(queryset)]
+    quote = connection.ops.quote_name
+    pk_column = quote(queryset.model._meta.pk.column)
+    select, params = queryset.order_by().values("pk").query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(OutboxEvent._meta.db_table)} "
+            f"(entity, entity_id, op, version, created_at) "
+            f"SELECT %s, matched.{pk_column}, %s, %s, %s FROM ({select}) matched",
+            [
+                ENTITIES[queryset.model],
+                op,
+                version_of(when),
+                connection.ops.adapt_datetimefield_value(when),
+                *params,
+            ],
+        )
+
+
+def as_dict(event):
+    return {
+        "id": event.pk,
+        "entity": event.entity,
+        "entity_id": event.entity_id,
+        "op": event.op,
+        "version": event.version,
+        "created_at": event.created_at.isoformat(),
+    }
+
+
+class LoggingSink:
+    """Log each event at INFO, for development and as a template"""
+
+    def send(self, events):
+        for event in events:
+            logger.info("Outbox event %s", json.dumps(as_dict(event)))
+
+
+class JsonLinesSink:
+    """Append events to a file as JSON lines, for a local consumer to tail"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, "a") as f:
+            f.writelines(json.dumps(as_dict(event)) + "\n" for event in events)
+
+
+def load_sinks(config):
+    """Instantiate the sinks named in ``config["SINKS"]``"""
+    return {
+        name: import_string(sink["BACKEND"])(**sink.get("OPTIONS", {}))
+        for name, sink in config["SINKS"].items()
+    }
+
+
+def report_lag(now=None):
+    """Set the lag gauges from the undelivered events, return the lag"""
+    now = now or timezone.now()
+    lag = 0.0
+    pending = 0
+    for using in sharding.databases():
+        # The table only holds the backlog, so this stays cheap
+        backlog = OutboxEvent.objects.using(using).aggregate(
+            oldest=Min("created_at"), pending=Count("pk")
+        )
+        if backlog["oldest"] is not None:
+            lag = max(lag, (now - backlog["oldest"]).total_seconds())
+        pending += backlog["pending"]
+    lag_seconds.set(lag)
+    pending_events.set(pending)
+    return lag
+
+
+def relay(sinks, batch_size, once=False, poll_interval=1.0):
+    """Deliver events to every sink in ID order, return how many were relayed.
+
+    Each database's outbox is relayed a batch at a time, in turn. With
+    ``once``, return when every outbox is empty, or raise if a sink fails;
+    otherwise poll and retry forever.
+    """
+    relayed = 0
+    while True:
+        delivered = 0
+        for using in sharding.databases():
+            outbox = OutboxEvent.objects.using(using)
+            batch = list(outbox.order_by("pk")[:batch_size])
+            if not batch:
+                continue
+            lag_seconds.set(
+                max(0.0, (timezone.now() - batch[0].created_at).total_seconds())
+            )
+            try:
+                for name, sink in sinks.items():
+                    sink.send(batch)
+            except Exception:
+                logger.exception("Outbox sink %s failed, retrying the batch", name)
+                if once:
+                    raise
+                time.sleep(poll_interval)
+                continue
+            outbox.filter(pk__in=[event.pk for event in batch]).delete()
+            delivered += len(batch)
+        relayed += delivered
+        if not delivered:
+            report_lag()
+            if once:
+                break
+            time.sleep(poll_interval)
+    return relayed
@@ -0,0 +1,193 @@
+import logging
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from store_products import metrics
+
+payment_logger = logging.getLogger("payments")
+
+# Razorpay order status -> Order.payment_status. Statuses that are not listed
+# ("created", "attempted") mean the payment is still in flight.
+GATEWAY_PAYMENT_STATUS = {
+    "paid": "completed",
+}
+
+gateway_latency = metrics.histogram(
+    "payment_gateway_call_duration_seconds",
+    "Duration of payment gateway calls by outcome",
+)
+breaker_state = metrics.gauge(
+    "payment_gateway_circuit_state",
+    "Payment gateway circuit breaker state (0=closed, 1=half_open, 2=open)",
+)
+
+
+def get_razorpay_client(**options):
+    """Build a Razorpay client with the configured credentials.
+
+    ``options`` are passed through to ``razorpay.Client``, e.g. ``base_url``
+    to point the client at a local stub gateway. The SDK is imported here
+    rather than at module level to keep it out of worker startup.
+    """
+    import razorpay
+
+    return razorpay.Client(
+        auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET), **options
+    )
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the gateway while the circuit is open"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Fail fast when a downstream dependency is erroring or slow.
+
+    The breaker keeps the outcome of the last ``window_size`` calls. Once at
+    least ``minimum_calls`` have been recorded and either the failure rate or
+    the slow call rate reaches its threshold, the circuit opens and every call
+    raises ``CircuitOpenError`` for ``open_duration`` seconds. After that up to
+    ``half_open_calls`` trial calls are let through: if they all succeed the
+    circuit closes, any failure opens it again.
+
+    Exceptions in ``ignore_exceptions`` (classes or dotted paths) count as
+    successes.
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name,
+        window_size=20,
+        minimum_calls=10,
+        failure_rate_threshold=0.5,
+        slow_call_duration=2.0,
+        slow_call_rate_threshold=0.5,
+        open_duration=30.0,
+        half_open_calls=3,
+        ignore_exceptions=(),
+    ):
+        self.name = name
+        self.minimum_calls = minimum_calls
+        self.failure_rate_threshold = failure_rate_threshold
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate_threshold = slow_call_rate_threshold
+        self.open_duration = open_duration
+        self.half_open_calls = half_open_calls
+        self.ignore_exceptions = tuple(ignore_exceptions)
+        self._ignored = None
+
+        self.lock = threading.Lock()
+        self.outcomes = deque(maxlen=window_size)  # (failed, slow) pairs
+        self.state = self.CLOSED
+        self.opened_at = 0.0
+        self.trials_started = 0
+        self.trials_succeeded = 0
+        breaker_state.set(self.STATE_VALUES[self.state], breaker=self.name)
+
+    def call(self, func, *args, **kwargs):
+        """Call ``func`` through the breaker and record its outcome"""
+        self._before_call()
+        started = time.monotonic()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            # Client errors say nothing about the health of the dependency
+            failed = not isinstance(e, self.ignored_exceptions())
+            self._record(time.monotonic() - started, failed=failed)
+            raise
+        self._record(time.monotonic() - started, failed=False)
+        return result
+
+    def ignored_exceptions(self):
+        """``ignore_exceptions`` with dotted paths imported on first use"""
+        if self._ignored is None:
+            self._ignored = tuple(
+                import_string(exc) if isinstance(exc, str) else exc
+                for exc in self.ignore_exceptions
+            )
+        return self._ignored
+
+    def _before_call(self):
+        with self.lock:
+            if self.state == self.OPEN:
+                remaining = self.opened_at + self.open_duration - time.monotonic()
+                if remaining > 0:
+                    raise CircuitOpenError(self.name, remaining)
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self.trials_started >= self.half_open_calls:
+                    raise CircuitOpenError(self.name, self.open_duration)
+                self.trials_started += 1
+
+    def _record(self, duration, failed):
+        slow = duration >= self.slow_call_duration
+        gateway_latency.observe(
+            duration, breaker=self.name, outcome="failure" if failed else "success"
+        )
+        with self.lock:
+            if self.state == self.HALF_OPEN:
+                if failed or slow:
+                    self._transition(self.OPEN)
+                else:
+                    self.trials_succeeded += 1
+                    if self.trials_succeeded >= self.half_open_calls:
+                        self._transition(self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                return
+
+            self.outcomes.append((failed, slow))
+            if len(self.outcomes) < self.minimum_calls:
+                return
+            failure_rate = sum(f for f, _ in self.outcomes) / len(self.outcomes)
+            slow_rate = sum(s for _, s in self.outcomes) / len(self.outcomes)
+            if (
+                failure_rate >= self.failure_rate_threshold
+                or slow_rate >= self.slow_call_rate_threshold
+            ):
+                payment_logger.warning(
+                    "Circuit '%s' tripping: failure rate %.0f%%, slow call rate %.0f%%",
+                    self.name,
+                    failure_rate * 100,
+                    slow_rate * 100,
+                )
+                self._transition(self.OPEN)
+
+    def _transition(self, state):
+        # Must be called with self.lock held
+        payment_logger.warning("Circuit '%s' %s -> %s", self.name, self.state, state)
+        self.state = state
+        self.outcomes.clear()
+        self.trials_started = self.trials_succeeded = 0
+        if state == self.OPEN:
+            self.opened_at = time.monotonic()
+        breaker_state.set(self.STATE_VALUES[state], breaker=self.name)
+
+
+gateway_breaker = CircuitBreaker(
+    "razorpay",
+    ignore_exceptions=("razorpay.errors.BadRequestError",),
+    **getattr(settings, "RAZORPAY_CIRCUIT_BREAKER", {}),
+)
+
+
+def call_gateway(func, *args, **kwargs):
+    """Call a Razorpay client method through the circuit breaker.
+
+    The call is capped by the ``RAZORPAY_LATENCY_BUDGET`` setting so a
+    hanging gateway cannot hold a worker longer than the budget.
+    """
+    kwargs.setdefault("timeout", settings.RAZORPAY_LATENCY_BUDGET)
+    return gateway_breaker.call(func, *args, **kwargs)
@@ -0,0 +1,126 @@
+"""Per-product sales counters for sorting the catalog by popularity.
+
+``Products.sales_total``, ``sales_7d`` and ``sales_30d`` hold the units sold
+by non-cancelled orders, all time and over the last 7 and 30 days. Placing
+an order adds to all three in the stock update it already makes, and
+cancelling one takes its units back off. Orders age out of the rolling
+windows only when ``refresh_popularity`` recounts them, so between runs the
+windows may still include orders a little older than their length.
+"""
+
+from datetime import timedelta
+
+from django.db.models import Case, F, Q, Sum, Value, When
+from django.db.models.functions import Greatest
+from store_products import sharding
+from store_products.models import OrderItem, Products
+
+# Rolling window counters and their length in days
+WINDOWS = {"sales_7d": 7, "sales_30d": 30}
+SALES_FIELDS = ["sales_total", *WINDOWS]
+
+# ``ordering`` values accepted by get_products and the counter each sorts on
+ORDERINGS = {
+    "popularity": "sales_30d",
+    "popularity_7d": "sales_7d",
+    "popularity_all": "sales_total",
+}
+
+
+def order_by(ordering):
+    """Order by a counter, highest first, matching its index"""
+    return [f"-{ORDERINGS[ordering]}", "id"]
+
+
+def count_sale(product, quantity):
+    """Add a new order's units to ``product`` in memory, for a bulk update"""
+    for field in SALES_FIELDS:
+        setattr(product, field, getattr(product, field) + quantity)
+
+
+def sales_changes(order, order_items, sign, now):
+    """``update()`` arguments adding ``sign`` times the units of ``order``.
+
+    Windows that ``order`` is already older than are left alone, and
+    counters stop at zero.
+    """
+    units = Case(
+        *[When(pk=item.product_id, then=Value(item.quantity)) for item in order_items],
+        default=Value(0),
+    )
+    fields = ["sales_total"] + [
+        field
+        for field, days in WINDOWS.items()
+        if order.created_at >= now - timedelta(days=days)
+    ]
+    return {field: Greatest(F(field) + sign * units, Value(0)) for field in fields}
+
+
+def adjust_sales(order, order_items, sign, now):
+    """Add ``sign`` times the units of ``order`` to its products"""
+    if not order_items:
+        return 0
+    return Products.objects.filter(
+        pk__in=[item.product_id for item in order_items]
+    ).update(**sales_changes(order, order_items, sign, now), updated_at=now)
+
+
+def counted_sales(now, all_time=False):
+    """Units sold per product, counted from the order items.
+
+    Only the items of orders within the longest window are read unless
+    ``all_time`` is set, which also counts ``sales_total``.
+    """
+    items = OrderItem.objects.exclude(order__status="cancelled")
+    windows = {
+        field: Sum(
+            "quantity", filter=Q(order__created_at__gte=now - timedelta(days=days))
+        )
+        for field, days in WINDOWS.items()
+    }
+    if all_time:
+        windows["sales_total"] = Sum("quantity")
+    else:
+        longest = max(WINDOWS.values())
+        items = items.filter(order__created_at__gte=now - timedelta(days=longest))
+    rows = items.order_by().values("product").annotate(**windows)
+
+    def count(alias):
+        return list(sharding.on_shard(rows, alias))
+
+    # Each shard counts its own orders; a product sold on several is summed
+    counted = {}
+    for shard_rows in sharding.fan_out(count):
+        for row in shard_rows:
+            units = counted.setdefault(row.pop("product"), {})
+            for field, sold in row.items():
+                units[field] = units.get(field, 0) + (sold or 0)
+    return counted
+
+
+def stale_products(counted, fields, batch_size):
+    """Yield products whose ``fields`` differ from ``counted``, in batches.
+
+    Products with a nonzero counter are compared along with the counted
+    ones, so products that sold nothing recently fall back to zero.
+    """
+    nonzero = Q()
+    for field in fields:
+        nonzero |= Q(**{f"{field}__gt": 0})
+    ids = sorted(
+        set(counted)
+        | set(Products.objects.filter(nonzero).values_list("pk", flat=True))
+    )
+    for start in range(0, len(ids), batch_size):
+        stale = []
+        products = Products.objects.filter(pk__in=ids[start : start + batch_size])
+        for product in products.only(*fields).order_by():
+            units = counted.get(product.pk, {})
+            changed = False
+            for field in fields:
+                if getattr(product, field) != units.get(field, 0):
+                    setattr(product, field, units.get(field, 0))
+                    changed = True
+            if changed:
+                stale.append(product)
+        yield stale
@@ -0,0 +1,115 @@
+"""Index of products frequently bought together.
+
+``ProductCoPurchase`` holds, for every ordered pair of products, the number
+of non-cancelled orders containing both. ``build_range`` fills it from
+``OrderItem`` one range of orders at a time, with the pair counting done by
+the database; ``add_order`` and ``remove_order`` keep it current as orders
+are placed and cancelled. Both take the order's product IDs rather than
+reading its items, which may be on an order shard.
+"""
+
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from store_products.models import Order, OrderItem, ProductCoPurchase
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+
+def _upsert_sql():
+    quote = connection.ops.quote_name
+    table = quote(ProductCoPurchase._meta.db_table)
+    return (
+        f"INSERT INTO {table} (product_id, related_id, order_count) {{rows}} "
+        f"ON CONFLICT (product_id, related_id) DO UPDATE SET "
+        f"order_count = {table}.order_count + excluded.order_count"
+    )
+
+
+def _upsert_rows_sql():
+    return _upsert_sql().format(rows="VALUES (%s, %s, %s)")
+
+
+def _products_sql(product_ids):
+    """A ``p(id)`` table of ``product_ids``, for forming pairs"""
+    return f"WITH p(id) AS (VALUES {', '.join(['(%s)'] * len(product_ids))}) "
+
+
+def _pairs_sql(where):
+    """Pairs of distinct products sharing an order, with the orders counted"""
+    quote = connection.ops.quote_name
+    items = quote(OrderItem._meta.db_table)
+    orders = quote(Order._meta.db_table)
+    return (
+        f"SELECT a.product_id, b.product_id, COUNT(DISTINCT a.order_id) "
+        f"FROM {items} a "
+        f"JOIN {items} b ON b.order_id = a.order_id AND b.product_id != a.product_id "
+        f"JOIN {orders} o ON o.id = a.order_id "
+        f"WHERE {where} "
+        f"GROUP BY a.product_id, b.product_id"
+    )
+
+
+def build_range(first_order_id, last_order_id, using=DEFAULT_DB_ALIAS):
+    """Add the pairs of orders with IDs in ``[first, last)`` to the index.
+
+    ``using`` is the database holding the orders. The pairs of orders on a
+    shard are counted there and written to the index in one batch.
+    """
+    select = _pairs_sql("a.order_id >= %s AND a.order_id < %s AND o.status != %s")
+    params = [first_order_id, last_order_id, "cancelled"]
+    if using == DEFAULT_DB_ALIAS:
+        with connection.cursor() as cursor:
+            cursor.execute(_upsert_sql().format(rows=select), params)
+        return
+    with connections[using].cursor() as cursor:
+        cursor.execute(select, params)
+        pairs = cursor.fetchall()
+    with connection.cursor() as cursor:
+        cursor.executemany(_upsert_rows_sql(), pairs)
+
+
+def add_order(product_ids):
+    """Count the pairs of a newly placed or reinstated order.
+
+    One statement whatever the number of items, as the pairs are formed by
+    the database.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    select = "SELECT a.id, b.id, 1 FROM p a JOIN p b ON b.id != a.id WHERE true"
+    with connection.cursor() as cursor:
+        cursor.execute(
+            _upsert_sql().format(rows=_products_sql(product_ids) + select),
+            product_ids,
+        )
+
+
+def remove_order(product_ids):
+    """Uncount the pairs of a cancelled order.
+
+    Pairs that drop to zero are kept, and skipped by ``related_products``,
+    until the next rebuild; deleting them here would cost a second query on
+    every cancellation.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    table = connection.ops.quote_name(ProductCoPurchase._meta.db_table)
+    in_order = ", ".join(["%s"] * len(product_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"UPDATE {table} SET order_count = order_count - 1 "
+            f"WHERE order_count > 0 AND product_id != related_id "
+            f"AND product_id IN ({in_order}) AND related_id IN ({in_order})",
+            [*product_ids, *product_ids],
+        )
+
+
+def related_products(product_id, limit):
+    """The ``limit`` products most often ordered with ``product_id``"""
+    return list(
+        ProductCoPurchase.objects.filter(product_id=product_id, order_count__gt=0)
+        .select_related("related")
+        .order_by("-order_count")[:limit]
+    )
@@ -0,0 +1,101 @@
+"""Serve the OpenAPI document from memory.
+
+Generating the schema imports the drf_spectacular generator stack and
+inspects every view, so it is done at most once per process: on the first
+request, or by loading ``OPENAPI_SCHEMA_FILE`` written at build time with
+``manage.py spectacular --file``. The rendered document is served with an
+ETag so clients can revalidate without downloading it again.
+"""
+
+import hashlib
+import json
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.module_loading import import_string
+from django.views.decorators.http import require_safe
+
+CONTENT_TYPES = {
+    "yaml": "application/vnd.oai.openapi; charset=utf-8",
+    "json": "application/vnd.oai.openapi+json; charset=utf-8",
+}
+
+_lock = threading.Lock()
+_schema = None
+_documents = {}  # format -> (body, etag)
+
+
+def load_schema():
+    """Return the schema as a dict, from ``OPENAPI_SCHEMA_FILE`` if set"""
+    path = getattr(settings, "OPENAPI_SCHEMA_FILE", None)
+    if path:
+        with open(path) as f:
+            if str(path).endswith(".json"):
+                return json.load(f)
+            import yaml
+
+            return yaml.safe_load(f)
+
+    from drf_spectacular.generators import SchemaGenerator
+
+    return SchemaGenerator().get_schema(request=None, public=True)
+
+
+def get_document(fmt):
+    """Return ``(body, etag)`` of the schema rendered as ``fmt``"""
+    global _schema
+    document = _documents.get(fmt)
+    if document is not None:
+        return document
+    with _lock:
+        if fmt not in _documents:
+            from drf_spectacular.renderers import (
+                OpenApiJsonRenderer,
+                OpenApiYamlRenderer,
+            )
+
+            if _schema is None:
+                _schema = load_schema()
+            renderer = OpenApiJsonRenderer() if fmt == "json" else OpenApiYamlRenderer()
+            body = renderer.render(_schema, renderer_context={})
+            etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            _documents[fmt] = (body, etag)
+        return _documents[fmt]
+
+
+def clear_cache():
+    """Forget the generated schema, e.g. after changing the URLconf"""
+    global _schema
+    with _lock:
+        _schema = None
+        _documents.clear()
+
+
+@require_safe
+def schema_view(request):
+    fmt = request.GET.get("format")
+    if fmt not in CONTENT_TYPES:
+        fmt = "json" if "json" in request.headers.get("Accept", "") else "yaml"
+    body, etag = get_document(fmt)
+
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type=CONTENT_TYPES[fmt])
+    response["ETag"] = etag
+    response["Vary"] = "Accept"
+    return response
+
+
+def lazy_view(view_class, **initkwargs):
+    """Return a view that imports ``view_class`` on its first request"""
+    view = None
+
+    def wrapper(request, *args, **kwargs):
+        nonlocal view
+        if view is None:
+            view = import_string(view_class).as_view(**initkwargs)
+        return view(request, *args, **kwargs)
+
+    return wrapper
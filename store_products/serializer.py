@@ -1,11 +1,18 @@
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
 from rest_framework import serializers
+from store_products import outbox, sharding
+from store_products.cache import invalidate_catalog
 from store_products.models import Products, Order, OrderItem
+from store_products.popularity import SALES_FIELDS, count_sale
+from store_products.related import add_order
 
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Products
         fields = "__all__"
+        read_only_fields = SALES_FIELDS
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
@@ -50,6 +57,28 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ["id", "created_at", "updated_at"]
 
+    def validate_user(self, user):
+        if (
+            self.instance is not None
+            and sharding.enabled()
+            and sharding.shard_for_user(user.pk) != self.instance._state.db
+        ):
+            raise serializers.ValidationError(
+                "The order cannot move to a user on another order shard."
+            )
+        return user
+
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Orders annotated by totals.with_totals report the sum of their
+        # items, even if the stored total has drifted
+        computed_total = getattr(instance, "computed_total", None)
+        if computed_total is not None:
+            data["total_amount"] = self.fields["total_amount"].to_representation(
+                computed_total
+            )
+        return data
+
 
 class CreateOrderSerializer(serializers.ModelSerializer):
     order_items = serializers.ListField(
@@ -62,39 +91,70 @@ class CreateOrderSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         order_items_data = validated_data.pop("order_items")
-        order = Order.objects.create(**validated_data)
-
-        total_amount = 0
-        for item_data in order_items_data:
-            product_id = item_data.get("product_id")
-            quantity = int(item_data.get("quantity", 1))
-
-            try:
-                product = Products.objects.get(id=product_id)
+        shard = sharding.shard_for_user(validated_data["user"].pk)
+
+        with sharding.atomic(shard, DEFAULT_DB_ALIAS):
+            # Fetch all products up front instead of one query per item
+            products = Products.objects.select_for_update().in_bulk(
+                [item_data.get("product_id") for item_data in order_items_data]
+            )
+
+            total_amount = 0
+            order_items = []
+            for item_data in order_items_data:
+                product_id = item_data.get("product_id")
+                quantity = int(item_data.get("quantity", 1))
+
+                product = products.get(int(product_id)) if product_id else None
+                if product is None:
+                    raise serializers.ValidationError(
+                        f"Product with id {product_id} does not exist"
+                    )
                 if product.stock_quantity < quantity:
                     raise serializers.ValidationError(
                         f"Insufficient stock for {product.name}. Available: {product.stock_quantity}"
                     )
 
-                order_item = OrderItem.objects.create(
-                    order=order,
+                order_item = OrderItem(
                     product=product,
                     quantity=quantity,
                     price_at_time=product.price,
                 )
+                order_items.append(order_item)
 
                 # Update stock
                 product.stock_quantity -= quantity
-                product.save()
+                product.updated_at = timezone.now()
+                count_sale(product, quantity)
 
                 total_amount += order_item.get_total_price()
 
-            except Products.DoesNotExist:
-                raise serializers.ValidationError(
-                    f"Product with id {product_id} does not exist"
-                )
-
-        order.total_amount = total_amount
-        order.save()
+            # Totals are known before the order is written, so it is
+            # inserted once instead of inserted and then updated
+            order = Order.objects.using(shard).create(
+                total_amount=total_amount, **validated_data
+            )
+            for order_item in order_items:
+                order_item.order = order
+            OrderItem.objects.using(shard).bulk_create(order_items)
+            add_order([item.product_id for item in order_items])
+            Products.objects.bulk_update(
+                {item.product_id: item.product for item in order_items}.values(),
+                ["stock_quantity", "updated_at", *SALES_FIELDS],
+            )
+            item_events = outbox.events(
+                OrderItem, [item.pk for item in order_items], outbox.CREATED
+            )
+            product_events = outbox.events(
+                Products, {item.product_id for item in order_items}, outbox.UPDATED
+            )
+            # Each change's events go to its own database's outbox
+            if shard == DEFAULT_DB_ALIAS:
+                outbox.emit(item_events + product_events)
+            else:
+                outbox.emit(item_events, using=shard)
+                outbox.emit(product_events)
+            if any(product.stock_quantity == 0 for product in products.values()):
+                invalidate_catalog()
 
         return order
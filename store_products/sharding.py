@@ -0,0 +1,285 @@
+"""Horizontal sharding of orders by user.
+
+With ``DATABASE_ORDER_SHARDS`` set, every ``Order``, its ``OrderItem`` rows
+and their outbox events live on one of several databases, picked by a jump
+consistent hash of the order's ``user_id``. All of a user's orders share a
+shard, and growing from n to n + 1 shards only moves the users that now
+hash to the new one (``reshard_orders``). Users, products and everything
+else stay on ``default``, so orders reference them without a database
+constraint.
+
+``OrderShardRouter`` sends saved instances, new orders and related lookups
+to their shard. A queryset with no instance to go by is left to the other
+routers: bind it with ``on_shard``, or read every shard in parallel with
+``gather``. IDs are unique across shards: each shard numbers its rows from
+its own multiple of ``2 ** ID_BITS``, which also tells ``locate`` where to
+look first.
+
+Without shards, every helper here works on ``default`` alone, inline, and
+issues the same queries as the plain ORM calls.
+"""
+
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from functools import cmp_to_key
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import DEFAULT_DB_ALIAS, connections, router, transaction
+from django.http import Http404
+from store_products.models import Order, OrderItem
+
+# Rows a shard can number before reaching the next shard's range
+ID_BITS = 40
+
+SHARDED_MODELS = (Order, OrderItem)
+
+
+def enabled():
+    return bool(settings.DATABASE_ORDER_SHARDS)
+
+
+def shards():
+    """Aliases of the databases orders are placed on"""
+    return settings.DATABASE_ORDER_SHARDS or [DEFAULT_DB_ALIAS]
+
+
+def databases():
+    """Every database that may hold orders or outbox events.
+
+    ``default`` keeps the product events, and the orders placed before
+    sharding until ``reshard_orders`` moves them.
+    """
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *shards()]))
+
+
+def jump_hash(key, buckets):
+    """Lamping and Veach's jump consistent hash of ``key`` to a bucket.
+
+    Going from n to n + 1 buckets moves 1 / (n + 1) of the keys, all of
+    them into the new bucket.
+    """
+    key &= 0xFFFFFFFFFFFFFFFF
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for_user(user_id):
+    aliases = shards()
+    return aliases[jump_hash(int(user_id), len(aliases))]
+
+
+def id_base(alias):
+    """The ID that numbering on shard ``alias`` continues from, 0 elsewhere"""
+    if alias not in settings.DATABASE_ORDER_SHARDS:
+        return 0
+    return (settings.DATABASE_ORDER_SHARDS.index(alias) + 1) << ID_BITS
+
+
+def home_shard(pk):
+    """The shard that numbered ``pk``, or None for IDs from before sharding"""
+    index = (int(pk) >> ID_BITS) - 1
+    if 0 <= index < len(settings.DATABASE_ORDER_SHARDS):
+        return settings.DATABASE_ORDER_SHARDS[index]
+    return None
+
+
+def start_sequences(using):
+    """Move shard ``using``'s order and item numbering to its own range.
+
+    Run after every migrate. SQLite keeps the last ID of each table in
+    ``sqlite_sequence``, which only ever moves forward here.
+    """
+    base = id_base(using)
+    if not base:
+        return
+    with connections[using].cursor() as cursor:
+        for model in SHARDED_MODELS:
+            table = model._meta.db_table
+            cursor.execute(
+                "UPDATE sqlite_sequence SET seq = MAX(seq, %s) WHERE name = %s",
+                [base, table],
+            )
+            cursor.execute(
+                "INSERT INTO sqlite_sequence (name, seq) SELECT %s, %s "
+                "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = %s)",
+                [table, base, table],
+            )
+
+
+def on_shard(queryset, alias):
+    """``queryset`` bound to shard ``alias``; left to the routers without shards.
+
+    Unbound, reads keep going to the read replicas as before.
+    """
+    return queryset.using(alias) if enabled() else queryset
+
+
+def write_db(queryset):
+    """The database an update of ``queryset`` runs on"""
+    return queryset._db or router.db_for_write(queryset.model)
+
+
+@contextmanager
+def atomic(*aliases):
+    """One transaction on each of ``aliases``, committed in reverse order.
+
+    The commits are not atomic across databases. Pass the order's shard
+    first, so the stock and sales changes on ``default`` commit before it.
+    """
+    with ExitStack() as stack:
+        for alias in dict.fromkeys(aliases):
+            stack.enter_context(transaction.atomic(using=alias))
+        yield
+
+
+def fan_out(function, aliases=None):
+    """``[function(alias) for alias in aliases]``, called in parallel.
+
+    ``aliases`` defaults to every shard. Each call runs in its own thread,
+    on connections it opens and closes, so it sees only committed rows. They
+    get the caller's ``execute_wrapper`` hooks, so the request metrics and
+    SQL profiler count their queries too. A single alias is called inline on
+    the caller's connections.
+    """
+    aliases = shards() if aliases is None else list(aliases)
+    if len(aliases) == 1:
+        return [function(aliases[0])]
+
+    wrappers = {
+        connection.alias: list(connection.execute_wrappers)
+        for connection in connections.all(initialized_only=True)
+    }
+
+    def call(alias):
+        try:
+            with ExitStack() as stack:
+                for name, hooks in wrappers.items():
+                    for hook in hooks:
+                        stack.enter_context(connections[name].execute_wrapper(hook))
+                return function(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as executor:
+        return list(executor.map(call, aliases))
+
+
+def merge(results, ordering, model):
+    """Merge lists of ``model`` instances, each sorted by ``order_by(*ordering)``.
+
+    Only field names and annotations are compared; NULLs sort first, as in
+    SQLite.
+    """
+    keys = []
+    for name in ordering:
+        if not isinstance(name, str) or "__" in name or name == "?":
+            continue
+        attribute = name.lstrip("-")
+        if attribute != "pk":
+            try:
+                attribute = model._meta.get_field(attribute).attname
+            except FieldDoesNotExist:
+                pass
+        keys.append((attribute, name.startswith("-")))
+
+    def compare(a, b):
+        for attribute, descending in keys:
+            x, y = getattr(a, attribute), getattr(b, attribute)
+            if x == y:
+                continue
+            smaller = x is None if x is None or y is None else x < y
+            return (1 if smaller else -1) if descending else (-1 if smaller else 1)
+        return 0
+
+    return list(heapq.merge(*results, key=cmp_to_key(compare)))
+
+
+def gather(queryset, ordering=None, limit=None):
+    """The rows of ``queryset`` from every shard, in ``ordering``.
+
+    ``ordering`` defaults to the queryset's own. Each shard sorts its rows
+    and returns at most ``limit``, so the merge never holds more than
+    ``limit`` rows per shard.
+    """
+    model = queryset.model
+    if ordering is None:
+        ordering = list(queryset.query.order_by) or model._meta.ordering
+    names = {name.lstrip("-") for name in ordering if isinstance(name, str)}
+    if not names & {"pk", model._meta.pk.name}:
+        # A total order, so rows tied on the rest still merge consistently
+        ordering = [*ordering, "-pk"]
+
+    def read(alias):
+        rows = on_shard(queryset, alias).order_by(*ordering)
+        return list(rows if limit is None else rows[:limit])
+
+    rows = merge(fan_out(read), ordering, model)
+    return rows if limit is None else rows[:limit]
+
+
+def with_related(queryset, *fields):
+    """Load the users or products in ``fields`` along with ``queryset``.
+
+    Joined while orders share their database, prefetched from ``default``
+    once they are sharded.
+    """
+    if enabled():
+        return queryset.prefetch_related(*fields)
+    return queryset.select_related(*fields)
+
+
+def locate(model, pk):
+    """The database holding row ``pk`` of a sharded model, or None.
+
+    The shard that numbered ``pk`` is tried first, then the others in
+    parallel: ``reshard_orders`` moves rows without renumbering them.
+    Without shards this is ``default``, found without a query.
+    """
+    if not enabled():
+        return DEFAULT_DB_ALIAS
+    rows = model._base_manager.filter(pk=pk)
+    home = home_shard(pk)
+    if home is not None and rows.using(home).exists():
+        return home
+    others = [alias for alias in shards() if alias != home]
+    found = fan_out(lambda alias: rows.using(alias).exists(), others)
+    return next((alias for alias, exists in zip(others, found) if exists), None)
+
+
+def find(queryset, pk):
+    """``queryset.get(pk=pk)`` on whichever shard holds the row"""
+    using = locate(queryset.model, pk)
+    if using is None:
+        raise queryset.model.DoesNotExist(
+            f"{queryset.model._meta.object_name} matching query does not exist."
+        )
+    return on_shard(queryset, using).get(pk=pk)
+
+
+def get_or_404(queryset, pk):
+    """``find``, raising ``Http404`` like ``get_object_or_404``"""
+    try:
+        return find(queryset, pk)
+    except queryset.model.DoesNotExist:
+        raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+
+def delete_product_items(product_ids):
+    """Delete the items of deleted products from every shard.
+
+    Deleting a product only cascades to the items on its own database.
+    """
+    if not enabled():
+        return
+    product_ids = list(product_ids)
+    fan_out(
+        lambda alias: OrderItem.objects.using(alias)
+        .filter(product_id__in=product_ids)
+        .delete()
+    )
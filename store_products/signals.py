@@ -0,0 +1,57 @@
+from django.contrib.auth.models import User
+from django.db.models.signals import post_migrate, post_save, pre_delete
+from django.dispatch import receiver
+from store_products import order_events, outbox, sharding
+from store_products.cache import invalidate_catalog
+from store_products.models import Order, OrderItem, Products
+
+
+# Only product edits save products one by one; orders update them in bulk.
+# Deletes invalidate explicitly instead: a post_delete receiver would stop
+# Django from fast-deleting products in bulk.
+@receiver(post_save, sender=Products)
+def product_saved(sender, using, **kwargs):
+    invalidate_catalog(using=using)
+
+
+# Bulk writes and deletes emit their events where they happen
+@receiver(post_save, sender=Products)
+@receiver(post_save, sender=Order)
+@receiver(post_save, sender=OrderItem)
+def record_saved(sender, instance, created, using, **kwargs):
+    outbox.emit(
+        outbox.events(
+            sender,
+            [instance.pk],
+            outbox.CREATED if created else outbox.UPDATED,
+            instance.updated_at,
+        ),
+        using=using,
+    )
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, using, **kwargs):
+    order_events.publish_on_commit(
+        [
+            order_events.order_state(
+                instance.pk, instance.user_id, instance.status, instance.payment_status
+            )
+        ],
+        using=using,
+    )
+
+
+@receiver(pre_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    # Django cascades to the orders on the user's own database only
+    if sharding.enabled():
+        Order.objects.using(sharding.shard_for_user(instance.pk)).filter(
+            user_id=instance.pk
+        ).delete()
+
+
+@receiver(post_migrate)
+def migrated(sender, using, **kwargs):
+    if sender.name == "store_products":
+        sharding.start_sequences(using)
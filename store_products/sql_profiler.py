@@ -0,0 +1,174 @@
+"""Sampling SQL profiler.
+
+``SQLProfilerMiddleware`` hooks ``connection.execute_wrapper`` for every
+request, which ``sharding.fan_out`` passes on to its worker threads. Queries slower than ``SQL_PROFILER["SLOW_QUERY_MS"]`` are always
+logged together with the line of project code that issued them. A sample of
+``SQL_PROFILER["SAMPLE_RATE"]`` requests additionally feeds per-endpoint
+statistics keyed by query fingerprint, shown at ``/admin/sql-profile/``.
+"""
+
+import functools
+import logging
+import random
+import re
+import threading
+import time
+import traceback
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger("store_products.sql")
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r"(?<![\w.\"])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_RE = re.compile(r"%s|\?")
+_IN_LIST_RE = re.compile(r"\bIN \((?:\?, )*\?\)", re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def fingerprint(sql):
+    """Normalize a statement so queries differing only in literals match.
+
+    String and number literals and parameter placeholders become ``?`` and
+    ``IN`` lists of any length collapse to ``IN (...)``.
+    """
+    sql = _STRING_RE.sub("?", sql)
+    sql = _NUMBER_RE.sub("?", sql)
+    sql = _PLACEHOLDER_RE.sub("?", sql)
+    sql = _IN_LIST_RE.sub("IN (...)", sql)
+    return _WHITESPACE_RE.sub(" ", sql).strip()
+
+
+# Frames of the execute wrappers themselves are never the query's origin
+_WRAPPER_FILES = {
+    str(Path(__file__).resolve()),
+    str(Path(__file__).resolve().with_name("middleware.py")),
+}
+
+
+def query_origin():
+    """Return "file:line in function" of the innermost project frame"""
+    base_dir = str(settings.BASE_DIR)
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (
+            filename.startswith(base_dir)
+            and filename not in _WRAPPER_FILES
+            and "site-packages" not in filename
+        ):
+            return (
+                f"{Path(filename).relative_to(base_dir)}:{frame.lineno} in {frame.name}"
+            )
+    return "unknown"
+
+
+class SQLProfiler:
+    """Per-endpoint query statistics keyed by fingerprint"""
+
+    # Bound the memory used by endpoints issuing many distinct statements
+    max_fingerprints = 500
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    def record(self, endpoint, sql, duration):
+        key = fingerprint(sql)
+        with self.lock:
+            stats = self.endpoints.setdefault(endpoint, {})
+            entry = stats.get(key)
+            if entry is None:
+                if len(stats) >= self.max_fingerprints:
+                    return
+                entry = stats[key] = [0, 0.0, 0.0]
+            entry[0] += 1
+            entry[1] += duration
+            entry[2] = max(entry[2], duration)
+
+    def report(self, top_n=20):
+        """Return ``{endpoint: [row, ...]}`` with the top fingerprints by total time"""
+        with self.lock:
+            snapshot = {
+                endpoint: [(key, *entry) for key, entry in stats.items()]
+                for endpoint, stats in self.endpoints.items()
+            }
+        return {
+            endpoint: [
+                {
+                    "fingerprint": key,
+                    "count": count,
+                    "total_ms": total * 1000,
+                    "max_ms": maximum * 1000,
+                }
+                for key, count, total, maximum in sorted(
+                    rows, key=lambda row: row[2], reverse=True
+                )[:top_n]
+            ]
+            for endpoint, rows in sorted(snapshot.items())
+        }
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+
+
+profiler = SQLProfiler()
+
+
+class RequestQueryHook:
+    """``connection.execute_wrapper`` installed for the duration of a request"""
+
+    def __init__(self, request, sampled, slow_query_seconds):
+        self.request = request
+        self.sampled = sampled
+        self.slow_query_seconds = slow_query_seconds
+
+    def endpoint(self):
+        match = self.request.resolver_match
+        return match.route if match is not None else self.request.path
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            if self.sampled:
+                profiler.record(self.endpoint(), sql, duration)
+            if (
+                self.slow_query_seconds is not None
+                and duration >= self.slow_query_seconds
+            ):
+                logger.warning(
+                    "Slow query (%.1fms) on %s from %s: %s",
+                    duration * 1000,
+                    self.endpoint(),
+                    query_origin(),
+                    fingerprint(sql),
+                )
+
+
+class SQLProfilerMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = getattr(settings, "SQL_PROFILER", {})
+        self.sample_rate = config.get("SAMPLE_RATE", 0.0)
+        slow_query_ms = config.get("SLOW_QUERY_MS")
+        self.slow_query_seconds = (
+            slow_query_ms / 1000 if slow_query_ms is not None else None
+        )
+
+    def __call__(self, request):
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and self.slow_query_seconds is None:
+            return self.get_response(request)
+
+        hook = RequestQueryHook(request, sampled, self.slow_query_seconds)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(hook))
+            return self.get_response(request)
@@ -1,4 +1,149 @@
-from django.test import TestCase
+import gzip
+import json
+import logging
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import (
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+from django.utils import timezone
+from store_products import order_events, outbox, payments, schema, sharding
+from store_products.admin import EstimatedCountPaginator, chunked_update
+from store_products.cache import SingleFlight
+from store_products.compression import CompressionMiddleware, negotiate
+from store_products.benchmarks import add_database, remove_database
+from store_products.db_routers import (
+    OrderShardRouter,
+    ReadReplicaRouter,
+    ReplicaPinningMiddleware,
+)
+from store_products.log_handlers import (
+    BackgroundQueueHandler,
+    BatchingQueueListener,
+    BufferedRotatingFileHandler,
+)
+from store_products.management.commands.bench_endpoints import (
+    ENDPOINTS,
+    compare,
+    endpoint_names,
+    endpoint_request,
+    fixture_ids,
+)
+from store_products.models import (
+    Order,
+    OrderItem,
+    OutboxEvent,
+    ProductCoPurchase,
+    Products,
+)
+from store_products.payments import CircuitBreaker, CircuitOpenError
+from store_products.sql_profiler import fingerprint, profiler
+from store_products.throttling import ThrottleMiddleware
+from store_products.totals import order_total, with_totals
+
+
+class StubGatewayHandler(BaseHTTPRequestHandler):
+    """Answers Razorpay order fetches from the server's ``orders`` mapping"""
+
+    def do_GET(self):
+        razorpay_order_id = self.path.split("?")[0].rstrip("/").rsplit("/", 1)[-1]
+        self.server.requests.append(razorpay_order_id)
+        gateway_status = self.server.orders.get(razorpay_order_id)
+        if gateway_status is None:
+            body = {"error": {"code": "BAD_REQUEST_ERROR", "description": "Not found"}}
+            self.send_response(400)
+        else:
+            body = {"id": razorpay_order_id, "status": gateway_status}
+            self.send_response(200)
+        payload = json.dumps(body).encode()
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubGateway:
+    def __init__(self, orders):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubGatewayHandler)
+        self.server.orders = orders
+        self.server.requests = []
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self):
+        return self.server.requests
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def populate(**options):
+    """Generate users, products and orders with ``populate_db --bulk``"""
+    call_command("populate_db", bulk=True, stdout=StringIO(), **options)
+
+
+def create_products(count):
+    """``count`` products named "Product 0"..., with 5 in stock at 9.99"""
+    return [
+        Products.objects.create(
+            name=f"Product {i}", description="", price="9.99", stock_quantity=5
+        )
+        for i in range(count)
+    ]
+
+
+class SeededTestCase(TestCase):
+    """Tests starting from a cold catalog cache and ``population``.
+
+    ``population`` holds the ``populate_db`` options generating the data
+    shared by the class's tests; without it, they start empty.
+    """
+
+    population = None
+
+    @classmethod
+    def setUpTestData(cls):
+        if cls.population:
+            populate(**cls.population)
+
+    def setUp(self):
+        cache.clear()
 
 
 # Create your tests here.
@@ -7,3 +152,1623 @@ class HelloWorldTestCase(TestCase):
         response = self.client.get("/api/hello/")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.content.decode(), "Hello World")
+
+
+class ReconcilePaymentsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="buyer", password="testpass123")
+        self.orders = [
+            Order.objects.create(
+                user=self.user, shipping_address="Street", payment_id=f"order_rzp{i}"
+            )
+            for i in range(5)
+        ]
+
+    def test_reconcile_updates_paid_orders(self):
+        gateway_orders = {
+            "order_rzp0": "paid",
+            "order_rzp1": "attempted",
+            "order_rzp2": "paid",
+            "order_rzp3": "created",
+        }
+        with StubGateway(gateway_orders) as gateway:
+            call_command(
+                "reconcile_payments",
+                base_url=gateway.base_url,
+                chunk_size=2,
+                concurrency=3,
+                stdout=StringIO(),
+            )
+
+        statuses = dict(Order.objects.values_list("payment_id", "payment_status"))
+        self.assertEqual(statuses["order_rzp0"], "completed")
+        self.assertEqual(statuses["order_rzp1"], "pending")
+        self.assertEqual(statuses["order_rzp2"], "completed")
+        self.assertEqual(statuses["order_rzp3"], "pending")
+        # The stub does not know order_rzp4, the gateway error leaves it pending.
+        self.assertEqual(statuses["order_rzp4"], "pending")
+        self.assertEqual(Order.objects.get(payment_id="order_rzp0").status, "confirmed")
+
+    def test_reconcile_resumes_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            checkpoint = Path(tmp_dir) / "reconcile.json"
+            checkpoint.write_text(json.dumps({"last_order_id": self.orders[2].id}))
+            with StubGateway({}) as gateway:
+                call_command(
+                    "reconcile_payments",
+                    base_url=gateway.base_url,
+                    checkpoint=str(checkpoint),
+                    resume=True,
+                    stdout=StringIO(),
+                )
+            self.assertEqual(sorted(gateway.requests), ["order_rzp3", "order_rzp4"])
+            self.assertEqual(
+                json.loads(checkpoint.read_text())["last_order_id"],
+                self.orders[4].id,
+            )
+
+
+class CircuitBreakerTestCase(TestCase):
+    def failing_call(self):
+        raise ConnectionError("gateway down")
+
+    def test_opens_on_error_rate_and_fails_fast(self):
+        breaker = CircuitBreaker("test", window_size=4, minimum_calls=4)
+        for result in [1, 1]:
+            breaker.call(lambda: result)
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                breaker.call(self.failing_call)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        func = mock.Mock()
+        with self.assertRaises(CircuitOpenError):
+            breaker.call(func)
+        func.assert_not_called()
+
+    def test_opens_on_slow_calls(self):
+        breaker = CircuitBreaker(
+            "test", window_size=2, minimum_calls=2, slow_call_duration=0
+        )
+        breaker.call(lambda: None)
+        breaker.call(lambda: None)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_half_open_trials_close_the_circuit(self):
+        breaker = CircuitBreaker(
+            "test", window_size=1, minimum_calls=1, open_duration=0, half_open_calls=2
+        )
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing_call)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        breaker.call(lambda: None)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        breaker.call(lambda: None)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_failure_reopens_the_circuit(self):
+        breaker = CircuitBreaker("test", window_size=1, minimum_calls=1)
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing_call)
+        breaker.opened_at -= breaker.open_duration
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing_call)
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_ignored_exceptions_by_dotted_path(self):
+        breaker = CircuitBreaker(
+            "test",
+            window_size=1,
+            minimum_calls=1,
+            ignore_exceptions=("builtins.ValueError",),
+        )
+        with self.assertRaises(ValueError):
+            breaker.call(int, "not a number")
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_create_razorpay_order_returns_503_while_open(self):
+        user = User.objects.create_user(username="buyer", password="testpass123")
+        order = Order.objects.create(user=user, shipping_address="Street")
+        breaker = CircuitBreaker("test", window_size=1, minimum_calls=1)
+        with self.assertRaises(ConnectionError):
+            breaker.call(self.failing_call)
+
+        with mock.patch.object(payments, "gateway_breaker", breaker):
+            response = self.client.post(
+                "/api/payments/razorpay/create/",
+                {"order_id": order.id, "amount": 100},
+                content_type="application/json",
+            )
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+
+
+class SchemaViewTestCase(TestCase):
+    def setUp(self):
+        schema.clear_cache()
+        self.addCleanup(schema.clear_cache)
+
+    def test_etag_revalidation(self):
+        response = self.client.get("/api/schema/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "/api/products/")
+
+        response = self.client.get("/api/schema/", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+
+    def test_serves_build_time_file(self):
+        document = {"openapi": "3.0.3", "info": {"title": "Prebuilt"}, "paths": {}}
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump(document, f)
+            f.flush()
+            with override_settings(OPENAPI_SCHEMA_FILE=f.name):
+                response = self.client.get("/api/schema/?format=json")
+        self.assertEqual(json.loads(response.content)["info"]["title"], "Prebuilt")
+
+
+class QueueLoggingTestCase(TestCase):
+    def test_records_are_written_by_listener_and_rotated(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "api.log"
+            file_handler = BufferedRotatingFileHandler(
+                path, maxBytes=200, backupCount=2
+            )
+            handler = BackgroundQueueHandler(queue.Queue())
+            handler.listener = BatchingQueueListener(handler.queue, file_handler)
+            logger = logging.getLogger("store_products.tests.queue")
+            logger.addHandler(handler)
+            logger.propagate = False
+            try:
+                payload = {"order_id": 1}
+                for i in range(20):
+                    logger.warning("Record %s: %s", i, payload)
+                # The message is rendered when logged, not when written
+                payload["order_id"] = 2
+            finally:
+                handler.stop()
+                logger.removeHandler(handler)
+                file_handler.close()
+
+            self.assertTrue(Path(f"{path}.1").exists())
+            lines = path.read_text().splitlines()
+            self.assertEqual(lines[-1], "Record 19: {'order_id': 1}")
+            self.assertTrue(all(f.stat().st_size <= 200 for f in path.parent.iterdir()))
+
+    def test_rotation_counts_bytes_written_by_other_processes(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / "api.log"
+            # Two handlers on one file, as in two worker processes
+            handlers = [
+                BufferedRotatingFileHandler(
+                    path, maxBytes=200, backupCount=5, encoding="utf-8"
+                )
+                for _ in range(2)
+            ]
+            try:
+                for i in range(20):
+                    handler = handlers[i % 2]
+                    handler.handle(logging.makeLogRecord({"msg": f"Prix {i}: 9,99 €"}))
+                    handler.flush()
+            finally:
+                for handler in handlers:
+                    handler.close()
+
+            self.assertTrue(Path(f"{path}.1").exists())
+            self.assertTrue(all(f.stat().st_size <= 200 for f in path.parent.iterdir()))
+
+
+class RequestMetricsTestCase(SeededTestCase):
+    def test_server_timing_header_and_metrics_endpoint(self):
+        response = self.client.get("/api/products/")
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response["Server-Timing"],
+            r'total;dur=[\d.]+, db;dur=[\d.]+;desc="1 queries"',
+        )
+
+        response = self.client.get("/api/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",route="api/products/"}',
+            response.content.decode(),
+        )
+
+
+class CompressionMiddlewareTestCase(TestCase):
+    body = json.dumps([{"name": f"Product {i}", "price": "9.99"} for i in range(200)])
+
+    def respond(self, response, accept_encoding="gzip"):
+        middleware = CompressionMiddleware(lambda request: response)
+        request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING=accept_encoding)
+        return middleware, middleware(request)
+
+    def test_negotiate(self):
+        codecs = {"zstd": None, "gzip": None}
+        self.assertEqual(negotiate("gzip, zstd", codecs), "zstd")
+        self.assertEqual(negotiate("gzip;q=1.0, zstd;q=0.5", codecs), "gzip")
+        self.assertEqual(negotiate("*;q=0.1, zstd;q=0", codecs), "gzip")
+        self.assertIsNone(negotiate("identity", codecs))
+        self.assertIsNone(negotiate("", codecs))
+
+    def test_compresses_large_bodies(self):
+        middleware, response = self.respond(HttpResponse(self.body))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(int(response["Content-Length"]), len(response.content))
+        self.assertEqual(gzip.decompress(response.content).decode(), self.body)
+
+        # An identical body is served from the cache of compressed variants
+        middleware.get_response = lambda request: HttpResponse(self.body)
+        size = middleware.cache.size
+        with mock.patch("gzip.compress") as compress:
+            response = middleware(
+                RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+            )
+        compress.assert_not_called()
+        self.assertEqual(middleware.cache.size, size)
+        self.assertEqual(gzip.decompress(response.content).decode(), self.body)
+
+    def test_skips_small_and_opted_out_responses(self):
+        _, response = self.respond(HttpResponse(b"{}"))
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+
+        no_transform = HttpResponse(
+            self.body, headers={"Cache-Control": "no-transform"}
+        )
+        _, response = self.respond(no_transform)
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+        _, response = self.respond(HttpResponse(self.body), accept_encoding="")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_streaming_and_etag(self):
+        chunks = [self.body[:100].encode(), self.body[100:].encode()]
+        response = StreamingHttpResponse(iter(chunks))
+        response["ETag"] = '"abc"'
+        _, response = self.respond(response)
+        self.assertEqual(response["ETag"], 'W/"abc"')
+        self.assertEqual(
+            gzip.decompress(b"".join(response.streaming_content)).decode(), self.body
+        )
+
+
+class SQLProfilerTestCase(TestCase):
+    def setUp(self):
+        profiler.reset()
+        cache.clear()
+
+    def test_fingerprint_strips_literals(self):
+        self.assertEqual(
+            fingerprint(
+                "SELECT * FROM t WHERE name = 'O''Brien' AND id IN (1, 2, 3)  LIMIT 21"
+            ),
+            "SELECT * FROM t WHERE name = ? AND id IN (...) LIMIT ?",
+        )
+        self.assertEqual(
+            fingerprint('SELECT "t1"."id" FROM "t1" WHERE "t1"."id" IN (%s, %s)'),
+            'SELECT "t1"."id" FROM "t1" WHERE "t1"."id" IN (...)',
+        )
+
+    @override_settings(SQL_PROFILER={"SAMPLE_RATE": 1.0, "SLOW_QUERY_MS": 0})
+    def test_sampled_requests_are_profiled_and_slow_queries_logged(self):
+        with self.assertLogs("store_products.sql", level="WARNING") as logs:
+            self.client.get("/api/products/")
+
+        rows = profiler.report()["api/products/"]
+        self.assertEqual(rows[0]["count"], 1)
+        self.assertIn('FROM "store_products_products"', rows[0]["fingerprint"])
+        self.assertIn("store_products/views.py", logs.output[0])
+
+    @override_settings(SQL_PROFILER={"SAMPLE_RATE": 1.0})
+    def test_admin_report_page(self):
+        User.objects.create_superuser("admin", "admin@example.com", "testpass123")
+        self.client.login(username="admin", password="testpass123")
+        self.client.get("/api/products/")
+
+        response = self.client.get("/admin/sql-profile/")
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "api/products/")
+
+
+@override_settings(DATABASE_READ_REPLICAS=["replica_0"], REPLICA_LAG_TOLERANCE=5)
+class ReadReplicaRouterTestCase(TestCase):
+    def setUp(self):
+        self.router = ReadReplicaRouter()
+        self.factory = RequestFactory()
+
+    def route(self, request, write=False):
+        """Return the alias used for a read, after an optional write"""
+        seen = {}
+
+        def view(request):
+            if write:
+                self.router.db_for_write(Order)
+            seen["alias"] = self.router.db_for_read(Order)
+            return HttpResponse()
+
+        response = ReplicaPinningMiddleware(view)(request)
+        return seen["alias"], response
+
+    def test_safe_requests_read_from_replica(self):
+        alias, response = self.route(self.factory.get("/api/products/"))
+        self.assertEqual(alias, "replica_0")
+        self.assertNotIn("db_pin_primary", response.cookies)
+
+    def test_unsafe_requests_use_primary(self):
+        alias, _ = self.route(self.factory.post("/api/orders/create/"))
+        self.assertEqual(alias, "default")
+
+    def test_reads_after_a_write_stick_to_primary(self):
+        alias, response = self.route(self.factory.get("/api/hello/"), write=True)
+        self.assertEqual(alias, "default")
+        self.assertEqual(response.cookies["db_pin_primary"]["max-age"], 5)
+
+        request = self.factory.get("/api/products/")
+        request.COOKIES["db_pin_primary"] = "1"
+        alias, _ = self.route(request)
+        self.assertEqual(alias, "default")
+
+
+class EndpointBenchmarkTestCase(TestCase):
+    def test_every_url_has_a_benchmark_request(self):
+        self.assertEqual(set(endpoint_names()), set(ENDPOINTS))
+
+    def test_compare_reports_regressions_past_threshold(self):
+        baseline = {
+            "scales": {
+                "10000": {"get_orders": {"p95_ms": 10.0, "requests_per_second": 100}}
+            }
+        }
+        within = {
+            "scales": {
+                "10000": {"get_orders": {"p95_ms": 11.0, "requests_per_second": 90}}
+            }
+        }
+        regressed = {
+            "scales": {
+                "10000": {"get_orders": {"p95_ms": 15.0, "requests_per_second": 50}}
+            }
+        }
+        self.assertEqual(compare(baseline, within, 0.2), [])
+        self.assertEqual(len(compare(baseline, regressed, 0.2)), 2)
+
+
+class DbBenchmarkTestCase(TransactionTestCase):
+    def test_benchmark_requests_are_not_throttled(self):
+        out = StringIO()
+        call_command(
+            "bench_db", seed=True, duration=0.5, threads=2, write_ratio=0, stdout=out
+        )
+        statuses = re.search(r"Status codes: (.*)", out.getvalue()).group(1)
+        self.assertIn("200", statuses)
+        self.assertNotIn("429", statuses)
+
+
+class PopulateDbBulkTestCase(TestCase):
+    def populate(self):
+        populate(users=5, products=40, orders=30, batch_size=7, seed=42)
+
+    def test_totals_and_stock_match_order_items(self):
+        self.populate()
+        self.assertEqual(User.objects.count(), 5)
+        self.assertEqual(Products.objects.count(), 40)
+        self.assertEqual(Order.objects.count(), 30)
+        for order in Order.objects.prefetch_related("order_items"):
+            self.assertEqual(
+                order.total_amount,
+                sum(item.get_total_price() for item in order.order_items.all()),
+            )
+        for item in OrderItem.objects.select_related("product"):
+            self.assertEqual(item.price_at_time, item.product.price)
+            self.assertGreaterEqual(item.product.stock_quantity, 0)
+
+    def test_orders_require_users(self):
+        with self.assertRaises(CommandError):
+            populate(users=0, products=5, orders=3)
+        self.assertFalse(Products.objects.exists())
+
+    def test_seed_is_deterministic(self):
+        self.populate()
+        first = list(Products.objects.values_list("name", "price", "stock_quantity"))
+        Order.objects.all().delete()
+        Products.objects.all().delete()
+        User.objects.all().delete()
+        self.populate()
+        second = list(Products.objects.values_list("name", "price", "stock_quantity"))
+        self.assertEqual(first, second)
+
+
+class ShardsTestCase(TestCase):
+    def generate(self, output_dir, shards):
+        call_command(
+            "generate_shards",
+            output_dir,
+            users=7,
+            products=30,
+            orders=40,
+            shards=shards,
+            seed=3,
+            stdout=StringIO(),
+        )
+        return {
+            table: "".join(
+                path.read_text() for path in sorted(Path(output_dir).glob(f"{table}-*"))
+            )
+            for table in ("users", "products", "orders", "order_items")
+        }
+
+    @mock.patch("store_products.management.commands.generate_shards.BLOCK_SIZE", 4)
+    def test_rows_do_not_depend_on_shard_count(self):
+        # Order dates are relative to the generation time
+        now = timezone.now()
+        with (
+            mock.patch("django.utils.timezone.now", return_value=now),
+            tempfile.TemporaryDirectory() as one,
+            tempfile.TemporaryDirectory() as three,
+        ):
+            self.assertEqual(self.generate(one, 1), self.generate(three, 3))
+
+    def test_load_shards(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            shards = self.generate(output_dir, 2)
+            call_command("load_shards", output_dir, batch_size=16, stdout=StringIO())
+
+        self.assertEqual(User.objects.count(), 7)
+        self.assertEqual(Products.objects.count(), 30)
+        self.assertEqual(
+            OrderItem.objects.count(), len(shards["order_items"].splitlines())
+        )
+        for order in Order.objects.prefetch_related("order_items"):
+            self.assertEqual(
+                order.total_amount,
+                sum(item.get_total_price() for item in order.order_items.all()),
+            )
+        self.assertTrue(User.objects.get(pk=1).check_password("testpass123"))
+        # New rows continue after the loaded primary keys
+        product = Products.objects.create(name="New", description="", price=1)
+        self.assertEqual(product.pk, 31)
+
+
+# Most queries a request to each URL in store_products/urls.py may make,
+# whatever the number of rows involved
+QUERY_BUDGETS = {
+    "schema": 2,
+    "swagger-ui": 2,
+    "redoc": 2,
+    "hello/": 9,
+    "metrics": 2,
+    "get_products": 3,
+    "get_product": 3,
+    "get_products_batch": 1,
+    "get_product_changes": 2,
+    "add_products": 3,
+    "update_product": 4,
+    "delete_product": 6,
+    "related_products": 2,
+    "get_orders": 3,
+    "get_order": 3,
+    "create_order": 11,
+    "order_status_events": 0,
+    "update_order": 5,
+    "cancel_order": 7,
+    "create_razorpay_order": 4,
+    "verify_razorpay_payment": 2,
+}
+
+
+TRANSACTION_CONTROL_RE = re.compile(r"(SAVEPOINT|RELEASE SAVEPOINT|ROLLBACK TO) ")
+
+
+class QueryBudgetTestCase(SeededTestCase):
+    population = {"users": 3, "products": 20, "orders": 30, "seed": 7}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ids = fixture_ids()
+
+    def measure(self):
+        """Return the SQL run by one request to every endpoint"""
+        statements = {}
+        with mock.patch(
+            "store_products.views.call_gateway", return_value={"id": "order_test"}
+        ):
+            for name in endpoint_names():
+                request = endpoint_request(self.client, name, self.ids)
+                # Budgets are for a cold catalog cache
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    request()
+                # Transaction control is not a round trip worth budgeting
+                statements[name] = [
+                    query["sql"]
+                    for query in queries
+                    if not TRANSACTION_CONTROL_RE.match(query["sql"])
+                ]
+        return statements
+
+    def fingerprints(self, statements):
+        counts = Counter(fingerprint(sql) for sql in statements)
+        return "\n".join(f"{n:>4} x {sql}" for sql, n in counts.most_common())
+
+    def test_endpoints_stay_within_query_budget(self):
+        self.assertEqual(set(QUERY_BUDGETS), set(endpoint_names()))
+        for name, statements in self.measure().items():
+            with self.subTest(endpoint=name):
+                if len(statements) > QUERY_BUDGETS[name]:
+                    self.fail(
+                        f"{name} made {len(statements)} queries, budget is "
+                        f"{QUERY_BUDGETS[name]}:\n{self.fingerprints(statements)}"
+                    )
+
+    def test_query_counts_do_not_grow_with_data(self):
+        before = self.measure()
+
+        user = User.objects.get(pk=self.ids["user"])
+        order = Order.objects.get(pk=self.ids["order"])
+        in_order = order.order_items.values_list("product_id", flat=True)
+        products = list(Products.objects.exclude(pk__in=in_order)[:3])
+        for product in products:
+            OrderItem.objects.create(
+                order=order, product=product, quantity=1, price_at_time=product.price
+            )
+        for _ in range(5):
+            extra = Order.objects.create(user=user, shipping_address="1 Test Road")
+            for product in products:
+                OrderItem.objects.create(
+                    order=extra, product=product, quantity=1, price_at_time=1
+                )
+
+        for name, statements in self.measure().items():
+            with self.subTest(endpoint=name):
+                if len(statements) != len(before[name]):
+                    self.fail(
+                        f"{name} went from {len(before[name])} to "
+                        f"{len(statements)} queries with more rows:\n"
+                        f"{self.fingerprints(statements)}"
+                    )
+
+
+class AdminChangelistTestCase(SeededTestCase):
+    changelists = ["products", "order", "orderitem"]
+    population = {"users": 3, "products": 20, "orders": 10, "seed": 3}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin_user = User.objects.create_superuser("admin", "admin@example.com")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin_user)
+
+    def measure(self):
+        """Return the SQL run by each changelist page"""
+        statements = {}
+        for name in self.changelists:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(f"/admin/store_products/{name}/")
+            self.assertEqual(response.status_code, 200)
+            statements[name] = [query["sql"] for query in queries]
+        return statements
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        before = self.measure()
+        populate(users=2, products=20, orders=20, seed=4)
+        for name, statements in self.measure().items():
+            with self.subTest(changelist=name):
+                self.assertEqual(len(statements), len(before[name]))
+                # Pages are never sized with an unbounded COUNT(*)
+                for sql in statements:
+                    if "COUNT(*)" in sql:
+                        self.assertIn("LIMIT", sql)
+
+    def test_list_editable_updates_only_changed_columns(self):
+        product = Products.objects.latest("pk")
+        response = self.client.get("/admin/store_products/products/")
+        formset = response.context["cl"].formset
+        data = {"_save": "Save"}
+        for form in [formset.management_form, *formset.forms]:
+            for field in form:
+                value = field.value()
+                if value not in (None, False):
+                    data[field.html_name] = "on" if value is True else value
+        form = next(f for f in formset.forms if f.instance.pk == product.pk)
+        data[form["price"].html_name] = "1.00"
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post("/admin/store_products/products/", data)
+        updates = [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 1)
+        self.assertNotIn('"name"', updates[0])
+        product.refresh_from_db()
+        self.assertEqual(str(product.price), "1.00")
+
+    def test_estimated_count_paginator(self):
+        queryset = Order.objects.all()
+        with mock.patch.object(EstimatedCountPaginator, "max_count", 5):
+            last = Order.objects.order_by("-pk").values_list("pk", flat=True)[0]
+            self.assertEqual(EstimatedCountPaginator(queryset, 2).count, last)
+            filtered = queryset.filter(user__isnull=False)
+            self.assertEqual(EstimatedCountPaginator(filtered, 2).count, 5)
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, queryset.count())
+
+
+@override_settings(ADMIN_BULK_CHUNK_SIZE=3)
+class AdminBulkActionTestCase(SeededTestCase):
+    population = {"users": 3, "products": 10, "orders": 10, "seed": 5}
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.admin_user = User.objects.create_superuser("admin", "admin@example.com")
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.admin_user)
+
+    def act(self, model, action, pks, **data):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                f"/admin/store_products/{model}/",
+                {"action": action, "_selected_action": pks, "index": 0, **data},
+            )
+        self.assertEqual(response.status_code, 302)
+        # Rows are updated in place, never loaded
+        self.assertFalse(
+            [q for q in queries if '"store_products_products"."name"' in q["sql"]]
+        )
+        return [q["sql"] for q in queries if q["sql"].startswith("UPDATE")]
+
+    def test_product_actions_update_in_chunks(self):
+        pks = list(Products.objects.order_by("pk").values_list("pk", flat=True))
+        before = {p.pk: p for p in Products.objects.all()}
+
+        updates = self.act("products", "mark_unavailable", pks)
+        self.assertEqual(len(updates), 4)  # 10 rows in chunks of 3
+        self.assertFalse(Products.objects.filter(is_available=True).exists())
+
+        self.act("products", "restock", pks[:2], amount="5")
+        self.act("products", "change_price", pks[:2], amount="10")
+        for product in Products.objects.filter(pk__in=pks[:2]):
+            old = before[product.pk]
+            self.assertEqual(product.stock_quantity, old.stock_quantity + 5)
+            self.assertEqual(product.price, round(old.price * Decimal("1.1"), 2))
+            self.assertGreater(product.updated_at, old.updated_at)
+
+    def test_restock_requires_positive_whole_amount(self):
+        pk = Products.objects.values_list("pk", flat=True)[0]
+        stock = Products.objects.get(pk=pk).stock_quantity
+        self.assertEqual(self.act("products", "restock", [pk], amount="1.5"), [])
+        self.assertEqual(self.act("products", "restock", [pk]), [])
+        self.assertEqual(Products.objects.get(pk=pk).stock_quantity, stock)
+
+    def test_order_actions_only_advance_eligible_orders(self):
+        Order.objects.update(status="pending")
+        delivered = Order.objects.first()
+        delivered.status = "delivered"
+        delivered.save()
+        pks = list(Order.objects.values_list("pk", flat=True))
+
+        self.act("order", "mark_shipped", pks)
+        self.assertEqual(Order.objects.filter(status="shipped").count(), len(pks) - 1)
+        self.assertEqual(Order.objects.get(pk=delivered.pk).status, "delivered")
+
+        self.act("order", "mark_delivered", pks)
+        self.assertEqual(Order.objects.filter(status="delivered").count(), len(pks))
+
+
+class SingleFlightTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_catalog_views_are_cached_until_a_product_changes(self):
+        product = Products.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock_quantity=3
+        )
+        for expected_queries in (1, 0):
+            with self.assertNumQueries(expected_queries):
+                response = self.client.get("/api/products/", {"name": "Lamp"})
+            self.assertEqual(response.json()[0]["stock_quantity"], 3)
+
+        product.stock_quantity = 2
+        product.save()
+        response = self.client.get("/api/products/", {"name": "Lamp"})
+        self.assertEqual(response.json()[0]["stock_quantity"], 2)
+
+        self.client.delete(f"/api/products/{product.pk}/delete/")
+        response = self.client.get(f"/api/products/{product.pk}/")
+        self.assertEqual(response.status_code, 404)
+
+    def test_orders_invalidate_only_when_stock_crosses_zero(self):
+        user = User.objects.create_user("buyer", "buyer@example.com")
+        product = Products.objects.create(
+            name="Lamp", description="Desk lamp", price="20.00", stock_quantity=3
+        )
+
+        def order(quantity):
+            return self.client.post(
+                "/api/orders/create/",
+                {
+                    "user": user.pk,
+                    "shipping_address": "1 Test Road",
+                    "order_items": [
+                        {"product_id": str(product.pk), "quantity": str(quantity)}
+                    ],
+                },
+                content_type="application/json",
+            ).json()["id"]
+
+        def stock():
+            return self.client.get(f"/api/products/{product.pk}/").json()[
+                "stock_quantity"
+            ]
+
+        self.assertEqual(stock(), 3)
+        order(1)
+        self.assertEqual(stock(), 3)
+        sold_out = order(2)
+        self.assertEqual(stock(), 0)
+        self.client.delete(f"/api/orders/{sold_out}/cancel/")
+        self.assertEqual(stock(), 2)
+
+    def test_concurrent_misses_compute_once(self):
+        flight = SingleFlight(beta=0)
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return "value"
+
+        results = []
+        threads = [
+            threading.Thread(
+                target=lambda: results.append(flight.get_or_compute("key", compute))
+            )
+            for _ in range(10)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 10)
+
+    def test_stale_value_served_while_another_caller_refreshes(self):
+        flight = SingleFlight(timeout=60, stale_timeout=30, beta=0)
+        cache.set("key", ("old", time.time() - 1, 0.01))
+        cache.add("key:lock", "other caller")
+        self.assertEqual(flight.get_or_compute("key", lambda: "new"), "old")
+
+        cache.delete("key:lock")
+        self.assertEqual(flight.get_or_compute("key", lambda: "new"), "new")
+        self.assertEqual(flight.get_or_compute("key", lambda: "newer"), "new")
+
+    def test_early_refresh_before_expiry(self):
+        flight = SingleFlight(timeout=60, beta=1.0)
+        cache.set("key", ("old", time.time() + 1, 0.5))
+        with mock.patch("random.random", return_value=1 - 1e-9):
+            self.assertEqual(flight.get_or_compute("key", lambda: "new"), "new")
+
+
+class ThrottleMiddlewareTestCase(SeededTestCase):
+    config = {
+        "DEFAULT": {"RATE": 1.0, "BURST": 3},
+        "ROUTES": {
+            "api/products/": {"COST": 2},
+            "api/hello/": {"RATE": 1.0, "BURST": 1},
+        },
+    }
+
+    def test_costs_and_retry_after_before_any_query(self):
+        with override_settings(THROTTLE=self.config):
+            self.assertEqual(self.client.get("/api/products/").status_code, 200)
+            self.assertEqual(self.client.get("/api/metrics/").status_code, 200)
+            with self.assertNumQueries(0):
+                response = self.client.get("/api/products/")
+            self.assertEqual(response.status_code, 429)
+            self.assertEqual(response["Retry-After"], "2")
+
+            # Other clients and routes with their own bucket are unaffected
+            response = self.client.get("/api/products/", REMOTE_ADDR="10.0.0.2")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(self.client.get("/api/hello/").status_code, 200)
+            self.assertEqual(self.client.get("/api/hello/").status_code, 429)
+
+    def test_buckets_refill(self):
+        request = RequestFactory().get("/api/products/")
+        request.resolver_match = resolve("/api/products/")
+        with override_settings(THROTTLE=self.config):
+            middleware = ThrottleMiddleware(lambda request: None)
+        with mock.patch("time.monotonic", return_value=100.0):
+            self.assertIsNone(middleware.process_view(request, None, (), {}))
+            self.assertIsNotNone(middleware.process_view(request, None, (), {}))
+        with mock.patch("time.monotonic", return_value=102.0):
+            self.assertIsNone(middleware.process_view(request, None, (), {}))
+
+    def test_shared_cache_store_and_forwarded_clients(self):
+        config = {**self.config, "CACHE_ALIAS": "default", "TRUSTED_PROXIES": 1}
+        with override_settings(THROTTLE=config):
+            for expected in (200, 429):
+                response = self.client.get(
+                    "/api/products/", HTTP_X_FORWARDED_FOR="spoofed, 203.0.113.9"
+                )
+                self.assertEqual(response.status_code, expected)
+            # A new worker sees the same buckets, keyed by the address the
+            # trusted proxy saw
+            response = Client().get(
+                "/api/products/", HTTP_X_FORWARDED_FOR="203.0.113.9"
+            )
+            self.assertEqual(response.status_code, 429)
+
+
+class OrderTotalsTestCase(SeededTestCase):
+    population = {"users": 2, "products": 10, "orders": 6, "seed": 9}
+
+    def expected_total(self, order):
+        return sum(item.get_total_price() for item in order.order_items.all())
+
+    def test_order_total_and_annotation(self):
+        order = Order.objects.first()
+        expected = self.expected_total(order)
+        with self.assertNumQueries(1):
+            self.assertEqual(order_total(order.pk), expected)
+        for annotated in with_totals(Order.objects.all()):
+            self.assertEqual(annotated.computed_total, self.expected_total(annotated))
+
+    def test_get_orders_reports_item_totals(self):
+        order = Order.objects.first()
+        Order.objects.filter(pk=order.pk).update(total_amount=Decimal("0.01"))
+        response = self.client.get(f"/api/orders/{order.pk}/")
+        self.assertEqual(
+            Decimal(response.json()["total_amount"]), self.expected_total(order)
+        )
+
+    def test_recompute_totals_corrects_drift(self):
+        drifted = list(Order.objects.order_by("pk").values_list("pk", flat=True)[:3])
+        Order.objects.filter(pk__in=drifted).update(total_amount=Decimal("0.01"))
+
+        out = StringIO()
+        call_command("recompute_totals", dry_run=True, chunk_size=2, stdout=out)
+        self.assertIn("Checked 6 orders, 3 totals would be corrected", out.getvalue())
+
+        call_command("recompute_totals", chunk_size=2, stdout=out)
+        for order in Order.objects.all():
+            self.assertEqual(order.total_amount, self.expected_total(order))
+
+        out = StringIO()
+        call_command("recompute_totals", stdout=out)
+        self.assertIn("0 totals corrected", out.getvalue())
+
+    def test_admin_item_delete_refreshes_order_total(self):
+        admin_user = User.objects.create_superuser("admin", "admin@example.com")
+        self.client.force_login(admin_user)
+        item = OrderItem.objects.first()
+        order = item.order
+        self.client.post(
+            f"/admin/store_products/orderitem/{item.pk}/delete/", {"post": "yes"}
+        )
+        order.refresh_from_db()
+        self.assertEqual(order.total_amount, self.expected_total(order))
+
+
+class RelatedProductsTestCase(SeededTestCase):
+    population = {"users": 3, "products": 8, "orders": 40, "seed": 11}
+
+    def brute_force_counts(self):
+        counts = Counter()
+        for order in Order.objects.exclude(status="cancelled"):
+            products = set(order.order_items.values_list("product_id", flat=True))
+            for product in products:
+                for related in products - {product}:
+                    counts[product, related] += 1
+        return counts
+
+    def indexed_counts(self):
+        return Counter(
+            {
+                (row.product_id, row.related_id): row.order_count
+                for row in ProductCoPurchase.objects.filter(order_count__gt=0)
+            }
+        )
+
+    def test_build_matches_brute_force(self):
+        call_command("build_related_products", chunk_size=7, stdout=StringIO())
+        self.assertEqual(self.indexed_counts(), self.brute_force_counts())
+
+        # Rebuilding starts over instead of adding to the counts
+        call_command("build_related_products", stdout=StringIO())
+        self.assertEqual(self.indexed_counts(), self.brute_force_counts())
+
+    def test_orders_update_index(self):
+        call_command("build_related_products", stdout=StringIO())
+        user = User.objects.first()
+        products = list(Products.objects.filter(stock_quantity__gt=0)[:3])
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": user.pk,
+                "shipping_address": "1 Test Road",
+                "order_items": [
+                    {"product_id": str(product.pk), "quantity": "1"}
+                    for product in products
+                ],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.indexed_counts(), self.brute_force_counts())
+
+        order_id = response.json()["id"]
+        self.client.delete(f"/api/orders/{order_id}/cancel/")
+        self.assertEqual(self.indexed_counts(), self.brute_force_counts())
+
+        self.client.patch(
+            f"/api/orders/{order_id}/update/",
+            {"status": "pending"},
+            content_type="application/json",
+        )
+        self.assertEqual(self.indexed_counts(), self.brute_force_counts())
+
+    def test_related_endpoint(self):
+        call_command("build_related_products", stdout=StringIO())
+        product, _ = self.brute_force_counts().most_common(1)[0][0]
+        expected = sorted(
+            (n for (p, _), n in self.brute_force_counts().items() if p == product),
+            reverse=True,
+        )
+
+        with self.assertNumQueries(1):
+            response = self.client.get(f"/api/products/{product}/related/")
+        self.assertEqual([row["order_count"] for row in response.json()], expected[:10])
+
+        response = self.client.get(f"/api/products/{product}/related/?limit=2")
+        self.assertEqual([row["order_count"] for row in response.json()], expected[:2])
+
+        response = self.client.get(f"/api/products/{product}/related/?limit=x")
+        self.assertEqual(response.status_code, 400)
+
+        missing = Products.objects.order_by("-pk").first().pk + 1
+        response = self.client.get(f"/api/products/{missing}/related/")
+        self.assertEqual(response.status_code, 404)
+
+
+class PopularityTestCase(SeededTestCase):
+    population = {"users": 3, "products": 8, "orders": 30, "seed": 12}
+
+    def expected_sales(self, days=None):
+        items = OrderItem.objects.exclude(order__status="cancelled")
+        if days is not None:
+            items = items.filter(
+                order__created_at__gte=timezone.now() - timedelta(days=days)
+            )
+        sales = Counter()
+        for product_id, quantity in items.values_list("product_id", "quantity"):
+            sales[product_id] += quantity
+        return sales
+
+    def assertCountersMatch(self):
+        for field, days in [("sales_total", None), ("sales_7d", 7), ("sales_30d", 30)]:
+            expected = self.expected_sales(days)
+            for product in Products.objects.all():
+                self.assertEqual(
+                    getattr(product, field), expected[product.pk], (field, product.pk)
+                )
+
+    def test_counters_follow_orders(self):
+        self.assertCountersMatch()
+
+        user = User.objects.first()
+        products = list(Products.objects.filter(stock_quantity__gt=1)[:2])
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": user.pk,
+                "shipping_address": "1 Test Road",
+                "order_items": [
+                    {"product_id": str(product.pk), "quantity": "2"}
+                    for product in products
+                ],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertCountersMatch()
+
+        self.client.delete(f"/api/orders/{response.json()['id']}/cancel/")
+        self.assertCountersMatch()
+
+    def test_refresh_decays_windows(self):
+        order = (
+            Order.objects.exclude(status="cancelled")
+            .filter(created_at__gte=timezone.now() - timedelta(days=6))
+            .first()
+        )
+        Order.objects.filter(pk=order.pk).update(
+            created_at=timezone.now() - timedelta(days=10)
+        )
+        call_command("refresh_popularity", stdout=StringIO())
+        self.assertCountersMatch()
+
+        out = StringIO()
+        call_command("refresh_popularity", all_time=True, stdout=out)
+        self.assertIn("updated 0", out.getvalue())
+
+    def test_get_products_by_popularity(self):
+        expected = [
+            product.pk
+            for product in sorted(
+                Products.objects.filter(is_available=True),
+                key=lambda product: (-product.sales_30d, product.pk),
+            )
+        ]
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/products/?ordering=popularity&is_available=true&limit=3&offset=1"
+            )
+        self.assertEqual([row["id"] for row in response.json()], expected[1:4])
+
+        # Without an ordering, pages follow the IDs
+        ids = sorted(Products.objects.values_list("pk", flat=True))
+        response = self.client.get("/api/products/?limit=3&offset=2")
+        self.assertEqual([row["id"] for row in response.json()], ids[2:5])
+
+        response = self.client.get("/api/products/?ordering=price")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/products/?limit=-1")
+        self.assertEqual(response.status_code, 400)
+
+
+class ProductsBatchTestCase(SeededTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = create_products(5)
+
+    def test_order_missing_and_duplicates(self):
+        first, second, third = (product.pk for product in self.products[:3])
+        missing = self.products[-1].pk + 100
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                f"/api/products/batch/?ids={third},{missing},{first},{third},{second}"
+            )
+        body = response.json()
+        self.assertEqual(
+            [product["id"] for product in body["products"]], [third, first, second]
+        )
+        self.assertEqual(body["missing"], [missing])
+
+        response = self.client.post(
+            "/api/products/batch/",
+            {"ids": [second, first]},
+            content_type="application/json",
+        )
+        self.assertEqual(
+            [product["id"] for product in response.json()["products"]],
+            [second, first],
+        )
+
+    def test_served_from_product_cache(self):
+        ids = [product.pk for product in self.products]
+        self.client.get(f"/api/products/{ids[0]}/")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(f"/api/products/batch/?ids={ids[0]},{ids[1]}")
+        self.assertEqual(len(queries), 1)
+
+        # Both are cached now, and get_product reads the batch's entries too
+        with self.assertNumQueries(0):
+            self.client.get(f"/api/products/batch/?ids={ids[0]},{ids[1]}")
+            self.client.get(f"/api/products/{ids[1]}/")
+
+        # A write makes the cached entries stale
+        self.client.patch(
+            f"/api/products/{ids[1]}/update/",
+            {"name": "Renamed"},
+            content_type="application/json",
+        )
+        response = self.client.get(f"/api/products/batch/?ids={ids[1]}")
+        self.assertEqual(response.json()["products"][0]["name"], "Renamed")
+
+    @override_settings(PRODUCT_BATCH_MAX_IDS=2)
+    def test_rejects_bad_ids(self):
+        response = self.client.get("/api/products/batch/?ids=1,2,3")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/products/batch/?ids=1,abc")
+        self.assertEqual(response.status_code, 400)
+        for ids in (5, "12", {"1": 1}):
+            response = self.client.post(
+                "/api/products/batch/", {"ids": ids}, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+@override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=0)
+class ProductChangesTestCase(TestCase):
+    def setUp(self):
+        self.products = create_products(5)
+
+    def sync(self, since=None, limit=2):
+        """Follow the feed to its end, return (changed IDs, deleted IDs, token)"""
+        changed, deleted = [], []
+        while True:
+            query = {"limit": limit, **({"since": since} if since else {})}
+            body = self.client.get("/api/products/changes/", query).json()
+            changed += [product["id"] for product in body["changed"]]
+            deleted += body["deleted"]
+            since = body["next"]
+            if not body["has_more"]:
+                return changed, deleted, since
+
+    def test_incremental_sync(self):
+        changed, deleted, token = self.sync()
+        self.assertEqual(changed, [product.pk for product in self.products])
+        self.assertEqual(deleted, [])
+
+        # Nothing new: same token, nothing returned
+        self.assertEqual(self.sync(token), ([], [], token))
+
+        updated, removed = self.products[1], self.products[3]
+        self.client.patch(
+            f"/api/products/{updated.pk}/update/",
+            {"price": "19.99"},
+            content_type="application/json",
+        )
+        self.client.delete(f"/api/products/{removed.pk}/delete/")
+        changed, deleted, token = self.sync(token)
+        self.assertEqual(changed, [updated.pk])
+        self.assertEqual(deleted, [removed.pk])
+
+    def test_recent_writes_held_back(self):
+        with override_settings(PRODUCT_CHANGES_SETTLE_SECONDS=60):
+            self.assertEqual(self.sync()[:2], ([], []))
+
+    def test_rejects_bad_token(self):
+        response = self.client.get("/api/products/changes/?since=abc")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get("/api/products/changes/?since=1.7.1")
+        self.assertEqual(response.status_code, 400)
+        # Well formed, but past the largest datetime
+        response = self.client.get(
+            "/api/products/changes/?since=300000000000000000.0.1"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RecordingSink:
+    sent = []
+
+    def __init__(self, fail=False):
+        self.fail = fail
+
+    def send(self, events):
+        if self.fail:
+            raise ConnectionError("sink down")
+        RecordingSink.sent.extend(
+            (event.entity, event.entity_id, event.op) for event in events
+        )
+
+
+class OutboxTestCase(SeededTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com")
+        cls.products = create_products(3)
+
+    def setUp(self):
+        super().setUp()
+        OutboxEvent.objects.all().delete()
+        RecordingSink.sent = []
+
+    def recorded(self):
+        return list(
+            OutboxEvent.objects.order_by("pk").values_list("entity", "entity_id", "op")
+        )
+
+    def test_product_writes(self):
+        response = self.client.post(
+            "/api/products/add/",
+            {"name": "New", "description": "New", "price": "1.00", "stock_quantity": 1},
+            content_type="application/json",
+        )
+        product_id = response.json()["id"]
+        self.client.patch(
+            f"/api/products/{product_id}/update/",
+            {"price": "2.00"},
+            content_type="application/json",
+        )
+        self.client.delete(f"/api/products/{product_id}/delete/")
+        self.assertEqual(
+            self.recorded(),
+            [
+                ("product", product_id, "created"),
+                ("product", product_id, "updated"),
+                ("product", product_id, "deleted"),
+            ],
+        )
+        versions = list(OutboxEvent.objects.order_by("pk").values_list("version"))
+        self.assertEqual(versions, sorted(versions))
+
+    def test_order_writes(self):
+        first, second, _ = self.products
+        order_items = [
+            {"product_id": str(product.pk), "quantity": "1"}
+            for product in (first, second)
+        ]
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": self.user.pk,
+                "shipping_address": "1 Road",
+                "order_items": order_items,
+            },
+            content_type="application/json",
+        )
+        order = Order.objects.get(pk=response.json()["id"])
+        item_ids = sorted(order.order_items.values_list("pk", flat=True))
+        self.assertCountEqual(
+            self.recorded(),
+            [("order", order.pk, "created")]
+            + [("order_item", pk, "created") for pk in item_ids]
+            + [("product", first.pk, "updated"), ("product", second.pk, "updated")],
+        )
+
+        # A failed write leaves no events behind
+        OutboxEvent.objects.all().delete()
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": self.user.pk,
+                "shipping_address": "1 Road",
+                "order_items": [{"product_id": str(first.pk), "quantity": "99"}],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.recorded(), [])
+
+    def test_cancelling_by_update_emits_product_events(self):
+        product = self.products[0]
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": self.user.pk,
+                "shipping_address": "1 Road",
+                "order_items": [{"product_id": str(product.pk), "quantity": "1"}],
+            },
+            content_type="application/json",
+        )
+        order_id = response.json()["id"]
+        OutboxEvent.objects.all().delete()
+        self.client.patch(
+            f"/api/orders/{order_id}/update/",
+            {"status": "cancelled"},
+            content_type="application/json",
+        )
+        self.assertCountEqual(
+            self.recorded(),
+            [("order", order_id, "updated"), ("product", product.pk, "updated")],
+        )
+
+    @override_settings(ADMIN_BULK_CHUNK_SIZE=2)
+    def test_bulk_update_emits_per_row(self):
+        Products.objects.filter(pk=self.products[0].pk).update(is_available=False)
+        chunked_update(Products.objects.filter(is_available=True), is_available=False)
+        self.assertCountEqual(
+            self.recorded(),
+            [("product", product.pk, "updated") for product in self.products[1:]],
+        )
+
+    def test_relay(self):
+        for product in self.products:
+            product.save()
+        expected = self.recorded()
+
+        sinks = {"broken": RecordingSink(fail=True)}
+        with self.assertRaises(ConnectionError):
+            outbox.relay(sinks, batch_size=2, once=True)
+        self.assertEqual(self.recorded(), expected)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "events.jsonl"
+            sinks = outbox.load_sinks(
+                {
+                    "SINKS": {
+                        "recording": {"BACKEND": "store_products.tests.RecordingSink"},
+                        "file": {
+                            "BACKEND": "store_products.outbox.JsonLinesSink",
+                            "OPTIONS": {"path": path},
+                        },
+                    }
+                }
+            )
+            self.assertEqual(outbox.relay(sinks, batch_size=2, once=True), 3)
+            lines = [json.loads(line) for line in path.read_text().splitlines()]
+        self.assertEqual(RecordingSink.sent, expected)
+        self.assertEqual(
+            [line["entity_id"] for line in lines], [e[1] for e in expected]
+        )
+        self.assertEqual(self.recorded(), [])
+        self.assertEqual(outbox.report_lag(), 0)
+
+
+@override_settings(ORDER_EVENTS={"HEARTBEAT_SECONDS": 0.05, "BUFFER_SIZE": 2})
+class OrderStatusEventsTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("buyer", "buyer@example.com")
+        cls.order = Order.objects.create(user=cls.user, shipping_address="1 Road")
+
+    def set_status(self, status):
+        with self.captureOnCommitCallbacks(execute=True):
+            order = Order.objects.get(pk=self.order.pk)
+            order.status = status
+            order.save()
+
+    async def open_stream(self, **query):
+        response = await self.async_client.get("/api/orders/events/", query)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = aiter(response.streaming_content)
+        self.assertTrue((await anext(events)).startswith(b"retry:"))
+        return events
+
+    async def test_order_stream(self):
+        events = await self.open_stream(order_id=self.order.pk)
+        try:
+            self.assertIn(b'"status": "pending"', await anext(events))
+            self.assertEqual(await anext(events), b": keepalive\n\n")
+
+            await sync_to_async(self.set_status)("shipped")
+            self.assertIn(b'"status": "shipped"', await anext(events))
+
+            # A save that changes neither status is not sent
+            await sync_to_async(self.set_status)("shipped")
+            self.assertEqual(await anext(events), b": keepalive\n\n")
+        finally:
+            await events.aclose()
+
+    async def test_stream_unsubscribes_when_closed(self):
+        topic = order_events.order_topic(self.order.pk + 1)
+        events = order_events.stream([topic])
+        await anext(events)
+        self.assertTrue(order_events.broker.has_subscribers(topic))
+        # What a client disconnect does to the stream
+        await events.aclose()
+        self.assertFalse(order_events.broker.has_subscribers(topic))
+
+    async def test_user_stream_overflow(self):
+        events = await self.open_stream(user_id=self.user.pk)
+        try:
+            for status in ["confirmed", "shipped", "delivered"]:
+                await sync_to_async(self.set_status)(status)
+            self.assertIn(b'"status": "confirmed"', await anext(events))
+            # The buffer held two events; the client is told to refetch
+            self.assertIn(b'"status": "shipped"', await anext(events))
+            self.assertIn(b"event: resync", await anext(events))
+        finally:
+            await events.aclose()
+
+    async def test_rejects_bad_requests(self):
+        response = await self.async_client.get("/api/orders/events/")
+        self.assertEqual(response.status_code, 400)
+        response = await self.async_client.get(
+            "/api/orders/events/", {"order_id": self.order.pk + 1}
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_asgi(self):
+        response = self.client.get(f"/api/orders/events/?order_id={self.order.pk}")
+        self.assertEqual(response.status_code, 501)
+
+
+@override_settings(DATABASE_ORDER_SHARDS=["orders_0", "orders_1"])
+class OrderShardRouterTestCase(TestCase):
+    def test_jump_hash_moves_keys_only_to_new_shards(self):
+        before = [sharding.jump_hash(key, 4) for key in range(10000)]
+        after = [sharding.jump_hash(key, 5) for key in range(10000)]
+        self.assertEqual(before, [sharding.jump_hash(key, 4) for key in range(10000)])
+        moved = [b for a, b in zip(before, after) if a != b]
+        self.assertEqual(set(moved), {4})
+        self.assertAlmostEqual(len(moved) / 10000, 1 / 5, delta=0.02)
+        self.assertEqual(Counter(before).keys(), {0, 1, 2, 3})
+
+    def test_routing(self):
+        router = OrderShardRouter()
+        shard = sharding.shard_for_user(7)
+        self.assertEqual(router.db_for_write(Order, instance=Order(user_id=7)), shard)
+        saved = Order(user_id=7)
+        saved._state.adding = False
+        saved._state.db = "default"
+        self.assertEqual(router.db_for_read(Order, instance=saved), "default")
+        item = OrderItem(order=Order(user_id=7))
+        self.assertEqual(router.db_for_write(OrderItem, instance=item), shard)
+        self.assertIsNone(router.db_for_write(Order))
+        self.assertIsNone(router.db_for_write(Products))
+        self.assertTrue(router.allow_migrate("orders_0", "store_products", "order"))
+        self.assertFalse(router.allow_migrate("orders_0", "store_products", "products"))
+        self.assertIsNone(router.allow_migrate("default", "store_products", "order"))
+
+    def test_ids_locate_their_shard(self):
+        base = sharding.id_base("orders_1")
+        self.assertEqual(sharding.home_shard(base + 1), "orders_1")
+        self.assertIsNone(sharding.home_shard(5))
+
+    def test_merge(self):
+        now = timezone.now()
+        shards = [
+            [Order(pk=4, created_at=now), Order(pk=1, created_at=now)],
+            [Order(pk=3, created_at=now), Order(pk=2, created_at=now - timedelta(1))],
+        ]
+        merged = sharding.merge(shards, ["-created_at", "-pk"], Order)
+        self.assertEqual([order.pk for order in merged], [4, 3, 1, 2])
+
+
+class OrderShardingTestCase(TransactionTestCase):
+    """The order endpoints and commands with orders on two shard files"""
+
+    shards = ["orders_0", "orders_1"]
+
+    @classmethod
+    def setUpClass(cls):
+        # Registered here, as the runner only creates the configured aliases
+        cls.directory = tempfile.TemporaryDirectory()
+        for alias in cls.shards:
+            add_database(alias, str(Path(cls.directory.name) / f"{alias}.sqlite3"))
+        cls.databases = {"default", *cls.shards}
+        cls.enterClassContext(override_settings(DATABASE_ORDER_SHARDS=cls.shards))
+        super().setUpClass()
+        for alias in cls.shards:
+            call_command("migrate", "store_products", database=alias, verbosity=0)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in cls.shards:
+            remove_database(alias)
+        cls.directory.cleanup()
+
+    def setUp(self):
+        cache.clear()
+        self.product = Products.objects.create(
+            name="Lamp", description="", price="9.99", stock_quantity=100
+        )
+        # One user on each shard
+        self.users = {}
+        for i in range(20):
+            user = User.objects.create_user(f"buyer{i}")
+            self.users.setdefault(sharding.shard_for_user(user.pk), user)
+
+    def place_order(self, user):
+        response = self.client.post(
+            "/api/orders/create/",
+            {
+                "user": user.pk,
+                "shipping_address": "1 Road",
+                "order_items": [{"product_id": str(self.product.pk), "quantity": "1"}],
+            },
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.json()["id"]
+
+    def test_orders_are_placed_on_their_users_shard(self):
+        for alias, user in self.users.items():
+            order_id = self.place_order(user)
+            self.assertGreater(order_id, sharding.id_base(alias))
+            order = Order.objects.using(alias).get(pk=order_id)
+            self.assertEqual(order.order_items.count(), 1)
+            self.assertEqual(
+                set(OutboxEvent.objects.using(alias).values_list("entity", flat=True)),
+                {"order", "order_item"},
+            )
+        self.assertFalse(Order.objects.using("default").exists())
+        self.assertEqual(
+            set(OutboxEvent.objects.values_list("entity", flat=True)), {"product"}
+        )
+
+        RecordingSink.sent = []
+        sinks = {"recording": RecordingSink()}
+        # The product's creation, then two updates and two orders of one item
+        self.assertEqual(outbox.relay(sinks, batch_size=10, once=True), 7)
+        self.assertEqual(
+            Counter(entity for entity, _, _ in RecordingSink.sent),
+            {"product": 3, "order": 2, "order_item": 2},
+        )
+
+    def test_order_reads(self):
+        placed = [self.place_order(user) for user in self.users.values() for _ in "ab"]
+        response = self.client.get("/api/orders/")
+        self.assertEqual([order["id"] for order in response.json()], placed[::-1])
+
+        alias, user = next(iter(self.users.items()))
+        other = next(shard for shard in self.shards if shard != alias)
+        with CaptureQueriesContext(connections[other]) as queries:
+            response = self.client.get("/api/orders/", {"user_id": user.pk})
+        self.assertEqual(len(response.json()), 2)
+        self.assertEqual(len(queries), 0)
+
+        order_id = response.json()[0]["id"]
+        self.assertEqual(self.client.get(f"/api/orders/{order_id}/").status_code, 200)
+        response = self.client.delete(f"/api/orders/{order_id}/cancel/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Order.objects.using(alias).get(pk=order_id).status, "cancelled"
+        )
+        self.assertEqual(self.client.get("/api/orders/0/").status_code, 404)
+
+    def test_request_metrics_count_fanned_out_queries(self):
+        for user in self.users.values():
+            self.place_order(user)
+        response = self.client.get("/api/orders/")
+        queries = int(re.search(r'"(\d+) queries"', response["Server-Timing"])[1])
+        # The orders and their items, on each shard
+        self.assertGreaterEqual(queries, 2 * len(self.shards))
+
+    @override_settings(SQL_PROFILER={"SAMPLE_RATE": 1.0})
+    def test_profiler_records_fanned_out_queries(self):
+        for user in self.users.values():
+            self.place_order(user)
+        profiler.reset()
+        self.client.get("/api/orders/")
+        counts = {
+            row["fingerprint"]: row["count"] for row in profiler.report()["api/orders/"]
+        }
+        orders = [key for key in counts if 'FROM "store_products_order" ' in key]
+        self.assertEqual(len(orders), 1)
+        self.assertEqual(counts[orders[0]], len(self.shards))
+
+    def test_reshard_moves_orders_to_a_new_shard(self):
+        with override_settings(DATABASE_ORDER_SHARDS=self.shards[:1]):
+            placed = {user.pk: self.place_order(user) for user in self.users.values()}
+        self.assertEqual(Order.objects.using("orders_1").count(), 0)
+
+        call_command("reshard_orders", stdout=StringIO())
+        moved = placed[self.users["orders_1"].pk]
+        order = Order.objects.using("orders_1").get(pk=moved)
+        self.assertEqual(order.order_items.count(), 1)
+        self.assertFalse(Order.objects.using("orders_0").filter(pk=moved).exists())
+        self.assertFalse(OrderItem.objects.using("orders_0").filter(order_id=moved))
+
+        # Found on a shard other than the one that numbered it
+        self.assertEqual(self.client.get(f"/api/orders/{moved}/").status_code, 200)
+        out = StringIO()
+        call_command("reshard_orders", stdout=out)
+        self.assertIn("0 orders moved", out.getvalue())
+
+    def test_admin(self):
+        placed = [self.place_order(user) for user in self.users.values()]
+        admin_user = User.objects.create_superuser("admin", "admin@example.com")
+        self.client.force_login(admin_user)
+
+        response = self.client.get("/admin/store_products/order/")
+        self.assertEqual(
+            [order.pk for order in response.context["cl"].result_list], placed[::-1]
+        )
+        response = self.client.get("/admin/store_products/orderitem/", {"q": "Lamp"})
+        self.assertEqual(len(response.context["cl"].result_list), 2)
+        response = self.client.get(f"/admin/store_products/order/{placed[0]}/change/")
+        self.assertEqual(response.status_code, 200)
+
+        self.client.post(
+            "/admin/store_products/order/",
+            {"action": "mark_shipped", "_selected_action": placed},
+        )
+        for alias in self.shards:
+            self.assertEqual(
+                set(Order.objects.using(alias).values_list("status", flat=True)),
+                {"shipped"},
+            )
+
+    def test_commands(self):
+        populate(users=4, products=20, orders=20, seed=1)
+        self.assertFalse(Order.objects.using("default").exists())
+        self.assertEqual(
+            sum(Order.objects.using(alias).count() for alias in self.shards), 20
+        )
+
+        out = StringIO()
+        call_command("recompute_totals", stdout=out)
+        self.assertIn("Checked 20 orders, 0 totals corrected", out.getvalue())
+        out = StringIO()
+        call_command("build_related_products", chunk_size=3, stdout=out)
+        self.assertIn("from 20 orders", out.getvalue())
@@ -0,0 +1,157 @@
+"""Per-client rate limiting, applied before the view runs.
+
+Each client has a token bucket per scope: the shared ``DEFAULT`` bucket, or
+a route's own bucket when ``ROUTES`` gives it a rate. A request takes its
+route's ``COST`` in tokens, so a full catalog dump can cost as much as ten
+single-product lookups. A request that finds too few tokens gets a 429 with
+``Retry-After`` from ``process_view``, before authentication, permission
+checks or any query.
+
+Buckets are kept with the generic cell rate algorithm (GCRA), which is
+equivalent to a token bucket but stores one float per bucket: the time at
+which the bucket will be full again.
+"""
+
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+DEFAULTS = {
+    "ENABLED": True,
+    # Tokens per second and bucket size for every client
+    "DEFAULT": {"RATE": 10.0, "BURST": 100},
+    # Route pattern -> {"COST": tokens per request}, plus optional "RATE" and
+    # "BURST" to give the route its own bucket per client
+    "ROUTES": {},
+    # Number of reverse proxies in front of the app whose X-Forwarded-For
+    # entries are trusted; 0 uses REMOTE_ADDR
+    "TRUSTED_PROXIES": 0,
+    # Cache alias to share buckets between worker processes, None keeps them
+    # in process memory
+    "CACHE_ALIAS": None,
+    # In-process buckets kept before idle ones are dropped
+    "MAX_BUCKETS": 100000,
+}
+
+
+class Bucket:
+    """Rate and capacity of one scope, in GCRA terms"""
+
+    __slots__ = ("name", "interval", "tolerance")
+
+    def __init__(self, name, rate, burst):
+        self.name = name
+        # Seconds one token takes to refill
+        self.interval = 1.0 / rate
+        # How far ahead of now the full time may be: a full bucket
+        self.tolerance = burst * self.interval
+
+
+class MemoryStore:
+    """Full times per bucket key in a dict, guarded by one lock"""
+
+    def __init__(self, max_buckets):
+        self.max_buckets = max_buckets
+        self.full_at = {}
+        self.lock = threading.Lock()
+
+    def take(self, key, bucket, cost):
+        """Return 0 if ``cost`` tokens were taken, else seconds to wait"""
+        now = time.monotonic()
+        with self.lock:
+            full_at = max(self.full_at.get(key, now), now) + cost * bucket.interval
+            wait = full_at - now - bucket.tolerance
+            if wait > 0:
+                return wait
+            if len(self.full_at) >= self.max_buckets and key not in self.full_at:
+                self.prune(now)
+            self.full_at[key] = full_at
+            return 0
+
+    def prune(self, now):
+        # Buckets that have refilled carry no state worth keeping
+        self.full_at = {k: t for k, t in self.full_at.items() if t > now}
+
+
+class CacheStore:
+    """Full times in a cache shared by worker processes.
+
+    The read and write are not atomic, so racing workers may admit a few
+    more requests than the rate allows; throttling stays approximate
+    rather than adding a lock round trip to every request.
+    """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def take(self, key, bucket, cost):
+        # Wall clock, as the full times are compared across processes
+        now = time.time()
+        cache_key = f"throttle:{key[0]}:{key[1]}"
+        full_at = max(self.cache.get(cache_key, now), now) + cost * bucket.interval
+        wait = full_at - now - bucket.tolerance
+        if wait > 0:
+            return wait
+        self.cache.set(cache_key, full_at, math.ceil(full_at - now) + 1)
+        return 0
+
+
+class ThrottleMiddleware:
+    """Reject requests over the client's rate with 429 and ``Retry-After``.
+
+    Configured by the ``THROTTLE`` setting, see ``DEFAULTS``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        config = {**DEFAULTS, **getattr(settings, "THROTTLE", {})}
+        self.enabled = config["ENABLED"]
+        self.trusted_proxies = config["TRUSTED_PROXIES"]
+        self.default = Bucket(
+            "default", config["DEFAULT"]["RATE"], config["DEFAULT"]["BURST"]
+        )
+        # Route -> (bucket, cost), resolved once here instead of per request
+        self.routes = {}
+        for route, options in config["ROUTES"].items():
+            bucket = self.default
+            if "RATE" in options:
+                bucket = Bucket(
+                    route, options["RATE"], options.get("BURST", options["RATE"])
+                )
+            self.routes[route] = (bucket, options.get("COST", 1))
+        if config["CACHE_ALIAS"]:
+            self.store = CacheStore(config["CACHE_ALIAS"])
+        else:
+            self.store = MemoryStore(config["MAX_BUCKETS"])
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not self.enabled:
+            return None
+        bucket, cost = self.routes.get(request.resolver_match.route, (self.default, 1))
+        wait = self.store.take((self.client(request), bucket.name), bucket, cost)
+        if not wait:
+            return None
+        retry_after = math.ceil(wait)
+        response = JsonResponse(
+            {
+                "detail": "Request was throttled. Expected available in "
+                f"{retry_after} seconds."
+            },
+            status=429,
+        )
+        response["Retry-After"] = str(retry_after)
+        return response
+
+    def client(self, request):
+        if self.trusted_proxies:
+            forwarded = request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")
+            if len(forwarded) >= self.trusted_proxies:
+                return forwarded[-self.trusted_proxies].strip()
+        return request.META.get("REMOTE_ADDR", "")
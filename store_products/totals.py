@@ -0,0 +1,87 @@
+"""Order totals computed by the database.
+
+An order's total is ``Sum(quantity * price_at_time)`` over its items. These
+helpers compute it in SQL for one order, annotate it onto a queryset of
+orders, or write it back to ``Order.total_amount``, so totals never require
+loading the items.
+"""
+
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from store_products import outbox
+from store_products.models import Order, OrderItem
+
+# Wide enough for any sum of Order.total_amount sized lines
+TOTAL_FIELD = DecimalField(max_digits=14, decimal_places=2)
+
+
+def line_total():
+    return ExpressionWrapper(
+        F("quantity") * F("price_at_time"), output_field=TOTAL_FIELD
+    )
+
+
+def items_total():
+    """Total of the items of the order in the outer query"""
+    items = (
+        OrderItem.objects.filter(order=OuterRef("pk"))
+        .order_by()
+        .values("order")
+        .annotate(total=Sum(line_total()))
+        .values("total")
+    )
+    return Coalesce(Subquery(items), Decimal("0"), output_field=TOTAL_FIELD)
+
+
+def order_total(order_id):
+    """Total of one order's items, in a single aggregate query"""
+    return OrderItem.objects.filter(order_id=order_id).aggregate(
+        total=Coalesce(Sum(line_total()), Decimal("0"), output_field=TOTAL_FIELD)
+    )["total"]
+
+
+def with_totals(queryset):
+    """Annotate each order with ``computed_total``"""
+    return queryset.annotate(computed_total=items_total())
+
+
+def refresh_totals(queryset):
+    """Set ``total_amount`` from the items of every order in ``queryset``.
+
+    One UPDATE, for use after items were added, edited or removed, plus
+    one INSERT for the outbox events.
+    """
+    now = timezone.now()
+    outbox.emit_queryset(queryset, outbox.UPDATED, now)
+    return queryset.update(total_amount=items_total(), updated_at=now)
+
+
+def drifted_totals(chunk_size, using=None):
+    """Yield ``(orders checked, orders with a wrong total)`` per chunk.
+
+    Orders on database ``using`` are read in primary key order,
+    ``chunk_size`` at a time, with only their ID, stored total and computed
+    total. The orders yielded have ``total_amount`` set to the computed
+    total, ready for ``bulk_update``.
+    """
+    orders = Order.objects.using(using) if using else Order.objects
+    last_pk = 0
+    while True:
+        rows = list(
+            with_totals(orders.filter(pk__gt=last_pk))
+            .order_by("pk")
+            .values_list("pk", "total_amount", "computed_total")[:chunk_size]
+        )
+        if not rows:
+            return
+        last_pk = rows[-1][0]
+        # Compared as Decimals: SQLite computes the sum in floating point
+        drifted = [
+            Order(pk=pk, total_amount=computed)
+            for pk, stored, computed in rows
+            if stored != computed
+        ]
+        yield len(rows), drifted
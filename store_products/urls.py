@@ -1,25 +1,33 @@
 from django.urls import path
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
-    SpectacularRedocView,
-)
-from store_products import views
+from store_products import schema, views
 
 urlpatterns = [
-    # API schema and docs
-    path("schema/", SpectacularAPIView.as_view(), name="schema"),
+    # API schema and docs. The schema is generated once and served from
+    # memory; the drf_spectacular views are imported on first use.
+    path("schema/", schema.schema_view, name="schema"),
     path(
         "docs/swagger/",
-        SpectacularSwaggerView.as_view(url_name="schema"),
+        schema.lazy_view(
+            "drf_spectacular.views.SpectacularSwaggerView", url_name="schema"
+        ),
         name="swagger-ui",
     ),
-    path("docs/redoc/", SpectacularRedocView.as_view(url_name="schema"), name="redoc"),
+    path(
+        "docs/redoc/",
+        schema.lazy_view(
+            "drf_spectacular.views.SpectacularRedocView", url_name="schema"
+        ),
+        name="redoc",
+    ),
     # Test endpoint
     path("hello/", views.hello_world),
+    # Prometheus metrics
+    path("metrics/", views.metrics_view, name="metrics"),
     # Product CRUD endpoints
     path("products/", views.get_products, name="get_products"),
     path("products/<int:product_id>/", views.get_product, name="get_product"),
+    path("products/batch/", views.get_products_batch, name="get_products_batch"),
+    path("products/changes/", views.get_product_changes, name="get_product_changes"),
     path("products/add/", views.add_products, name="add_products"),
     path(
         "products/<int:product_id>/update/", views.update_product, name="update_product"
@@ -27,10 +35,16 @@ urlpatterns = [
     path(
         "products/<int:product_id>/delete/", views.delete_product, name="delete_product"
     ),
+    path(
+        "products/<int:product_id>/related/",
+        views.related_products,
+        name="related_products",
+    ),
     # Order CRUD endpoints
     path("orders/", views.get_orders, name="get_orders"),
     path("orders/<int:order_id>/", views.get_order, name="get_order"),
     path("orders/create/", views.create_order, name="create_order"),
+    path("orders/events/", views.order_status_events, name="order_status_events"),
     path("orders/<int:order_id>/update/", views.update_order, name="update_order"),
     path("orders/<int:order_id>/cancel/", views.cancel_order, name="cancel_order"),
     # Payment endpoints (to be implemented)
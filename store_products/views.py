@@ -1,12 +1,27 @@
 # from django.shortcuts import render
 from django.conf import settings
-from django.http import HttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from store_products import metrics
+from store_products.cache import (
+    cached_catalog_view,
+    catalog_cache,
+    catalog_key,
+    catalog_version,
+    invalidate_catalog,
+)
 from store_products.models import Products, Order
-from django.db import transaction
+from store_products import changes, order_events, outbox, popularity, related, sharding
+from asgiref.sync import sync_to_async
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-import razorpay
+from store_products.payments import CircuitOpenError, call_gateway, get_razorpay_client
+from store_products.totals import with_totals
 from store_products.serializer import (
     ProductSerializer,
     OrderSerializer,
@@ -40,6 +55,15 @@ def hello_world(request):
     return HttpResponse("Hello World")
 
 
+def metrics_view(request):
+    """Expose the in-process metrics in the Prometheus text format"""
+    # The relay runs in its own process, so the backlog is read at scrape time
+    outbox.report_lag()
+    return HttpResponse(
+        metrics.render_prometheus(), content_type="text/plain; version=0.0.4"
+    )
+
+
 # PRODUCT CRUD OPERATIONS
 
 
@@ -73,13 +97,37 @@ def hello_world(request):
             description="Filter products by availability",
             required=False,
         ),
+        OpenApiParameter(
+            name="ordering",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Sort by units sold, highest first: popularity (last 30 "
+            "days), popularity_7d or popularity_all",
+            enum=list(popularity.ORDERINGS),
+            required=False,
+        ),
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Maximum number of products to return",
+            required=False,
+        ),
+        OpenApiParameter(
+            name="offset",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description="Number of products to skip",
+            required=False,
+        ),
     ],
     responses={200: ProductSerializer(many=True)},
     description="Get all products with optional filters",
 )
 @api_view(["GET"])
+@cached_catalog_view
 def get_products(request):
-    logger.info(f"Get products endpoint accessed with filters: {request.GET.dict()}")
+    logger.info("Get products endpoint accessed with filters: %s", request.GET.dict())
 
     queryset = Products.objects.all()
 
@@ -91,15 +139,15 @@ def get_products(request):
 
     if name:
         queryset = queryset.filter(name__icontains=name)
-        logger.info(f"Applied name filter: {name}")
+        logger.info("Applied name filter: %s", name)
 
     if min_price:
         try:
             min_price = float(min_price)
             queryset = queryset.filter(price__gte=min_price)
-            logger.info(f"Applied min_price filter: {min_price}")
+            logger.info("Applied min_price filter: %s", min_price)
         except ValueError:
-            logger.error(f"Invalid min_price value: {min_price}")
+            logger.error("Invalid min_price value: %s", min_price)
             return Response(
                 {"error": "Invalid min_price value"}, status=status.HTTP_400_BAD_REQUEST
             )
@@ -108,9 +156,9 @@ def get_products(request):
         try:
             max_price = float(max_price)
             queryset = queryset.filter(price__lte=max_price)
-            logger.info(f"Applied max_price filter: {max_price}")
+            logger.info("Applied max_price filter: %s", max_price)
         except ValueError:
-            logger.error(f"Invalid max_price value: {max_price}")
+            logger.error("Invalid max_price value: %s", max_price)
             return Response(
                 {"error": "Invalid max_price value"}, status=status.HTTP_400_BAD_REQUEST
             )
@@ -118,10 +166,40 @@ def get_products(request):
     if is_available is not None:
         is_available_bool = is_available.lower() in ["true", "1", "yes"]
         queryset = queryset.filter(is_available=is_available_bool)
-        logger.info(f"Applied is_available filter: {is_available_bool}")
+        logger.info("Applied is_available filter: %s", is_available_bool)
+
+    ordering = request.GET.get("ordering")
+    if ordering:
+        if ordering not in popularity.ORDERINGS:
+            logger.error("Invalid ordering value: %s", ordering)
+            return Response(
+                {"error": "Invalid ordering value"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        queryset = queryset.order_by(*popularity.order_by(ordering))
+        logger.info("Applied ordering: %s", ordering)
+
+    limit = request.GET.get("limit")
+    offset = request.GET.get("offset")
+    if limit or offset:
+        try:
+            offset = int(offset or 0)
+            limit = int(limit) if limit else None
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ValueError
+        except ValueError:
+            logger.error("Invalid limit/offset values: %s, %s", limit, offset)
+            return Response(
+                {"error": "Invalid limit or offset value"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not ordering:
+            # Unordered rows may come back in any order, so pages would overlap
+            queryset = queryset.order_by("id")
+        queryset = queryset[offset : offset + limit if limit is not None else None]
+        logger.info("Applied limit %s and offset %s", limit, offset)
 
     serialized_products = ProductSerializer(queryset, many=True)
-    logger.info(f"Returning {len(serialized_products.data)} products")
+    logger.info("Returning %s products", len(serialized_products.data))
     return Response(serialized_products.data)
 
 
@@ -129,18 +207,182 @@ def get_products(request):
     responses={200: ProductSerializer}, description="Get a specific product by ID"
 )
 @api_view(["GET"])
+@cached_catalog_view
 def get_product(request, product_id):
-    logger.info(f"Get product endpoint accessed for product ID: {product_id}")
+    logger.info("Get product endpoint accessed for product ID: %s", product_id)
     try:
         product = get_object_or_404(Products, id=product_id)
         serializer = ProductSerializer(product)
-        logger.info(f"Successfully retrieved product: {product.name}")
+        logger.info("Successfully retrieved product: %s", product.name)
         return Response(serializer.data)
     except Exception as e:
-        logger.error(f"Error retrieving product {product_id}: {str(e)}")
+        logger.error("Error retrieving product %s: %s", product_id, e)
         raise
 
 
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name="ids",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Comma-separated product IDs (GET only)",
+            required=False,
+        ),
+    ],
+    request={
+        "type": "object",
+        "properties": {"ids": {"type": "array", "items": {"type": "integer"}}},
+    },
+    responses={
+        200: {
+            "type": "object",
+            "properties": {
+                "products": {"type": "array", "items": {"type": "object"}},
+                "missing": {"type": "array", "items": {"type": "integer"}},
+            },
+        }
+    },
+    description="Get several products by ID in request order, with the IDs "
+    "that do not exist. POST the IDs for long lists.",
+)
+@api_view(["GET", "POST"])
+def get_products_batch(request):
+    if request.method == "POST":
+        ids = request.data.get("ids") if isinstance(request.data, dict) else None
+        if not isinstance(ids, list):
+            # A string or object would be iterated as characters or keys;
+            # None is rejected below
+            ids = None
+    else:
+        ids = request.GET.get("ids", "").split(",")
+    logger.info("Get products batch endpoint accessed with IDs: %s", ids)
+
+    max_ids = settings.PRODUCT_BATCH_MAX_IDS
+    try:
+        # Unique IDs, in the order first requested
+        ids = list(dict.fromkeys(int(product_id) for product_id in ids))
+    except (TypeError, ValueError):
+        logger.error("Invalid product IDs: %s", ids)
+        return Response(
+            {"error": "ids must be a list of product IDs"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    if len(ids) > max_ids:
+        logger.error("Too many product IDs: %s", len(ids))
+        return Response(
+            {"error": f"At most {max_ids} ids per request"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    # Products cached by get_product are served from there, the rest are
+    # read in one query and cached the same way
+    cache = catalog_cache()
+    version = catalog_version()
+    keys = {
+        product_id: catalog_key(version, "get_product", [("product_id", product_id)])
+        for product_id in ids
+    }
+    cached = cache.get_many(keys.values())
+    found = {
+        product_id: cached[key][1]
+        for product_id, key in keys.items()
+        if key in cached and cached[key][0] == status.HTTP_200_OK
+    }
+    to_read = [product_id for product_id in ids if product_id not in found]
+    if to_read:
+        read = {
+            product.pk: ProductSerializer(product).data
+            for product in Products.objects.filter(pk__in=to_read)
+        }
+        cache.set_many(
+            {
+                keys[product_id]: (status.HTTP_200_OK, data)
+                for product_id, data in read.items()
+            }
+        )
+        found.update(read)
+
+    missing = [product_id for product_id in ids if product_id not in found]
+    logger.info(
+        "Returning %s products, %s from cache, %s missing",
+        len(found),
+        len(ids) - len(to_read),
+        len(missing),
+    )
+    return Response(
+        {
+            "products": [
+                found[product_id] for product_id in ids if product_id in found
+            ],
+            "missing": missing,
+        }
+    )
+
+
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name="since",
+            type=OpenApiTypes.STR,
+            location=OpenApiParameter.QUERY,
+            description="Token from the previous response; omit to start from "
+            "the beginning",
+            required=False,
+        ),
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description=f"Number of changes to return (default "
+            f"{changes.DEFAULT_LIMIT}, at most {changes.MAX_LIMIT})",
+            required=False,
+        ),
+    ],
+    responses={
+        200: {
+            "type": "object",
+            "properties": {
+                "changed": {"type": "array", "items": {"type": "object"}},
+                "deleted": {"type": "array", "items": {"type": "integer"}},
+                "next": {"type": "string"},
+                "has_more": {"type": "boolean"},
+            },
+        }
+    },
+    description="Products changed and deleted since a token, oldest first",
+)
+@api_view(["GET"])
+def get_product_changes(request):
+    logger.info("Product changes endpoint accessed with: %s", request.GET.dict())
+    since = request.GET.get("since")
+    try:
+        position = changes.decode_token(since) if since else None
+        limit = int(request.GET.get("limit", changes.DEFAULT_LIMIT))
+    except ValueError:
+        logger.error("Invalid since or limit value: %s", request.GET.dict())
+        return Response(
+            {"error": "Invalid since or limit value"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    limit = max(1, min(limit, changes.MAX_LIMIT))
+
+    changed, deleted, position, has_more = changes.changes_since(position, limit)
+    logger.info(
+        "Returning %s changed and %s deleted products", len(changed), len(deleted)
+    )
+    return Response(
+        {
+            "changed": ProductSerializer(changed, many=True).data,
+            "deleted": deleted,
+            # Unchanged when there was nothing new, so the replica polls again
+            # from the same place
+            "next": changes.encode_token(position) if position else since,
+            "has_more": has_more,
+        }
+    )
+
+
 @extend_schema(
     request=ProductSerializer,
     responses={201: ProductSerializer},
@@ -148,20 +390,22 @@ def get_product(request, product_id):
 )
 @api_view(["POST"])
 def add_products(request):
-    logger.info(f"Add product endpoint accessed with data: {request.data}")
+    logger.info("Add product endpoint accessed with data: %s", request.data)
     try:
         serializer = ProductSerializer(data=request.data)
         if serializer.is_valid():
-            product = serializer.save()
+            # With the outbox event of the save
+            with transaction.atomic():
+                product = serializer.save()
             logger.info(
-                f"Successfully created product: {product.name} (ID: {product.id})"
+                "Successfully created product: %s (ID: %s)", product.name, product.id
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
-            logger.error(f"Product creation failed with errors: {serializer.errors}")
+            logger.error("Product creation failed with errors: %s", serializer.errors)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"Error creating product: {str(e)}")
+        logger.error("Error creating product: %s", e)
         raise
 
 
@@ -172,42 +416,113 @@ def add_products(request):
 )
 @api_view(["PUT", "PATCH"])
 def update_product(request, product_id):
-    logger.info(f"Update product endpoint accessed for product ID: {product_id}")
+    logger.info("Update product endpoint accessed for product ID: %s", product_id)
     try:
         product = get_object_or_404(Products, id=product_id)
         partial = request.method == "PATCH"
         serializer = ProductSerializer(product, data=request.data, partial=partial)
         if serializer.is_valid():
-            updated_product = serializer.save()
+            with transaction.atomic():
+                updated_product = serializer.save()
             logger.info(
-                f"Successfully updated product: {updated_product.name} (ID: {product_id})"
+                "Successfully updated product: %s (ID: %s)",
+                updated_product.name,
+                product_id,
             )
             return Response(serializer.data)
         else:
             logger.error(
-                f"Product update failed for ID {product_id} with errors: {serializer.errors}"
+                "Product update failed for ID %s with errors: %s",
+                product_id,
+                serializer.errors,
             )
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"Error updating product {product_id}: {str(e)}")
+        logger.error("Error updating product %s: %s", product_id, e)
         raise
 
 
 @extend_schema(responses={204: None}, description="Delete a specific product")
 @api_view(["DELETE"])
 def delete_product(request, product_id):
-    logger.info(f"Delete product endpoint accessed for product ID: {product_id}")
+    logger.info("Delete product endpoint accessed for product ID: %s", product_id)
     try:
         product = get_object_or_404(Products, id=product_id)
         product_name = product.name
-        product.delete()
-        logger.info(f"Successfully deleted product: {product_name} (ID: {product_id})")
+        with transaction.atomic():
+            product.delete()
+            changes.record_deletions([product_id])
+            outbox.emit(outbox.events(Products, [product_id], outbox.DELETED))
+        sharding.delete_product_items([product_id])
+        invalidate_catalog()
+        logger.info(
+            "Successfully deleted product: %s (ID: %s)", product_name, product_id
+        )
         return Response(status=status.HTTP_204_NO_CONTENT)
     except Exception as e:
-        logger.error(f"Error deleting product {product_id}: {str(e)}")
+        logger.error("Error deleting product %s: %s", product_id, e)
         raise
 
 
+@extend_schema(
+    parameters=[
+        OpenApiParameter(
+            name="limit",
+            type=OpenApiTypes.INT,
+            location=OpenApiParameter.QUERY,
+            description=f"Number of products to return (default {related.DEFAULT_LIMIT}, "
+            f"at most {related.MAX_LIMIT})",
+            required=False,
+        ),
+    ],
+    responses={
+        200: {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "id": {"type": "integer"},
+                    "name": {"type": "string"},
+                    "price": {"type": "string"},
+                    "is_available": {"type": "boolean"},
+                    "order_count": {"type": "integer"},
+                },
+            },
+        }
+    },
+    description="Products most often bought together with a specific product",
+)
+@api_view(["GET"])
+def related_products(request, product_id):
+    logger.info("Related products endpoint accessed for product ID: %s", product_id)
+    try:
+        limit = int(request.GET.get("limit", related.DEFAULT_LIMIT))
+    except ValueError:
+        logger.error("Invalid limit value: %s", request.GET.get("limit"))
+        return Response(
+            {"error": "Invalid limit value"}, status=status.HTTP_400_BAD_REQUEST
+        )
+    limit = max(1, min(limit, related.MAX_LIMIT))
+
+    pairs = related.related_products(product_id, limit)
+    if not pairs:
+        # Only an empty result needs telling apart from a missing product
+        get_object_or_404(Products.objects.only("pk"), id=product_id)
+    price_field = ProductSerializer().fields["price"]
+    data = [
+        {
+            "id": pair.related_id,
+            "name": pair.related.name,
+            "price": price_field.to_representation(pair.related.price),
+            "is_available": pair.related.is_available,
+            "order_count": pair.order_count,
+        }
+        for pair in pairs
+    ]
+    logger.info("Returning %s related products", len(data))
+    return Response(data)
+
+
 # ORDER CRUD OPERATIONS
 
 
@@ -233,23 +548,32 @@ def delete_product(request, product_id):
 )
 @api_view(["GET"])
 def get_orders(request):
-    logger.info(f"Get orders endpoint accessed with filters: {request.GET.dict()}")
+    logger.info("Get orders endpoint accessed with filters: %s", request.GET.dict())
 
-    queryset = Order.objects.all()
+    queryset = with_totals(
+        sharding.with_related(
+            Order.objects.prefetch_related("order_items__product"), "user"
+        )
+    )
 
     user_id = request.GET.get("user_id")
     order_status = request.GET.get("status")
 
-    if user_id:
-        queryset = queryset.filter(user_id=user_id)
-        logger.info(f"Applied user_id filter: {user_id}")
-
     if order_status:
         queryset = queryset.filter(status=order_status)
-        logger.info(f"Applied status filter: {order_status}")
+        logger.info("Applied status filter: %s", order_status)
 
-    serializer = OrderSerializer(queryset, many=True)
-    logger.info(f"Returning {len(serializer.data)} orders")
+    if user_id:
+        # All of a user's orders are on one shard
+        shard = sharding.shard_for_user(user_id)
+        orders = sharding.on_shard(queryset, shard).filter(user_id=user_id)
+        logger.info("Applied user_id filter: %s", user_id)
+    else:
+        # Newest first across every shard, read in parallel
+        orders = sharding.gather(queryset)
+
+    serializer = OrderSerializer(orders, many=True)
+    logger.info("Returning %s orders", len(serializer.data))
     return Response(serializer.data)
 
 
@@ -258,14 +582,21 @@ def get_orders(request):
 )
 @api_view(["GET"])
 def get_order(request, order_id):
-    logger.info(f"Get order endpoint accessed for order ID: {order_id}")
+    logger.info("Get order endpoint accessed for order ID: %s", order_id)
     try:
-        order = get_object_or_404(Order, id=order_id)
+        order = sharding.get_or_404(
+            with_totals(
+                sharding.with_related(
+                    Order.objects.prefetch_related("order_items__product"), "user"
+                )
+            ),
+            order_id,
+        )
         serializer = OrderSerializer(order)
-        logger.info(f"Successfully retrieved order ID: {order_id}")
+        logger.info("Successfully retrieved order ID: %s", order_id)
         return Response(serializer.data)
     except Exception as e:
-        logger.error(f"Error retrieving order {order_id}: {str(e)}")
+        logger.error("Error retrieving order %s: %s", order_id, e)
         raise
 
 
@@ -276,21 +607,30 @@ def get_order(request, order_id):
 )
 @api_view(["POST"])
 def create_order(request):
-    logger.info(f"Create order endpoint accessed with data: {request.data}")
+    logger.info("Create order endpoint accessed with data: %s", request.data)
     try:
         serializer = CreateOrderSerializer(data=request.data)
         if serializer.is_valid():
             order = serializer.save()
+            order = (
+                sharding.on_shard(
+                    sharding.with_related(Order.objects, "user"), order._state.db
+                )
+                .prefetch_related("order_items__product")
+                .get(pk=order.pk)
+            )
             response_serializer = OrderSerializer(order)
             logger.info(
-                f"Successfully created order ID: {order.id} for user: {order.user.username}"
+                "Successfully created order ID: %s for user: %s",
+                order.id,
+                order.user.username,
             )
             return Response(response_serializer.data, status=status.HTTP_201_CREATED)
         else:
-            logger.error(f"Order creation failed with errors: {serializer.errors}")
+            logger.error("Order creation failed with errors: %s", serializer.errors)
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"Error creating order: {str(e)}")
+        logger.error("Error creating order: %s", e)
         raise
 
 
@@ -301,56 +641,177 @@ def create_order(request):
 )
 @api_view(["PUT", "PATCH"])
 def update_order(request, order_id):
-    logger.info(f"Update order endpoint accessed for order ID: {order_id}")
+    logger.info("Update order endpoint accessed for order ID: %s", order_id)
     try:
-        order = get_object_or_404(Order, id=order_id)
+        order = sharding.get_or_404(
+            sharding.with_related(
+                Order.objects.prefetch_related("order_items__product"), "user"
+            ),
+            order_id,
+        )
         partial = request.method == "PATCH"
         serializer = OrderSerializer(order, data=request.data, partial=partial)
         if serializer.is_valid():
-            updated_order = serializer.save()
-            logger.info(f"Successfully updated order ID: {order_id}")
+            was_cancelled = order.status == "cancelled"
+            with sharding.atomic(order._state.db, DEFAULT_DB_ALIAS):
+                updated_order = serializer.save()
+                # Cancelled orders are left out of the co-purchase index
+                if was_cancelled != (updated_order.status == "cancelled"):
+                    items = list(order.order_items.all())
+                    now = timezone.now()
+                    popularity.adjust_sales(
+                        order, items, 1 if was_cancelled else -1, now
+                    )
+                    product_ids = [item.product_id for item in items]
+                    if product_ids:
+                        outbox.emit(
+                            outbox.events(
+                                Products, set(product_ids), outbox.UPDATED, now
+                            )
+                        )
+                    if was_cancelled:
+                        related.add_order(product_ids)
+                    else:
+                        related.remove_order(product_ids)
+            logger.info("Successfully updated order ID: %s", order_id)
             return Response(serializer.data)
         else:
             logger.error(
-                f"Order update failed for ID {order_id} with errors: {serializer.errors}"
+                "Order update failed for ID %s with errors: %s",
+                order_id,
+                serializer.errors,
             )
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
-        logger.error(f"Error updating order {order_id}: {str(e)}")
+        logger.error("Error updating order %s: %s", order_id, e)
         raise
 
 
 @extend_schema(responses={204: None}, description="Cancel/Delete an order")
 @api_view(["DELETE"])
 def cancel_order(request, order_id):
-    logger.info(f"Cancel order endpoint accessed for order ID: {order_id}")
+    logger.info("Cancel order endpoint accessed for order ID: %s", order_id)
     try:
-        order = get_object_or_404(Order, id=order_id)
-
-        # Restore stock for cancelled orders
-        if order.status != "cancelled":
-            for order_item in order.order_items.all():
-                product = order_item.product
-                product.stock_quantity += order_item.quantity
-                product.save()
-                logger.info(
-                    f"Restored {order_item.quantity} units of {product.name} to stock"
-                )
+        # Found first, so the transaction can be opened on its shard
+        shard = sharding.locate(Order, order_id)
+        if shard is None:
+            raise Http404("No Order matches the given query.")
+        with sharding.atomic(shard, DEFAULT_DB_ALIAS):
+            order = get_object_or_404(
+                sharding.on_shard(Order.objects, shard), id=order_id
+            )
 
-            order.status = "cancelled"
-            order.save()
-            logger.info(f"Successfully cancelled order ID: {order_id}")
-        else:
-            logger.info(f"Order ID: {order_id} was already cancelled")
+            # Restore stock for cancelled orders
+            if order.status != "cancelled":
+                order_items = list(
+                    sharding.with_related(order.order_items.all(), "product")
+                )
+                if order_items:
+                    # One UPDATE for all products, relative to the current
+                    # stock and sales so concurrent orders are not overwritten
+                    now = timezone.now()
+                    Products.objects.filter(
+                        pk__in=[item.product_id for item in order_items]
+                    ).update(
+                        stock_quantity=F("stock_quantity")
+                        + Case(
+                            *[
+                                When(pk=item.product_id, then=Value(item.quantity))
+                                for item in order_items
+                            ]
+                        ),
+                        **popularity.sales_changes(order, order_items, -1, now),
+                        updated_at=now,
+                    )
+                    outbox.emit(
+                        outbox.events(
+                            Products,
+                            {item.product_id for item in order_items},
+                            outbox.UPDATED,
+                            now,
+                        )
+                    )
+                    if any(item.product.stock_quantity == 0 for item in order_items):
+                        invalidate_catalog()
+                for order_item in order_items:
+                    logger.info(
+                        "Restored %s units of %s to stock",
+                        order_item.quantity,
+                        order_item.product.name,
+                    )
+
+                order.status = "cancelled"
+                order.save()
+                related.remove_order([item.product_id for item in order_items])
+                logger.info("Successfully cancelled order ID: %s", order_id)
+            else:
+                logger.info("Order ID: %s was already cancelled", order_id)
 
         return Response(
             {"message": "Order cancelled successfully"}, status=status.HTTP_200_OK
         )
     except Exception as e:
-        logger.error(f"Error cancelling order {order_id}: {str(e)}")
+        logger.error("Error cancelling order %s: %s", order_id, e)
         raise
 
 
+@require_GET
+async def order_status_events(request):
+    """Stream status changes of one order (``?order_id=``) or of all of a
+    user's orders (``?user_id=``) as server-sent events.
+
+    A plain async view rather than a DRF one, so an open stream holds no
+    thread. Served only by the ASGI application: a WSGI server would try to
+    read the endless stream to its end.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"error": "Event streams are served by the ASGI application"},
+            status=501,
+        )
+    try:
+        order_id = int(request.GET["order_id"]) if "order_id" in request.GET else None
+        user_id = int(request.GET["user_id"]) if "user_id" in request.GET else None
+    except ValueError:
+        return JsonResponse({"error": "Invalid order_id or user_id"}, status=400)
+    if (order_id is None) == (user_id is None):
+        return JsonResponse(
+            {"error": "Pass exactly one of order_id and user_id"}, status=400
+        )
+    logger.info("Order events stream opened for %s", request.GET.dict())
+
+    orders = Order.objects.values_list("pk", "user_id", "status", "payment_status")
+    if order_id is not None:
+        try:
+            order = await sync_to_async(sharding.find)(
+                Order.objects.only("pk"), order_id
+            )
+        except Order.DoesNotExist:
+            return JsonResponse({"error": "Order not found"}, status=404)
+        topics = [order_events.order_topic(order_id)]
+
+        async def snapshot():
+            return [
+                order_events.order_state(*row)
+                async for row in sharding.on_shard(orders, order._state.db).filter(
+                    pk=order_id
+                )
+            ]
+
+    else:
+        # Only changes from here on: a user may have any number of orders
+        topics = [order_events.user_topic(user_id)]
+        snapshot = None
+
+    response = StreamingHttpResponse(
+        order_events.stream(topics, snapshot), content_type="text/event-stream"
+    )
+    # Not cached, compressed or buffered by proxies on the way
+    response["Cache-Control"] = "no-cache, no-transform"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
 # PAYMENT INTEGRATION
 
 
@@ -375,12 +836,10 @@ def cancel_order(request, order_id):
 @api_view(["POST"])
 def create_razorpay_order(request):
     payment_logger.info(
-        f"Create Razorpay order endpoint accessed with data: {request.data}"
+        "Create Razorpay order endpoint accessed with data: %s", request.data
     )
     try:
-        client = razorpay.Client(
-            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
-        )
+        client = get_razorpay_client()
 
         order_id = request.data.get("order_id")
         amount = request.data.get("amount")
@@ -395,24 +854,28 @@ def create_razorpay_order(request):
             )
 
         # Get the order from database
-        order = get_object_or_404(Order, id=order_id)
+        order = sharding.get_or_404(Order.objects, order_id)
 
         # Create Razorpay order
-        razorpay_order = client.order.create(
+        razorpay_order = call_gateway(
+            client.order.create,
             {
                 "amount": int(float(amount) * 100),  # Amount in paise
                 "currency": "INR",
                 "receipt": f"order_{order_id}",
                 "payment_capture": 1,
-            }
+            },
         )
 
         # Update order with Razorpay order ID
         order.payment_id = razorpay_order["id"]
-        order.save()
+        with transaction.atomic(using=order._state.db):
+            order.save()
 
         payment_logger.info(
-            f"Successfully created Razorpay order {razorpay_order['id']} for order ID: {order_id}"
+            "Successfully created Razorpay order %s for order ID: %s",
+            razorpay_order["id"],
+            order_id,
         )
 
         return Response(
@@ -424,6 +887,13 @@ def create_razorpay_order(request):
             }
         )
 
+    except CircuitOpenError as e:
+        payment_logger.error("Payment gateway unavailable: %s", e)
+        return Response(
+            {"error": "Payment gateway temporarily unavailable"},
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+            headers={"Retry-After": str(max(1, round(e.retry_after)))},
+        )
     except ImportError:
         payment_logger.error("Razorpay library not installed")
         return Response(
@@ -431,7 +901,7 @@ def create_razorpay_order(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
     except Exception as e:
-        payment_logger.error(f"Error creating Razorpay order: {str(e)}")
+        payment_logger.error("Error creating Razorpay order: %s", e)
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
@@ -457,9 +927,8 @@ def create_razorpay_order(request):
 def verify_razorpay_payment(request):
     payment_logger.info("Verify Razorpay payment endpoint accessed")
     try:
-        client = razorpay.Client(
-            auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
-        )
+        client = get_razorpay_client()
+        from razorpay.errors import SignatureVerificationError
 
         razorpay_payment_id = request.data.get("razorpay_payment_id")
         razorpay_order_id = request.data.get("razorpay_order_id")
@@ -467,7 +936,9 @@ def verify_razorpay_payment(request):
         order_id = request.data.get("order_id")
 
         payment_logger.info(
-            f"Payment verification attempt for order ID: {order_id}, Razorpay order: {razorpay_order_id}"
+            "Payment verification attempt for order ID: %s, Razorpay order: %s",
+            order_id,
+            razorpay_order_id,
         )
 
         if not all(
@@ -490,22 +961,24 @@ def verify_razorpay_payment(request):
             client.utility.verify_payment_signature(params_dict)
 
             # Payment verified successfully
-            order = get_object_or_404(Order, id=order_id)
+            order = sharding.get_or_404(Order.objects, order_id)
             order.payment_status = "completed"
             order.status = "confirmed"
-            order.save()
+            with transaction.atomic(using=order._state.db):
+                order.save()
 
             payment_logger.info(
-                f"Payment verified successfully for order ID: {order_id}"
+                "Payment verified successfully for order ID: %s", order_id
             )
 
             return Response(
                 {"status": "success", "message": "Payment verified successfully"}
             )
 
-        except razorpay.errors.SignatureVerificationError:
+        except SignatureVerificationError:
             payment_logger.error(
-                f"Payment verification failed for order ID: {order_id} - Invalid signature"
+                "Payment verification failed for order ID: %s - Invalid signature",
+                order_id,
             )
             return Response(
                 {"error": "Payment verification failed"},
@@ -519,5 +992,5 @@ def verify_razorpay_payment(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR,
         )
     except Exception as e:
-        payment_logger.error(f"Error verifying payment: {str(e)}")
+        payment_logger.error("Error verifying payment: %s", e)
         return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)